@@ -2,28 +2,40 @@
 Ballot images. It is designed to be easy to use and easy to extend.
 """
 import os
+import sys
 import math
+import struct
+import array
+import errno
+import fcntl
+from contextlib import contextmanager
 from xml.dom import minidom
 from xml.parsers.expat import ExpatError
 import logging
+from collections import OrderedDict
 import site; site.addsitedir(os.path.expanduser("~/tevs")) #XXX
-from cropstats import cropstats
+from cropstats import cropstats, batch_cropstats
 import Image, ImageDraw, ImageFont, ImageChops
 import const
 import util
 import ocr
 import adjust
+import composite
+import projection
+import deskew
+import pyramid
+import metrics
 import pdb
 
 __all__ = [
     'BallotException', 'LoadBallotType', 'Ballot', 'DuplexBallot', 'IStats',
     'VoteData', 'results_to_CSV', 'results_to_mosaic', 'Choice', 'VOP', 
     'WriteIn', 'Jurisdiction', 'Contest', 'Page', 'Template',
-    'Template_to_XML', 'Template_from_XML', 'TemplateCache', 'NullCache',
+    'Template_to_XML', 'Template_from_XML', 'Template_to_binary',
+    'Template_from_binary', 'Template_from_data', 'TemplateCache', 'NullCache',
     'IsVoted', 'IsWriteIn', 'Extensions',
 ]
 
-composite_counts_dict = {}
 
 class BallotException(Exception):
     "Raised if analysis of a ballot image cannot continue"
@@ -48,6 +60,50 @@ def LoadBallotType(name):
     name = name[0].upper() + name[1:] + "Ballot"
     return getattr(module, name)
 
+def image_mode(kind):
+    """Return the PIL mode pages of the Ballot subclass kind are held in:
+    "L", just the red channel of each pixel, if const.single_channel is set
+    and kind supports it, otherwise "RGB"."""
+    if getattr(const, "single_channel", False) and kind.single_channel:
+        return "L"
+    return "RGB"
+
+def _rgb(im):
+    "im, or a copy of im in RGB if it is not already"
+    if im.mode != "RGB":
+        return im.convert("RGB")
+    return im
+
+def open_image(image, mode="RGB"):
+    """Return (filename, image) for image, which is either the filename of an
+    image to open or a (filename, image) pair of an already opened image. The
+    image returned is loaded and in mode, either "RGB" or "L". An "L" image
+    holds only the red channel of the original."""
+    if isinstance(image, basestring):
+        fname, im = image, None
+    else:
+        fname, im = image
+    try:
+        if im is None:
+            with metrics.timer("open_image"):
+                im = Image.open(fname)
+                im.load()
+        if im.mode == mode:
+            im.load()
+            return fname, im
+        if im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        if mode == "L" and im.mode == "RGB":
+            # keep red alone, as most analysis only ever looks at red
+            im = im.convert("L", (1, 0, 0, 0))
+        elif mode == "RGB" and im.mode == "L":
+            im = im.convert("RGB")
+        return fname, im
+    except KeyboardInterrupt:
+        raise
+    except IOError:
+        raise BallotException("Could not open %s", fname)
+
 class Ballot(object):
     """A Ballot takes a set of images and an Extension object. The set of
     images can be described as either a string representing the filename of a
@@ -56,7 +112,14 @@ class Ballot(object):
 
     When the ballot is created, it attempts to open all of the files given to
     it via PIL. It also attempts to flip the images (see the flip method below)
-    It builds a list of Page encapsulating the images.
+    It builds a list of Page encapsulating the images. In place of any of the
+    filenames, a (filename, image) pair of an image that has already been
+    opened, such as by prefetch.Prefetcher, may be given.
+
+    Pages are RGB unless the subclass sets single_channel, meaning that it
+    reads pixels only through util.red or ImageStat band 0, and
+    const.single_channel is set. Then pages are held as "L" images of the
+    red channel alone, a third of the size; see image_mode.
 
     The Ballot class cannot be used directly. It must be used via a subclass
     that implements the required abstract methods (documented below). However,
@@ -76,31 +139,28 @@ class Ballot(object):
         * self.log - a useful reference to the default logger, see the Python
           logging module.
     """
+    single_channel = False
+
     def __init__(self, images, extensions):
-        #TODO should also take list of (fname, image) pairs 
-        def iopen(fname):
-            try:
-                return self.flip(Image.open(fname).convert("RGB"))
-            except BallotException:
-                raise
-            except KeyboardInterrupt:
-                raise
-            except IOError:
-                raise BallotException("Could not open %s", fname)
+        mode = image_mode(type(self))
+        def iopen(image):
+            fname, im = open_image(image, mode)
+            return fname, self.flip(im)
 
         self.pages = []
-        def add_page(number, fname):
+        def add_page(number, image):
+            fname, im = iopen(image)
             self.pages.append(Page(
                 ballot=self,
                 dpi=const.dpi,
                 filename=fname,
-                image=iopen(fname),
+                image=im,
                 number=number,
             ))
 
         if not isinstance(images, basestring):
-            for i, fname in enumerate(images):
-                add_page(i, fname)
+            for i, image in enumerate(images):
+                add_page(i, image)
         else: #just a filename
             add_page(0, images)
 
@@ -186,11 +246,13 @@ class Ballot(object):
         try:
             return self.laycode_cache[page.number]
         except KeyError:
-            lc = self.get_layout_code(page)
+            with metrics.timer("GetLayoutCode"):
+                lc = self.get_layout_code(page)
             self.laycode_cache[page.number] = lc
             page.barcode = lc
             return lc
 
+    @metrics.timed("FindLandmarks")
     def FindLandmarks(self, page=0):
         """Find and record the landmarks for this page so that we can compute
         the locations of VOPs from the layout. A landmark is any identifying
@@ -216,6 +278,7 @@ class Ballot(object):
             r, x, y, y2y = 0,0,0,1
         return r, x, y, y2y
 
+    @metrics.timed("BuildLayout")
     def BuildLayout(self, page=0):
         """Create a Template from a Page. The Template contains all of the
         layout information and textual descriptions of any page with the same
@@ -231,98 +294,33 @@ class Ballot(object):
         from the specified Page. 
         
         If it cannot build a sensible layout, it will raise a BallotException.
+
+        Only one process sharing a template cache builds the template for a
+        layout code. Any other that needs it waits for that build to finish
+        and uses its template.
         """
+        code = self.GetLayoutCode(self._page(page))
+        cache = self.extensions.template_cache
+        if cache[code] is not None:
+            metrics.count("template_cache", result="hit")
+            return self._BuildLayout(page, code)
+        metrics.count("template_cache", result="miss")
+        with cache.building(code):
+            return self._BuildLayout(page, code)
+
+    def _BuildLayout(self, page, code):
         pagenum = page
         page = self._page(page)
-        code = self.GetLayoutCode(page)
         tmpl = self.extensions.template_cache[code]
 
         if tmpl is not None:
             if const.save_composite_images:
-                # need to retrieve composite image if it exists,
-                try:
-                    oldimage = Image.open("%s/%s%d/%s.jpg" % (
-                            util.root(),
-                            "composite_images",os.getpid(),
-                            tmpl.barcode))
-                except:
-                    try:
-                        oldimage = Image.open("%s/%s%d/%s.jpg" % (
-                                util.root(),
-                                "template_images",os.getpid(),
-                                tmpl.barcode))
-                    except:
-                        oldimage = None
-
-                # else retrieve template image
-                # derotate the new image as if you were building a template
-                r2d = 180/3.14
-                #pdb.set_trace()
-                #page.image.save("/tmp/prerotate.jpg")
-                newimage = page.image.rotate(-r2d * page.rot, Image.BILINEAR)
-                #page.image.save("/tmp/postrotate.jpg")
-                if oldimage is None: oldimage = newimage
-                # landmarks will change once image is derotated!
-                try:
-                    self.FindLandmarks(pagenum)
-                except BallotException:
-                    pass
-                # translate the new image to align with composite image
-                delta_x = tmpl.xoff - page.xoff 
-                delta_y = tmpl.yoff - page.yoff
-
-                newimage = newimage.offset(delta_x,delta_y)
-                #newimage.save("/tmp/posttranslate.jpg")
-                # apply darker operation, save result in first argument?
-                oldimage.load()
-                oldr,oldg,oldb = oldimage.split()
-                newr,newg,newb = newimage.split()
-                    # count dark pixels in oldr excluding edges
-                oldr_crop = oldr.crop((const.dpi/4,
-                                       const.dpi/4,
-                                       min(oldr.size[0],newr.size[0]) 
-                                       - (const.dpi/4),
-                                       min(oldr.size[1],newr.size[1]) 
-                                       - (const.dpi/4)))
-                old_total_intensity = 0
-                for p in oldr_crop.getdata():
-                    old_total_intensity += p
-                newr = ImageChops.darker(oldr,newr)
-                newg = ImageChops.darker(oldg,newg)
-                newb = ImageChops.darker(oldb,newb)
-                new_total_intensity = 0
-                    # count dark pixels in newr excluding edges
-                newr_crop = newr.crop((const.dpi/4,
-                                       const.dpi/4,
-                                       min(newr.size[0],oldr.size[0]) 
-                                       - (const.dpi/4),
-                                       min(newr.size[1],oldr.size[1]) 
-                                       - (const.dpi/4)))
-                new_total_intensity = 0
-                for p in newr_crop.getdata():
-                    new_total_intensity += p
-                self.log.info("%s Old %d New %d Diff %d" % (
-                        os.path.basename(page.filename),
-                        old_total_intensity,
-                        new_total_intensity,
-                        old_total_intensity - new_total_intensity))
-                newimage = Image.merge("RGB",(newr,newg,newb))
-                try:
-                    composite_counts_dict[tmpl.barcode] += 1
-                    if 0==(composite_counts_dict[tmpl.barcode]%5):
-                        self.log.info("Composite count for %s now %d \
-(this run only)" % (
-                                tmpl.barcode,
-                                composite_counts_dict[tmpl.barcode]
-                                ))
-                except:
-                    composite_counts_dict[tmpl.barcode] = 1
-                newimage.save("%s/%s%d/%s.jpg" % (
-                            util.root(),
-                            "composite_images",os.getpid(),
-                            tmpl.barcode))
-                # save result as composite
-                pass
+                # derotate the new image as if you were building a template,
+                # with its landmark where the template has it
+                newimage = deskew.align(page.image, page.rot,
+                    (page.xoff, page.yoff), (tmpl.xoff, tmpl.yoff))
+                composite.composites().add(
+                    tmpl.barcode, newimage, page.filename)
             page.template = tmpl
             return tmpl
 
@@ -332,9 +330,10 @@ class Ballot(object):
         )
         # derotate image before trying to build layout.
         # page.rot is tangent, equiv to rot in radians for small values
-        # convert to degrees for call to Image.rotate
-        r2d = 180/3.14
-        page.image = page.image.rotate(-r2d * page.rot, Image.BILINEAR)
+        # The whole page is rotated, once per layout code: every vendor's
+        # build_layout reads pixels all over page.image, and the template
+        # image is saved whole.
+        page.image = deskew.deskew(page.image, page.rot)
         # landmarks will change once image is derotated!
         try:
             self.FindLandmarks(pagenum)
@@ -368,6 +367,7 @@ class Ballot(object):
             _ocr1(self.extensions, page, subtree)
         return tree
 
+    @metrics.timed("CapturePageInfo")
     def CapturePageInfo(self, page=0):
         """
         CapturePageInfo walks the layout and creates a VoteData object for each
@@ -425,16 +425,24 @@ AT PAGE
             if page.template.precinct is not None and len(page.template.precinct)>0: 
                 kw["barcode"]=page.template.precinct
             results.append(VoteData(**kw))
+        # extract every VOP on the page in one go, skipping contests too
+        # short to be real
+        short = lambda contest: (int(contest.y2) - int(contest.y) <
+            self.min_contest_height) #XXX only defined insubclass!!!!!!
+        choices = []
         for contest in page.template.contests:
-            if int(contest.y2) - int(contest.y) < self.min_contest_height: #XXX only defined insubclass!!!!!!
+            if not short(contest):
+                choices.extend(contest.choices)
+        vops = iter(self.extract_VOPs(page, T, scale, choices))
+
+        for contest in page.template.contests:
+            if short(contest):
                 for choice in contest.choices:
                      append(contest, choice) #mark all bad
                 continue
 
             for choice in contest.choices:
-                x, y, stats, crop, voted, writein, ambiguous = self.extract_VOP(
-                    page, T, scale, choice
-                )
+                x, y, stats, crop, voted, writein, ambiguous = vops.next()
                 append(contest, choice, 
                     coords=(x, y), stats=stats, image=crop,
                     is_writein=writein, was_voted=voted, 
@@ -471,32 +479,7 @@ template offsets (%d,%d) margins(%d,%d)" % (
         x, y = rotatefunc(x, y, scale)
         self.log.debug("Result after rotatefunc: (%d,%d)" % (x,y))
         cropx, cropy = x, y 
-        # provide for calling of further adjustment function, 
-        # if one is defined in subclass
-        vla_present = False
-        try:
-            self.vendor_level_adjustment
-            vla_present = True
-        except AttributeError:
-            pass
-        if vla_present == True:
-            in_x = x
-            in_y = y
-            x,y = self.vendor_level_adjustment(
-                page,
-                page.image,
-                x - margin_width,
-                y - margin_width,
-                ow + (2*margin_width),
-                oh + (2*margin_height))
-            if abs(in_x - x) > margin_width or abs(in_y - y) > margin_height:
-                self.log.info(
-                    "LARGE vendor level adjustment; x %d to %d, y %d adjusted to %d" 
-                    % (in_x,x,in_y,y)
-                    )
-            else:
-                self.log.debug("Vendor level adjustment: x %d to %d, y %d adjusted to %d" 
-                    % (in_x,x,in_y,y))
+        x, y = self._vendor_adjust(page, x, y)
         crop = page.image.crop((
             cropx - margin_width,
             cropy - margin_height,
@@ -520,6 +503,100 @@ template offsets (%d,%d) margins(%d,%d)" % (
 
         return cropx, cropy, stats, crop, voted, 0, ambiguous
 
+    def _vendor_adjust(self, page, x, y):
+        """provide for calling of further adjustment function, if one is
+        defined in subclass"""
+        try:
+            vla = self.vendor_level_adjustment
+        except AttributeError:
+            return x, y
+        margin_width = page.margin_width 
+        margin_height = page.margin_height 
+        ow = page.target_width
+        oh = page.target_height
+        in_x = x
+        in_y = y
+        x,y = vla(
+            page,
+            page.image,
+            x - margin_width,
+            y - margin_width,
+            ow + (2*margin_width),
+            oh + (2*margin_height))
+        if abs(in_x - x) > margin_width or abs(in_y - y) > margin_height:
+            self.log.info(
+                "LARGE vendor level adjustment; x %d to %d, y %d adjusted to %d" 
+                % (in_x,x,in_y,y)
+                )
+        else:
+            self.log.debug("Vendor level adjustment: x %d to %d, y %d adjusted to %d" 
+                % (in_x,x,in_y,y))
+        return x, y
+
+    def extract_VOPs(self, page, rotatefunc, scale, choices):
+        """Extract every choice in choices from the specified ballot, returning
+        a list of what extract_VOP would return for each.
+
+        If a subclass overrides extract_VOP, this simply calls it for each
+        choice. Otherwise the coordinates of all of the choices are
+        transformed together and their statistics are all taken from a
+        single read of the page image. Crops of the VOPs are only made if
+        they are going to be saved (const.save_vops) or if IsVoted or
+        IsWriteIn have been replaced by ones that may look at them;
+        otherwise the crop in each result is None."""
+        if type(self).extract_VOP.im_func is not Ballot.extract_VOP.im_func:
+            return [self.extract_VOP(page, rotatefunc, scale, choice)
+                for choice in choices]
+        iround = lambda x: int(round(x))
+        margin_width = page.margin_width 
+        margin_height = page.margin_height 
+        ow = page.target_width
+        oh = page.target_height
+        # adjust x and y for the shift of landmark between template and ballot
+        scaled_page_offset_x = page.xoff/scale
+        scaled_page_offset_y = page.yoff/scale
+        xs = [iround(choice.x + scaled_page_offset_x - page.template.xoff)
+            for choice in choices]
+        ys = [iround(choice.y + scaled_page_offset_y - page.template.yoff)
+            for choice in choices]
+        try:
+            xs, ys = rotatefunc.points(xs, ys, scale)
+        except AttributeError:
+            pts = [rotatefunc(x, y, scale) for x, y in zip(xs, ys)]
+            xs, ys = [p[0] for p in pts], [p[1] for p in pts]
+
+        boxes, coords = [], []
+        for cropx, cropy in zip(xs, ys):
+            boxes.append((
+                cropx - margin_width,
+                cropy - margin_height,
+                cropx + (2*margin_width) + ow,
+                cropy + (2*margin_height) + oh
+            ))
+            coords.append(self._vendor_adjust(page, cropx, cropy))
+        self.log.debug("Extracting %d VOPs from %s" % (
+            len(boxes), page.filename))
+
+        keep_crops = (
+            getattr(const, "save_vops", True) or
+            self.extensions.IsVoted is not IsVoted or
+            self.extensions.IsWriteIn is not IsWriteIn
+        )
+        results = []
+        allstats = batch_cropstats(page.image, boxes, coords)
+        for choice, box, s in zip(choices, boxes, allstats):
+            crop = None
+            if keep_crops:
+                crop = page.image.crop(box)
+            stats = IStats(s)
+            voted, ambiguous = self.extensions.IsVoted(crop, stats, choice)
+            writein = self.extensions.IsWriteIn(crop, stats, choice)
+            results.append((
+                box[0] + margin_width, box[1] + margin_height,
+                stats, crop, voted, 0, ambiguous
+            ))
+        return results
+
     def flip(self, im):
         """This method applies any 90 or 180 degree transformation required to 
         make im read top to bottom, left to right.
@@ -631,8 +708,8 @@ class DuplexBallot(Ballot):
     if neither landmarks nor layoutcodes betray a testable difference. All
     three of these may be used in accord, or none may be used.
 
-    DuplexBallot must be given an iterable of image names that must be of even
-    length.
+    DuplexBallot must be given an iterable of image names, or (name, image)
+    pairs as for Ballot, that must be of even length.
 
     """
     def __init__(self, images, extensions):
@@ -643,16 +720,13 @@ class DuplexBallot(Ballot):
             raise TypeError("Requires an even number of ballot images")
         self.pages = []
         number = 0
-        for fnames in zip(images[::2], images[1::2]):
-            try:
-                f = self.flip_front(Image.open(fnames[0]).convert("RGB"))
-                b = self.flip_back(Image.open(fnames[1]).convert("RGB"))
-            except BallotException:
-                raise
-            except KeyboardInterrupt:
-                raise
-            except IOError:
-                raise BallotException("Could not open one of %s", fnames)
+        mode = image_mode(type(self))
+        for pair in zip(images[::2], images[1::2]):
+            ffname, f = open_image(pair[0], mode)
+            bfname, b = open_image(pair[1], mode)
+            fnames = ffname, bfname
+            f = self.flip_front(f)
+            b = self.flip_back(b)
             if not self.is_front(f):
                 if not self.is_front(b):
                     raise BallotException(
@@ -724,6 +798,7 @@ class DuplexBallot(Ballot):
             front, _ = self._swap(page)
             return self._GetLayoutCode(front)
 
+    @metrics.timed("FindLandmarks")
     def FindLandmarks(self, page=0):
         """returns ((rf, rx, ry), (rb, rx, ry))
         If find_front_landmarks raises an error, FindLandmarks will swap the
@@ -754,91 +829,35 @@ class DuplexBallot(Ballot):
         page.template = tmpl
         return tmpl
 
+    @metrics.timed("BuildLayout")
     def BuildLayout(self, page=0):
-        "returns (front_layout, back_layout)"
-        front, back = self._page(page)
+        """returns (front_layout, back_layout), building them under the
+        template cache's lock for the layout code as in Ballot.BuildLayout"""
         lc = self.GetLayoutCode(page)
+        cache = self.extensions.template_cache
+        _, back = self._page(page)
+        # a blank back has no template to build, so cannot be missing one
+        if cache[lc] is not None and (back.blank
+                or cache["%sback" % (lc,)] is not None):
+            metrics.count("template_cache", result="hit")
+            return self._BuildLayout(page, lc)
+        metrics.count("template_cache", result="miss")
+        with cache.building(lc):
+            return self._BuildLayout(page, lc)
+
+    def _BuildLayout(self, page, lc):
+        front, back = self._page(page)
         ft = self.extensions.template_cache[lc]
         bt = self.extensions.template_cache["%sback" % (lc,)]
-        if ft is not None:
-            # given that templates exist...
-            pagenum = 0 
-            for t in (ft,bt):
-                try:
-                    t.barcode
-                except:
+        if ft is not None and const.save_composite_images:
+            # given that templates exist, derotate each page as if building
+            # a template, with its landmark where the template has it
+            for p, t in ((front, ft), (back, bt)):
+                if t is None or p.blank:
                     continue
-                if const.save_composite_images:
-                    # need to retrieve composite image if it exists,
-                    try:
-                        oldimage = Image.open("%s/%s%d/%s.jpg" % (
-                                util.root(),
-                                "composite_images",os.getpid(),
-                                t.barcode))
-                    except:
-                        oldimage = Image.open("%s/%s%d/%s.jpg" % (
-                                util.root(),
-                                "template_images",os.getpid(),
-                                t.barcode))
-                    # else retrieve template image
-                    # derotate the new image as if you were building a template
-                    r2d = 180/3.14
-                    #page[pagenum].image.save("/tmp/prerotate.jpg")
-                    page[pagenum].image = page[pagenum].image.rotate(
-                        -r2d * page[pagenum].rot, 
-                         Image.BILINEAR)
-                    #page[pagenum].image.save("/tmp/postrotate.jpg")
-                    # landmarks will change once image is derotated!
-                    try:
-                        self.FindLandmarks(page)
-                    except BallotException:
-                        page[pagenum].blank = True
-                    # translate the new image to align with composite image
-                    delta_x = t.xoff - page[pagenum].xoff 
-                    delta_y = t.yoff - page[pagenum].yoff
-
-                    newimage = page[pagenum].image.offset(delta_x,delta_y)
-                    #newimage.save("/tmp/postranslate.jpg")
-                    # apply darker operation, save result in first argument?
-                    oldimage.load()
-                    oldr,oldg,oldb = oldimage.split()
-                    newr,newg,newb = newimage.split()
-                    # count dark pixels in oldr excluding edges
-                    oldr_crop = oldr.crop((const.dpi/4,
-                                           const.dpi/4,
-                                           min(oldr.size[0],newr.size[0]) 
-                                           - (const.dpi/4),
-                                           min(oldr.size[1],newr.size[1]) 
-                                           - (const.dpi/4)))
-                    old_total_intensity = 0
-                    for p in oldr_crop.getdata():
-                        old_total_intensity += p
-                    newr = ImageChops.darker(oldr,newr)
-                    # count dark pixels in newr excluding edges
-                    newr_crop = oldr.crop((const.dpi/4,
-                                           const.dpi/4,
-                                           min(newr.size[0],oldr.size[0]) 
-                                           - (const.dpi/4),
-                                           min(newr.size[1],oldr.size[1]) 
-                                           - (const.dpi/4)))
-                    new_total_intensity = 0
-                    for p in newr_crop.getdata():
-                        new_total_intensity += p
-                    self.log.info("%s Old %d New %d Diff %d" % (
-                            os.path.basename(page[pagenum].filename),
-                            old_total_intensity,
-                            new_total_intensity,
-                            old_total_intensity - new_total_intensity))
-                    newg = ImageChops.darker(oldg,newg)
-                    newb = ImageChops.darker(oldb,newb)
-                    newimage = Image.merge("RGB",(newr,newg,newb))
-                    newimage.save("%s/%s%d/%s.jpg" % (
-                                util.root(),
-                                "composite_images",os.getpid(),
-                                t.barcode))
-                    pagenum += 1
-                    # save result as composite
-                    pass
+                newimage = deskew.align(p.image, p.rot,
+                    (p.xoff, p.yoff), (t.xoff, t.yoff))
+                composite.composites().add(t.barcode, newimage, p.filename)
 
         if ft is not None:
             front.template = ft
@@ -856,6 +875,7 @@ class DuplexBallot(Ballot):
         return ft, bt
 
     #CapturePageInfo can just call super, but must make sure template is built first
+    @metrics.timed("CapturePageInfo")
     def CapturePageInfo(self, page=0):
         "returns list of results of both pages processed"
         front, back = self._page(page)
@@ -911,6 +931,8 @@ class _bag(object):
         return repr(self.__dict__)
 
 class IStats(object): #TODO move to cropstats or new pilb module
+    """The statistics of a vote op as returned by cropstats. On single
+    channel pages, green and blue are the same as red."""
     def __init__(self, stats):
        self.red, self.green, self.blue = _bag(), _bag(), _bag()
        self.adjusted = _bag()
@@ -962,7 +984,7 @@ class IStats(object): #TODO move to cropstats or new pilb module
                 self.red.third_fourth +
                 self.blue.darkest_fourth  + self.blue.second_fourth  +
                 self.blue.third_fourth +
-                self.green.darkest_fourth + self.green.second_fourth
+                self.green.darkest_fourth + self.green.second_fourth +
                 self.green.third_fourth 
                )/3.0
            ))
@@ -1352,6 +1374,10 @@ class Page(_scannedPage):
        * self.xoff - the x offset of the ballot within the ballot image
        * self.yoff - the y offset of the ballot within the ballot image
        * self.rot - the rotation of the ballot within the ballot image
+       * self.profiles - the projection.Profiles of self.image, computed as
+          needed and kept for as long as self.image is unchanged
+       * self.pyramid - the pyramid.Pyramid of self.image, likewise, used by
+          self.locate to search for landmarks from coarse to fine
 
     Note that self.rot is in radians, which is used by python's math library,
     but that the rotate method in PIL uses degrees.
@@ -1365,6 +1391,8 @@ class Page(_scannedPage):
         self.blank = False
         self.barcode = ""
         self.landmarks = []
+        self._profiles = None
+        self._pyramid = None
         # the standard size and margin of vote targets, converted to pixels
         adj = lambda a: int(round(float(const.dpi) * a))
         try:
@@ -1384,6 +1412,55 @@ class Page(_scannedPage):
             raise AttributeError(e + " and is required in the tevs.cfg file.")
             print e
 
+    @property
+    def profiles(self):
+        self._profiles = projection.of(self.image, self._profiles)
+        return self._profiles
+
+    @property
+    def pyramid(self):
+        self._pyramid = pyramid.of(self.image, self._pyramid)
+        return self._pyramid
+
+    def locate(self, search, box, window=None, factors=None):
+        """Find a landmark in box, a list of left, upper, right, lower, of
+        self.image from coarse to fine. search(image, box, dpi) returns the
+        x, y of the landmark in box of image, an image at dpi, or returns
+        None or raises BallotException if it is not there.
+
+        search is called on the coarsest level of self.pyramid, or of
+        factors if given, then on each finer level only within window pixels
+        (by default 1/10") of where the level before found the landmark,
+        ending with self.image.
+        If any level does not find it, box is searched at full resolution
+        after all, so that a landmark the coarse levels cannot make out is
+        still found as without them."""
+        dpi = self.dpi or const.dpi
+        if window is None:
+            window = dpi/10
+        if factors is None:
+            factors = self.pyramid.factors
+        found = None
+        for factor in sorted(factors, reverse=True) + [1]:
+            if found is None:
+                region = [v/factor for v in box]
+            else:
+                x, y = found
+                region = [max(x - window, box[0])/factor,
+                          max(y - window, box[1])/factor,
+                          min(x + window, box[2])/factor,
+                          min(y + window, box[3])/factor]
+            try:
+                found = search(self.pyramid.level(factor), region, dpi/factor)
+            except BallotException:
+                found = None
+            if found is None:
+                break
+            found = found[0]*factor, found[1]*factor
+        else:
+            return found
+        return search(self.image, list(box), dpi)
+
     def as_template(self, barcode, contests, precinct=None, party=None, frompage=None):
         """Given the barcode and contests, convert this page into a Template
         and store that objects as its own template. This is handled by
@@ -1540,38 +1617,156 @@ def Template_from_XML(xml): #XXX needs to be updated for jurisdictions
 
     return Template(dpi, xoff, yoff, rot, barcode, contests, y2y=y2y)
 
+#Binary templates: a header, a table of every distinct string in the
+#template, then the contests and choices as arrays of little endian ints,
+#with strings given by their position in the table.
+_tmpl_magic = "TEVSTMPL"
+_tmpl_version = 1
+_tmpl_header = struct.Struct("<8sHiiidiIII")
+
+def _tmpl_ints(values):
+    "an array of values as little endian ints, bad values as 0 as in XML"
+    def toint(v):
+        try:
+            return int(v)
+        except (TypeError, ValueError):
+            return 0
+    a = array.array("i", (toint(v) for v in values))
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a
+
+def Template_to_binary(template): #XXX needs to be updated for jurisdictions
+    """Takes a template object and returns a compact serialization of it, the
+    same information as Template_to_XML in a form that is much quicker to
+    read back with Template_from_binary"""
+    strings, interned = [], {}
+    def intern(s):
+        if s is None:
+            s = "None" #as Template_to_XML would write it
+        if isinstance(s, unicode):
+            s = s.encode("utf-8")
+        else:
+            s = str(s)
+        if s not in interned:
+            interned[s] = len(strings)
+            strings.append(s)
+        return interned[s]
+
+    intern(template.barcode)
+    contests, choices = [], []
+    for contest in template.contests:
+        contests.extend((contest.x, contest.y, contest.x2, contest.y2,
+            intern(contest.prop), intern(contest.description),
+            len(contest.choices)))
+        for choice in contest.choices:
+            choices.extend((choice.x, choice.y, intern(choice.description)))
+
+    lengths = _tmpl_ints(len(s) for s in strings)
+    return "".join((
+        _tmpl_header.pack(_tmpl_magic, _tmpl_version, template.dpi,
+            template.xoff, template.yoff, template.rot, template.y2y,
+            len(strings), len(contests)/7, len(choices)/3),
+        lengths.tostring(),
+        "".join(strings),
+        _tmpl_ints(contests).tostring(),
+        _tmpl_ints(choices).tostring(),
+    ))
+
+def Template_from_binary(data): #XXX needs to be updated for jurisdictions
+    """Takes a string generated from Template_to_binary and returns a
+    Template. Raises ValueError if data is not a binary template of a version
+    this code understands."""
+    try:
+        (magic, version, dpi, xoff, yoff, rot, y2y,
+            nstrings, ncontests, nchoices) = _tmpl_header.unpack_from(data)
+    except struct.error:
+        raise ValueError("not a binary template")
+    if magic != _tmpl_magic or version != _tmpl_version:
+        raise ValueError("not a version %d binary template" % _tmpl_version)
+
+    at = [_tmpl_header.size]
+    def ints(n):
+        a = array.array("i")
+        end = at[0] + n*a.itemsize
+        if end > len(data):
+            raise ValueError("truncated binary template")
+        a.fromstring(data[at[0]:end])
+        if sys.byteorder == "big":
+            a.byteswap()
+        at[0] = end
+        return a
+
+    strings = []
+    for n in ints(nstrings):
+        strings.append(data[at[0]:at[0] + n].decode("utf-8", "replace"))
+        at[0] += n
+    contests = ints(7*ncontests)
+    choices = ints(3*nchoices)
+
+    parsed, c = [], 0
+    for i in range(0, len(contests), 7):
+        x, y, x2, y2, prop, text, n = contests[i:i + 7]
+        cur = Contest(x, y, x2, y2, strings[prop], strings[text])
+        for j in range(c, c + 3*n, 3):
+            cur.append(Choice(choices[j], choices[j + 1],
+                strings[choices[j + 2]]))
+        c += 3*n
+        parsed.append(cur)
+
+    return Template(dpi, xoff, yoff, rot, strings[0], parsed, y2y=y2y)
+
+def Template_from_data(data):
+    """Returns the Template serialized in data by either Template_to_binary
+    or Template_to_XML. Raises ValueError if it is neither."""
+    if data.startswith(_tmpl_magic):
+        return Template_from_binary(data)
+    try:
+        return Template_from_XML(data)
+    except ExpatError as e:
+        raise ValueError(str(e))
+
 BlankTemplate = Template(0, 0, 0, 0.0, "blank", [])
 
 class TemplateCache(object):
     """A TemplateCache stores Templates by their barcode and loads and saves
-    them in a directory location. When instantiated, it loads all templates
-    into ram for quick access. It does not automatically save templates, but
-    provides methods for saving them. It uses Template_to_XML/Template_from_XML
-    for the serialization and deserialization of the template. For storing and
-    retrieving templates from the cache it behaves as a standard dictionary.
+    them in a directory location. It does not automatically save templates,
+    but provides methods for saving them. It saves templates with
+    Template_to_XML, or Template_to_binary if binary is True, and reads
+    templates in either format. For storing and retrieving templates from
+    the cache it behaves as a standard dictionary.
+
+    Templates are only read from disk when first asked for, and at most size
+    of them are kept in ram, dropping the least recently used (size None
+    keeps them all).
     """
-    def __init__(self, location):
-        self.cache = {}
+    def __init__(self, location, size=None, binary=False):
+        self.cache = OrderedDict()
         self.location = location
+        self.size = size
+        self.binary = binary
         util.mkdirp(location)
         self.log = logging.getLogger('')
-        #attempt to prepopulate cache
+        self.lock_dir = os.path.normpath(location) + ".locks"
+
+    def _load(self, id):
+        "parse template id from disk, None if there is none"
+        fname = os.path.join(self.location, id)
+        if not os.path.exists(fname):
+            return None
+        data = util.readfrom(fname, "<") #default to text that will not parse
         try:
-            for file in os.listdir(location):
-                if os.path.splitext(file)[1] == ".jpg":
-                    continue
-                rfile = os.path.join(location, file)
-                data = util.readfrom(rfile, "<") #default to text that will not parse
-                try:
-                    tmpl = Template_from_XML(data)
-                except ExpatError:
-                    if data != "<":
-                        self.log.exception("Could not parse " + file)
-                    continue
-                fname = os.path.basename(file)
-                self.cache[fname] = tmpl
-        except OSError:
-            self.log.info("No templates found")
+            return Template_from_data(data)
+        except ValueError:
+            if data != "<":
+                self.log.exception("Could not parse " + id)
+            return None
+
+    def _keep(self, id, template):
+        self.cache[id] = template
+        if self.size is not None:
+            while len(self.cache) > self.size:
+                self.cache.popitem(last=False)
 
     def __call__(self, id):
         return self.__getitem__(id)
@@ -1581,30 +1776,43 @@ class TemplateCache(object):
         if id == "blank":
             return BlankTemplate
         try:
-            return self.cache[id]
+            template = self.cache.pop(id)
         except KeyError:
-            self.log.info("No template found for %s", id)
-            return None
+            template = self._load(id)
+            if template is None:
+                self.log.info("No template found for %s", id)
+                return None
+        self._keep(id, template)
+        return template
 
     def __setitem__(self, id, template):
         id = str(id)
         if id == "blank":
             return
-        self.cache[id] = template
+        self.cache.pop(id, None)
+        self._keep(id, template)
         self.log.info("Template %s created", id)
         # always save template upon creation
-        self.save(id)
+        self.save(id, template)
 
-    def save(self, id):
-        id = str(id)
+    def save(self, id, template=None):
         "write the template id to disk at self.location"
+        id = str(id)
         fname = os.path.join(self.location, id)
         if not os.path.exists(fname):
-            template = self.cache[id]
+            if template is None:
+                template = self.cache[id]
             if template is None:
                 return
-            xml = Template_to_XML(template)
-            util.writeto(fname, xml)
+            if self.binary:
+                data = Template_to_binary(template)
+            else:
+                data = Template_to_XML(template)
+            # other processes read templates without locking, so they must
+            # never see one half written
+            tmp = "%s.%d" % (fname, os.getpid())
+            util.writeto(tmp, data)
+            os.rename(tmp, fname)
             if template.image is not None:
                 try:
                     im = _fixup(
@@ -1620,9 +1828,44 @@ class TemplateCache(object):
 
     def save_all(self):
         "save all templates that are not already saved"
-        for id in self.cache.iterkeys():
+        for id in self.cache.keys():
             self.save(id)
 
+    @contextmanager
+    def building(self, id):
+        """Hold the lock for building template id for the duration of a with
+        block. Every process using the same location takes the same lock, so
+        only one at a time builds a given template; the others wait and then
+        find the template the first one saved. The lock file is removed
+        once the template is built."""
+        util.mkdirp(self.lock_dir)
+        lock = os.path.join(self.lock_dir, str(id))
+        while True:
+            f = open(lock, "a")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    f.close()
+                    raise
+                self.log.info("Waiting for template %s to be built", id)
+                fcntl.flock(f, fcntl.LOCK_EX)
+            # the holder we waited for may have removed the file, in which
+            # case a newcomer could be locking a new one: start again
+            try:
+                if os.fstat(f.fileno()).st_ino == os.stat(lock).st_ino:
+                    break
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    f.close()
+                    raise
+            f.close()
+        try:
+            yield
+        finally:
+            util.rmf(lock) #while still locked, so no one else holds it
+            f.close()
+
 class NullTemplateCache(object):
     "A Template Cache that is a no-op for all methods"
     def __init__(self, loc):
@@ -1636,6 +1879,9 @@ class NullTemplateCache(object):
         pass
     def save(self):
         pass
+    @contextmanager
+    def building(self, id):
+        yield
 
 NullCache = NullTemplateCache("") #used as the default
 
@@ -1670,7 +1916,7 @@ class Extensions(object):
     All extensions must be in the _xpts dict below and must be
     callable"""
     _xpts = {
-        "ocr_engine":     ocr.tesseract,#_with_prefix_and_postfix, 
+        "ocr_engine":     ocr.tesseract_pool,#_with_prefix_and_postfix, 
         "ocr_cleaner":    ocr.clean_ocr_text,
         "template_cache": NullCache,
         "IsWriteIn":      IsWriteIn,
@@ -2,6 +2,15 @@
 # that which caused dx x offset specified when dy is as specified
 from __future__ import division
 import math
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def iround_array(a):
+    """round the array a to integers the way int(round(x)) does, halves away
+    from zero, rather than numpy's round half to even"""
+    return (numpy.sign(a) * numpy.floor(numpy.abs(a) + .5)).astype(int)
 
 def rotator(tang, xl, yl, scalefactor=1.0):
     """
@@ -25,6 +34,13 @@ def rotator(tang, xl, yl, scalefactor=1.0):
     (474, 254)
     >>> r(832, 1746)
     (942, 1691)
+
+    The returned function also has a points method that transforms lists of
+    x and y coordinates all at once:
+
+    >>> xs, ys = r.points([98, 464, 832], [1030, 280, 1746], 1.0)
+    >>> zip(xs, ys)
+    [(160, 1027), (474, 254), (942, 1691)]
     """
     ra = math.atan(tang)
     cos, sin = math.cos(ra), math.sin(ra)
@@ -48,6 +64,22 @@ def rotator(tang, xl, yl, scalefactor=1.0):
         # return scaled output values
 
         return int(round(xd*scalefactor)), int(round(yd*scalefactor))
+
+    def points(xs, ys, scalefactor):
+        """
+        Transform the lists xs and ys of layout coordinates into a pair
+        of lists of coordinates in the particular ballot
+        """
+        if numpy is None:
+            pts = [r(x, y, scalefactor) for x, y in zip(xs, ys)]
+            return [p[0] for p in pts], [p[1] for p in pts]
+        xs = numpy.asarray(xs, dtype=float) - (xl*scalefactor)
+        ys = (yl*scalefactor) - numpy.asarray(ys, dtype=float)
+        xd = (xl*scalefactor) + (xs*cos - ys*sin)
+        yd = (yl*scalefactor) - (xs*sin + ys*cos)
+        return (iround_array(xd*scalefactor).tolist(),
+                iround_array(yd*scalefactor).tolist())
+    r.points = points
     return r
 
 def rotate_pt_by(x,y,deltatang,lx,ly):
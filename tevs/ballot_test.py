@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 from PILB import Image, ImageDraw
 from util_test import *
 import Ballot
@@ -81,3 +84,38 @@ def IsVoted_test(): #add loop that makes a speck in the center instead of
         for color in colors:
             do(color, speck, v, a)
 
+
+def Template_binary_test():
+    contests, _ = CONCHO(
+        (0, 0, 200, 400, "prop", "contest uno",
+            (10, 10, "yes", True, False, False),
+            (10, 70, "no", False, False, False)),
+        (0, 400, 200, 600, "prop", "contest dos",
+            (10, 410, "yes", True, False, False)),
+    )
+    tmpl = Ballot.Template(300, 3, -4, 0.01, "0102", contests, y2y=2900)
+    def dump(t):
+        return (t.dpi, t.xoff, t.yoff, t.rot, t.y2y, t.barcode, [
+            (c.x, c.y, c.x2, c.y2, c.prop, c.description,
+                [(ch.x, ch.y, ch.description) for ch in c.choices])
+            for c in t.contests
+        ])
+    binary = Ballot.Template_to_binary(tmpl)
+    assert dump(Ballot.Template_from_data(binary)) == \
+        dump(Ballot.Template_from_data(Ballot.Template_to_XML(tmpl)))
+    assert dump(Ballot.Template_from_binary(binary)) == dump(tmpl)
+
+def TemplateCache_test():
+    d = tempfile.mkdtemp()
+    try:
+        cache = Ballot.TemplateCache(os.path.join(d, "templates"))
+        with cache.building("0102"):
+            assert os.path.exists(os.path.join(d, "templates.locks", "0102"))
+            cache["0102"] = Ballot.Template(300, 0, 0, 0, "0102", [])
+        # no lock files left behind, and no temporary files beside templates
+        assert os.listdir(os.path.join(d, "templates.locks")) == []
+        assert os.listdir(os.path.join(d, "templates")) == ["0102"]
+        assert Ballot.TemplateCache(os.path.join(d, "templates"))["0102"] \
+            .barcode == "0102"
+    finally:
+        shutil.rmtree(d)
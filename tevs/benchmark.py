@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+"""Time each stage of processing ballots, to show whether a change makes
+TEVS faster before it is deployed.
+
+usage: python benchmark.py [-c tevs.cfg] [-b brand] [-n ballots] [--dpi=N]
+           [--tilt=T] [--noise=F] [--density=F] [--seed=N] [--ocr]
+           [-o results.json] [image ...]
+       python benchmark.py --compare before.json after.json
+
+The configuration file is read as by main.py; the brand, and with --dpi
+the resolution, may be overridden. Unless image files are given, ballots
+of the brand are generated: Hart (boxed columns, bar code and vote boxes),
+Diebold (edge dashes, dash code and boxed columns) or ESS (circled plus
+targets, timing marks and contests under gray headers), drawn where each
+vendor's code looks for them, tilted by the tangent T, with a fraction F
+of pixels turned to random grays, and a fraction F of their vote targets
+marked. Each ballot's images are made with the layout and marks fixed by
+the seed, so only the first ballot builds a template.
+
+The stages timed are, per ballot, open and flip (constructing the Ballot,
+which decodes and flips its images) and, per page, FindLandmarks,
+GetLayoutCode, BuildLayout (cold: building the template, warm: from the
+template cache) and CapturePageInfo. Templates are built in a fresh
+temporary directory. OCR is replaced by a function returning no text
+unless --ocr is given, so that tesseract does not swamp the timings.
+
+The results are written as JSON, by default to standard output: the
+commit, the settings, and for each stage the count, min, median, mean and
+total seconds, and the first error raised by any stage that failed.
+--compare prints the median of each stage of two such files side by side.
+
+Demo ballots ask for their landmarks on the terminal, so they cannot be
+benchmarked.
+"""
+import sys
+import os
+import math
+import time
+import json
+import random
+import shutil
+import getopt
+import logging
+import tempfile
+import subprocess
+
+import Image, ImageDraw
+
+import const
+import config
+import Ballot
+
+class _Sheet(object):
+    """A white page of width by height inches at dpi, on which shapes are
+    drawn in inches, tilted about the center of the page by tangent tilt."""
+    def __init__(self, width, height, dpi, tilt=0.0):
+        self.dpi = dpi
+        self.image = Image.new(
+            "RGB", (int(width*dpi), int(height*dpi)), "white")
+        self.draw = ImageDraw.Draw(self.image)
+        self.cx, self.cy = width/2.0, height/2.0
+        angle = math.atan(tilt)
+        self.cos, self.sin = math.cos(angle), math.sin(angle)
+
+    def _xy(self, x, y):
+        dx, dy = x - self.cx, y - self.cy
+        return ((self.cx + dx*self.cos - dy*self.sin)*self.dpi,
+                (self.cy + dx*self.sin + dy*self.cos)*self.dpi)
+
+    def box(self, x0, y0, x1, y1, fill="black"):
+        "fill the rectangle from x0, y0 to x1, y1"
+        self.draw.polygon([self._xy(x0, y0), self._xy(x1, y0),
+            self._xy(x1, y1), self._xy(x0, y1)], fill=fill)
+
+    def outline(self, x0, y0, x1, y1, width, fill="black"):
+        "draw the sides of the rectangle from x0, y0 to x1, y1"
+        self.box(x0, y0, x1, y0 + width, fill)
+        self.box(x0, y1 - width, x1, y1, fill)
+        self.box(x0, y0, x0 + width, y1, fill)
+        self.box(x1 - width, y0, x1, y1, fill)
+
+    def circle(self, x, y, r, width, fill="black"):
+        "draw a circle of radius r about x, y"
+        n = 48
+        for i in range(n):
+            a = 2*math.pi*i/n
+            self.box(x + r*math.cos(a) - width/2, y + r*math.sin(a) - width/2,
+                x + r*math.cos(a) + width/2, y + r*math.sin(a) + width/2, fill)
+
+    def speckle(self, noise, rng):
+        "turn a fraction noise of the pixels to random grays"
+        w, h = self.image.size
+        for _ in xrange(int(noise*w*h)):
+            gray = rng.randint(0, 255)
+            self.image.putpixel((rng.randrange(w), rng.randrange(h)),
+                (gray, gray, gray))
+
+def _digits(rng):
+    "a Hart layout code that passes hart_ballot.good_barcode"
+    tail = lambda n: "".join(str(rng.randint(0, 9)) for _ in range(n))
+    return "100" + tail(4) + "0" + str(rng.randint(0, 4)) + tail(5)
+
+def _two_of_five():
+    "the wide elements for each digit of a Hart bar code"
+    wides = {}
+    for i in range(5):
+        for j in range(i + 1, 5):
+            value = (1, 2, 4, 7, 0)[i] + (1, 2, 4, 7, 0)[j]
+            wides.setdefault(0 if value == 11 else value, (i, j))
+    return wides
+
+def _hart_bar_code(sheet, code, x0, x1, top):
+    """draw the interleaved two of five bar code for code between x0 and
+    x1, read from the bottom up, starting just below top"""
+    narrow, wide = .018, .045
+    wides = _two_of_five()
+    elements = [narrow]*4 #start group
+    for group in range(7):
+        bars = wides[int(code[2*group])]
+        spaces = wides[int(code[2*group + 1])]
+        for i in range(5):
+            elements.append(wide if i in bars else narrow)
+            elements.append(wide if i in spaces else narrow)
+    elements += [wide, narrow, narrow] #stop group
+    y = top + sum(elements)
+    for n, height in enumerate(elements):
+        if n % 2 == 0:
+            sheet.box(x0, y - height, x1, y)
+        y -= height
+
+def hart(sheet, rng, density, code):
+    """a Hart ballot: a box around three columns of boxed contests with
+    vote boxes at their left, and the layout code in a bar code at the
+    upper left of the box"""
+    w, h = sheet.cx*2, sheet.cy*2
+    line = .02
+    left, top, right, bottom = .75, .75, w - .6, h - .75
+    sheet.outline(left, top, right, bottom, line)
+    _hart_bar_code(sheet, code, left - .3, left - .2, top - .05)
+    column = (right - left)/3
+    target_w = const.target_width_inches
+    target_h = const.target_height_inches
+    for c in range(3):
+        x = left + c*column
+        if c:
+            sheet.box(x, top, x + line, bottom)
+        y = top + .5
+        while y + 1.5 < bottom:
+            sheet.box(x, y, x + column, y + line)
+            for choice in range(3):
+                ty = y + .45 + .3*choice
+                tx = x + const.vote_target_horiz_offset_inches
+                if rng.random() < density:
+                    sheet.box(tx, ty, tx + target_w, ty + target_h)
+                else:
+                    sheet.outline(tx, ty, tx + target_w, ty + target_h, .015)
+            y += 1.5
+
+def diebold(sheet, rng, density, code):
+    """a Diebold ballot: .2" by .05" dashes in the quarter inch columns
+    across the top and down both sides, the dashes between the bottom
+    corners giving the layout code in binary, and three columns, 2.75",
+    2.75" and 2.5" wide from just inside the left dashes, of contests
+    between horizontal lines with vote targets at their left"""
+    w, h = sheet.cx*2, sheet.cy*2
+    top, bottom = .5, h - .5
+    last = int((w - .2)/.25) #the column of the right side dashes
+    bits = int(code) % (1 << (last - 1))
+    for column in range(last + 1):
+        x = .25*column
+        sheet.box(x, top, x + .2, top + .05)
+        if column in (0, last) or bits >> (last - 1 - column) & 1:
+            sheet.box(x, bottom, x + .2, bottom + .05)
+    y = top
+    while y <= bottom:
+        for x in (0, .25*last):
+            sheet.box(x, y, x + .2, y + .05)
+        y += .25
+    line = .01
+    target_w = const.target_width_inches
+    target_h = const.target_height_inches
+    bounds = (.23, 2.98, 5.73, 8.23)
+    for x0, x1 in zip(bounds, bounds[1:]):
+        y = 1.25
+        while y + 1.5 < bottom:
+            sheet.box(x0, y, x1, y + line)
+            for choice in range(3):
+                ty = y + .45 + .3*choice
+                tx = x0 + const.vote_target_horiz_offset_inches
+                if rng.random() < density:
+                    sheet.box(tx, ty, tx + target_w, ty + target_h)
+                else:
+                    sheet.outline(tx, ty, tx + target_w, ty + target_h, .015)
+            y += 1.5
+        sheet.box(x0, y, x1, y + line)
+
+def ess(sheet, rng, density, code):
+    """an ESS ballot: a circled plus at each corner; timing marks every
+    third of an inch down the left from just below the upper left plus,
+    with blocks half an inch to their right giving the layout code; a line
+    across the top of three columns, with a black marker above where each
+    column's vote targets are; and in each column, contests with a gray
+    header above their vote targets"""
+    w, h = sheet.cx*2, sheet.cy*2
+    for x, y in ((.6, .45), (w - .68, .45), (w - .68, h - .3), (.6, h - .3)):
+        sheet.box(x - .005, y - .09, x + .005, y + .09)
+        sheet.box(x - .09, y - .005, x + .09, y + .005)
+        sheet.circle(x, y, .05, .01)
+    # the first mark is .25" left of and .36" below the plus's left edge
+    x, y = .345, .81
+    marks = [y]
+    y += .5
+    while y <= h - 1:
+        marks.append(y)
+        y += 1/3.0
+    marks.append(marks[-1] + .5)
+    for n, y in enumerate(marks):
+        sheet.box(x, y, x + .2, y + .1)
+        if 0 < n < len(marks) - 1:
+            # no block, a half block or a whole one: 0, A or B
+            block = int(code[n % len(code)]) % 3
+            if block:
+                sheet.box(x + .5, y, x + .5 + .125*block, y + .1)
+    target_w = const.target_width_inches
+    target_h = const.target_height_inches
+    left, column, top = 1.4, 2.2, .84
+    # the line is followed from 1" right of the first mark
+    sheet.box(1.1, top, left + 3*column, top + .02)
+    sheet.box(1.1, top + .17, left + 3*column, top + .19)
+    for c in range(3):
+        x0 = left + c*column
+        sheet.box(x0 + .14, top + .05, x0 + .38, top + .14)
+        y = top + .4
+        while y + 2 < h - 1:
+            sheet.box(x0, y, x0 + column - .1, y + .6, fill=(160, 160, 160))
+            for choice in range(3):
+                ty = y + .8 + .35*choice
+                tx = x0 + .14
+                if rng.random() < density:
+                    sheet.box(tx, ty, tx + target_w, ty + target_h)
+                else:
+                    sheet.outline(tx, ty, tx + target_w, ty + target_h, .015)
+            y += 2
+
+generators = {"hart": hart, "diebold": diebold, "ess": ess}
+
+def synthetic_ballots(brand, count, dpi, tilt, noise, density, seed, pages):
+    """Generate count ballots of pages images each, as lists of (name,
+    image) pairs. Every ballot has the same layout; which targets are marked
+    and where the noise falls differs from ballot to ballot."""
+    draw = generators[brand]
+    code = _digits(random.Random(seed))
+    ballots = []
+    for n in range(count):
+        rng = random.Random("%s-%d" % (seed, n))
+        images = []
+        for p in range(pages):
+            sheet = _Sheet(const.ballot_width_inches,
+                const.ballot_height_inches, dpi, tilt)
+            draw(sheet, rng, density, code)
+            sheet.speckle(noise, rng)
+            images.append(("synthetic-%s-%d-%d" % (brand, n, p), sheet.image))
+        ballots.append(images)
+    return ballots
+
+def image_ballots(names, pages):
+    "the image files names, taken pages at a time as the images of ballots"
+    return [names[i:i + pages] for i in range(0, len(names), pages)]
+
+def run(kind, ballots, extensions):
+    """Process ballots, created with the Ballot subclass kind, through each
+    stage, returning the seconds each stage took on each page and the first
+    error raised by each stage."""
+    timings, errors = {}, {}
+    def timed(stage, f, *args):
+        start = time.time()
+        try:
+            result = f(*args)
+        except Exception as e:
+            errors.setdefault(stage, "%s: %s" % (type(e).__name__, e))
+            raise
+        timings.setdefault(stage, []).append(time.time() - start)
+        return result
+
+    cache = extensions.template_cache
+    for images in ballots:
+        try:
+            # the constructor opens, decodes and flips the images
+            ballot = timed("open and flip", kind, images, extensions)
+            for page in ballot.pages:
+                timed("FindLandmarks", ballot.FindLandmarks, page)
+                code = timed("GetLayoutCode", ballot.GetLayoutCode, page)
+                if cache[code] is None:
+                    timed("BuildLayout (cold)", ballot.BuildLayout, page)
+                else:
+                    timed("BuildLayout (warm)", ballot.BuildLayout, page)
+                timed("CapturePageInfo", ballot.CapturePageInfo, page)
+        except Exception:
+            # recorded by timed; the later stages of this ballot are skipped
+            pass
+    return timings, errors
+
+def summarize(timings):
+    "the count, min, median, mean and total of each stage's timings"
+    summary = {}
+    for stage, times in timings.iteritems():
+        times = sorted(times)
+        n = len(times)
+        summary[stage] = {
+            "count": n,
+            "min": times[0],
+            "median": (times[(n - 1)/2] + times[n/2])/2,
+            "mean": sum(times)/n,
+            "total": sum(times),
+        }
+    return summary
+
+def commit():
+    "the git commit of this tree, if it can be found"
+    try:
+        return subprocess.Popen(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).communicate()[0].strip() or None
+    except OSError:
+        return None
+
+def compare(before, after, out=sys.stdout):
+    "print the median seconds of each stage in two results files"
+    with open(before) as f:
+        a = json.load(f)
+    with open(after) as f:
+        b = json.load(f)
+    print >>out, "%-20s %12s %12s %8s" % (
+        "stage", a.get("commit") or before, b.get("commit") or after, "ratio")
+    for stage in sorted(set(a["stages"]) | set(b["stages"])):
+        ma = a["stages"].get(stage, {}).get("median")
+        mb = b["stages"].get(stage, {}).get("median")
+        fmt = lambda m: "-" if m is None else "%.4f" % m
+        ratio = "-"
+        if ma and mb is not None:
+            ratio = "%.2f" % (mb/ma)
+        print >>out, "%-20s %12s %12s %8s" % (stage, fmt(ma), fmt(mb), ratio)
+
+def usage():
+    print >>sys.stderr, __doc__
+    sys.exit(2)
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "c:b:n:o:", [
+            "config=", "brand=", "ballots=", "dpi=", "tilt=", "noise=",
+            "density=", "seed=", "ocr", "output=", "compare",
+        ])
+    except getopt.GetoptError:
+        usage()
+    settings = {"config": "tevs.cfg", "ballots": 5, "tilt": 0.005,
+        "noise": 0.001, "density": 0.3, "seed": 0}
+    brand, dpi, output, use_ocr = None, None, None, False
+    try:
+        for opt, arg in opts:
+            if opt == "--compare":
+                if len(args) != 2:
+                    usage()
+                return compare(*args)
+            elif opt in ("-c", "--config"):
+                settings["config"] = arg
+            elif opt in ("-b", "--brand"):
+                brand = arg
+            elif opt in ("-n", "--ballots"):
+                settings["ballots"] = int(arg)
+            elif opt == "--dpi":
+                dpi = int(arg)
+            elif opt in ("--tilt", "--noise", "--density"):
+                settings[opt[2:]] = float(arg)
+            elif opt == "--seed":
+                settings["seed"] = int(arg)
+            elif opt == "--ocr":
+                use_ocr = True
+            elif opt in ("-o", "--output"):
+                output = arg
+    except ValueError:
+        usage()
+
+    config.get(settings["config"])
+    logging.basicConfig(level=logging.WARNING)
+    if brand is not None:
+        const.layout_brand = brand
+    if dpi is not None:
+        const.dpi = const.ballot_dpi = dpi
+    brand = const.layout_brand.lower()
+    try:
+        kind = Ballot.LoadBallotType(brand)
+    except ValueError as e:
+        print >>sys.stderr, "No such ballot type: %s: %s" % (brand, e)
+        sys.exit(2)
+    pages = 2 if issubclass(kind, Ballot.DuplexBallot) else 1
+    if args:
+        ballots = image_ballots(args, pages)
+    elif brand in generators:
+        ballots = synthetic_ballots(brand, settings["ballots"], const.dpi,
+            settings["tilt"], settings["noise"], settings["density"],
+            settings["seed"], pages)
+    else:
+        print >>sys.stderr, "No generator for %s ballots; give images" % brand
+        sys.exit(2)
+
+    templates = tempfile.mkdtemp(prefix="tevs-benchmark")
+    try:
+        xtnz = {"template_cache": Ballot.TemplateCache(
+            os.path.join(templates, "templates"))}
+        if not use_ocr:
+            xtnz["ocr_engine"] = lambda *a, **kw: ""
+        timings, errors = run(kind, ballots, Ballot.Extensions(**xtnz))
+    finally:
+        shutil.rmtree(templates, True)
+
+    settings.update(brand=brand, dpi=const.dpi, ocr=use_ocr,
+        images=args or None)
+    results = {
+        "commit": commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "settings": settings,
+        "stages": summarize(timings),
+        "errors": errors,
+    }
+    text = json.dumps(results, indent=1, sort_keys=True)
+    if output is None:
+        print text
+    else:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""composite.py keeps the composite images saved with save_composite_images:
+for each layout code, the darkest value seen at each pixel over every ballot
+of that layout, after aligning the ballot with its template.
+
+The composites are held in memory while ballots are processed and only
+written out every so often and at the end of a run, instead of reopening
+and recompressing a JPEG for every ballot. Each process writes its own
+composite_images<pid> directory; merge combines them.
+"""
+import os
+import re
+import logging
+
+import Image, ImageChops, ImageStat
+import const
+import util
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['Composites', 'composites', 'flush', 'merge']
+
+def _as_mode(im, mode):
+    """im in mode, "L" meaning just the red channel as for single channel
+    pages"""
+    if im.mode == mode:
+        return im
+    if im.mode not in ("RGB", "L"):
+        im = im.convert("RGB")
+    if mode == "L" and im.mode == "RGB":
+        return im.convert("L", (1, 0, 0, 0))
+    return im.convert(mode)
+
+def _red_total(im, margin):
+    "sum of the red channel of im, not counting a margin around the edges"
+    w, h = im.size
+    crop = im.crop((margin, margin, w - margin, h - margin))
+    return int(ImageStat.Stat(crop).sum[0])
+
+class _Composite(object):
+    "the composite of one layout code, as an array if numpy is available"
+    def __init__(self, image):
+        self.mode = image.mode
+        if numpy is not None:
+            self.pixels = numpy.array(image)
+        else:
+            self.pixels = image.copy()
+        self.count = 0
+        self.dirty = False
+
+    def image(self):
+        if numpy is not None:
+            return Image.fromarray(self.pixels, self.mode)
+        return self.pixels
+
+    def darken(self, image):
+        "keep the darker of the composite and image at each pixel"
+        image = _as_mode(image, self.mode)
+        if numpy is None:
+            self.pixels = ImageChops.darker(self.pixels, image)
+        else:
+            new = numpy.asarray(image)
+            h = min(self.pixels.shape[0], new.shape[0])
+            w = min(self.pixels.shape[1], new.shape[1])
+            # darker crops to the smaller image, as ImageChops.darker does
+            if (h, w) != self.pixels.shape[:2]:
+                self.pixels = self.pixels[:h, :w].copy()
+            numpy.minimum(self.pixels, new[:h, :w], out=self.pixels)
+        self.count += 1
+        self.dirty = True
+
+    def red_total(self, margin):
+        "sum of the red channel, not counting a margin around the edges"
+        if numpy is None:
+            return _red_total(self.pixels, margin)
+        red = self.pixels
+        if red.ndim == 3:
+            red = red[:, :, 0]
+        h, w = red.shape
+        return int(red[margin:h - margin, margin:w - margin].sum(
+            dtype=numpy.int64))
+
+class Composites(object):
+    """The composites of every layout code seen by this process, saved as
+    location/<layout code>.jpg. Each composite is started from a composite
+    already saved there, then from the template image in template_location,
+    and failing both from the first ballot added. Every flush_every ballots
+    added, and on flush, changed composites are written out."""
+    def __init__(self, location, template_location=None, flush_every=50):
+        self.location = location
+        self.template_location = template_location
+        self.flush_every = flush_every
+        self.composites = {}
+        self.added = 0
+        self.log = logging.getLogger('')
+
+    def _start(self, code, image):
+        for loc in (self.location, self.template_location):
+            if loc is None:
+                continue
+            try:
+                old = Image.open(os.path.join(loc, "%s.jpg" % code))
+                old.load()
+            except IOError:
+                continue
+            return _Composite(_as_mode(old, image.mode))
+        return _Composite(image)
+
+    def add(self, code, image, name=""):
+        """darken the composite for layout code with image, a ballot page
+        already aligned with its template, logging the change in the total
+        intensity of the red channel"""
+        composite = self.composites.get(code)
+        if composite is None:
+            composite = self.composites[code] = self._start(code, image)
+        margin = const.dpi/4
+        before = composite.red_total(margin)
+        composite.darken(image)
+        after = composite.red_total(margin)
+        self.log.info("%s Old %d New %d Diff %d" % (
+            os.path.basename(name), before, after, before - after))
+        if composite.count % 5 == 0:
+            self.log.info("Composite count for %s now %d (this run only)",
+                code, composite.count)
+        self.added += 1
+        if self.added % self.flush_every == 0:
+            self.flush()
+
+    def flush(self):
+        "write out every composite changed since the last flush"
+        util.mkdirp(self.location)
+        for code, composite in self.composites.iteritems():
+            if not composite.dirty:
+                continue
+            fname = os.path.join(self.location, "%s.jpg" % code)
+            tmp = "%s.%d.jpg" % (fname[:-4], os.getpid())
+            try:
+                composite.image().save(tmp)
+                os.rename(tmp, fname)
+            except (IOError, OSError):
+                self.log.exception("Could not save composite %s", fname)
+                continue
+            composite.dirty = False
+
+_composites = [None, None] #(pid, Composites)
+
+def composites():
+    """The Composites of this process, saving in composite_images<pid> under
+    the root. A process forked from one with composites gets its own."""
+    pid = os.getpid()
+    if _composites[0] != pid:
+        _composites[:] = pid, Composites(
+            util.root("composite_images%d" % pid),
+            util.root("template_images%d" % pid),
+        )
+    return _composites[1]
+
+def flush():
+    "flush the composites of this process, if it has any"
+    if _composites[0] == os.getpid():
+        _composites[1].flush()
+
+def merge(pids=None, dest=None):
+    """Combine the composite_images<pid> directories under the root of the
+    processes pids, or of every process that has left one, into one
+    composite per layout code in dest, by default composite_images under the
+    root, darkening what is already there. Returns the number of composites
+    written."""
+    if dest is None:
+        dest = util.root("composite_images")
+    if pids is None:
+        sources = [
+            util.root(d) for d in os.listdir(util.root())
+            if re.match(r"composite_images\d+$", d)
+        ]
+    else:
+        sources = [util.root("composite_images%d" % pid) for pid in pids]
+    merged = Composites(dest, flush_every=None)
+    for source in sources:
+        try:
+            fnames = os.listdir(source)
+        except OSError:
+            continue #saved no composites
+        for fname in fnames:
+            code, ext = os.path.splitext(fname)
+            if ext != ".jpg" or "." in code:
+                continue
+            try:
+                im = Image.open(os.path.join(source, fname))
+                im.load()
+            except IOError:
+                continue
+            composite = merged.composites.get(code)
+            if composite is None:
+                # from the composite of earlier runs, if any
+                composite = merged.composites[code] = merged._start(code, im)
+            composite.darken(im)
+    merged.flush()
+    return len(merged.composites)
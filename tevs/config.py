@@ -156,6 +156,56 @@ def get(cfg_file="tevs.cfg"):
     const.on_new_layout = config.get("Mode", "on_new_layout")
     const.filename_extension = config.get("Mode","filename_extension")
 
+    try:
+        const.ocr_workers = int(config.get("Mode", "ocr_workers"))
+    except ConfigParser.NoOptionError:
+        const.ocr_workers = None #one per cpu
+
+    try:
+        const.prefetch = int(config.get("Mode", "prefetch"))
+    except ConfigParser.NoOptionError:
+        const.prefetch = 2
+
+    try:
+        const.write_behind_threads = int(
+            config.get("Mode", "write_behind_threads"))
+    except ConfigParser.NoOptionError:
+        const.write_behind_threads = 2
+    try:
+        const.write_behind_depth = int(
+            config.get("Mode", "write_behind_depth"))
+    except ConfigParser.NoOptionError:
+        const.write_behind_depth = 4
+
+    try:
+        const.metrics_file = config.get("Mode", "metrics_file").strip()
+    except ConfigParser.NoOptionError:
+        const.metrics_file = None
+    try:
+        const.metrics_interval = int(config.get("Mode", "metrics_interval"))
+    except ConfigParser.NoOptionError:
+        const.metrics_interval = 15
+
+    try:
+        const.template_cache_size = int(
+            config.get("Mode", "template_cache_size"))
+    except ConfigParser.NoOptionError:
+        const.template_cache_size = 256
+    try:
+        const.template_format = config.get(
+            "Mode", "template_format").strip().lower()
+    except ConfigParser.NoOptionError:
+        const.template_format = "xml"
+    if const.template_format not in ("binary", "xml"):
+        sys.stderr.write("template_format must be binary or xml, "
+            "using xml\n")
+        const.template_format = "xml"
+
+    try:
+        const.single_channel = yesno(config, "Mode", "single_channel")
+    except ConfigParser.NoOptionError:
+        const.single_channel = False
+
     const.save_vops = yesno(config, "Mode", "save_vops")
     const.save_template_images = yesno(config, "Mode", "save_template_images")
     const.save_composite_images = yesno(config, "Mode", "save_composite_images")
@@ -163,4 +213,8 @@ def get(cfg_file="tevs.cfg"):
     #const.dbname = config.get("Database", "name")
     const.dbname = config.get("Database", "database")
     const.dbuser  = config.get("Database", "user")
+    try:
+        const.db_group = int(config.get("Database", "group_size"))
+    except ConfigParser.NoOptionError:
+        const.db_group = 1
 
@@ -1,11 +1,16 @@
+import sys
 from PIL import Image
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 #thresholds for colors
 lowest_bin = 64
 low_bin = 128
 high_bin = 192
 
-def cropstats(im, x, y):
+def py_cropstats(im, x, y):
     data = im.load()
     columns = im.size[0]
     rows = im.size[1]
@@ -24,6 +29,8 @@ def cropstats(im, x, y):
     for r in range(rows):
         for c in range(columns):
             datum = data[c, r]
+            if isinstance(datum, int): #single channel, treat as gray
+                datum = (datum, datum, datum)
             for color in range(3):
                 dc = datum[color]
                 tot[color] += dc
@@ -55,6 +62,76 @@ def cropstats(im, x, y):
 
     return retlist
 
+def _image_array(im):
+    """return the pixels of im as a rows x columns x 3 array, or as a rows x
+    columns array if im has a single channel"""
+    a = numpy.asarray(im)
+    if a.ndim == 3:
+        a = a[:, :, :3]
+    return a
+
+def _box_array(a, box):
+    """return the pixels of a within box, filling anything outside of a with
+    black as Image.crop does, without copying when box is inside a"""
+    left, upper, right, lower = box
+    rows, columns = a.shape[:2]
+    if left >= 0 and upper >= 0 and right <= columns and lower <= rows:
+        return a[upper:lower, left:right]
+    out = numpy.zeros((max(lower - upper, 0), max(right - left, 0))
+        + a.shape[2:], dtype=a.dtype)
+    l, u = max(left, 0), max(upper, 0)
+    r, b = min(right, columns), min(lower, rows)
+    if r > l and b > u:
+        out[u - upper:b - upper, l - left:r - left] = a[u:b, l:r]
+    return out
+
+def _array_stats(a, x, y):
+    "the array version of py_cropstats"
+    rows, columns = a.shape[:2]
+    rc = float(rows * columns)
+    if a.ndim == 2: #single channel, green and blue are the same as red
+        channels = [a]
+    else:
+        channels = [a[:, :, color] for color in range(3)]
+    retlist = []
+    for channel in channels:
+        # the bins are 64 wide, so the bin of a pixel is its top two bits
+        bins = numpy.bincount((channel >> 6).ravel(), minlength=4)
+        retlist.append(int(channel.sum(dtype=numpy.int64)) / rc)
+        retlist.extend(int(b) for b in bins[:4])
+    retlist *= 3 / len(channels)
+    retlist.append(x)
+    retlist.append(y)
+    # strictly inside the middle half of the crop, as in py_cropstats
+    interior = a[rows/4 + 1:(3*rows)/4, columns/4 + 1:(3*columns)/4]
+    retlist.append(int((interior < low_bin).sum()) * (3 / len(channels)))
+    return retlist
+
+def np_cropstats(im, x, y):
+    """Same as py_cropstats, but computes every bin with array operations
+    instead of visiting each pixel"""
+    return _array_stats(_image_array(im), x, y)
+
+def batch_cropstats(im, boxes, coords=None):
+    """Return the cropstats of each of boxes, a list of (left, upper, right,
+    lower) in im, as though each had been cropped from im and passed to
+    cropstats. coords is an optional list of (x, y) to report for each box,
+    by default the upper left corner of the box. With numpy, im is read once
+    and no crops are made."""
+    if coords is None:
+        coords = [box[:2] for box in boxes]
+    if numpy is None:
+        return [py_cropstats(im.crop(box), x, y)
+            for box, (x, y) in zip(boxes, coords)]
+    a = _image_array(im)
+    return [_array_stats(_box_array(a, box), x, y)
+        for box, (x, y) in zip(boxes, coords)]
+
+if numpy is not None:
+    cropstats = np_cropstats
+else:
+    cropstats = py_cropstats
+
 if __name__ == "__main__":
     try:
         filename = sys.argv[1]
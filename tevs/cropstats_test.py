@@ -0,0 +1,31 @@
+import random
+from util_test import *
+from PILB import Image
+import cropstats
+
+def np_cropstats_test():
+    if cropstats.numpy is None:
+        return
+    random.seed(0)
+    for w, h in ((1, 1), (7, 3), (30, 24)):
+        im = noise(w, h)
+        assert cropstats.np_cropstats(im, 2, 3) == \
+            cropstats.py_cropstats(im, 2, 3)
+
+def batch_cropstats_test():
+    random.seed(0)
+    im = noise(60, 60)
+    #the last two boxes hang off of the image
+    boxes = [(0, 0, 20, 20), (13, 7, 40, 19), (50, 50, 70, 65), (-5, 10, 5, 20)]
+    for box, stats in zip(boxes, cropstats.batch_cropstats(im, boxes)):
+        assert stats == cropstats.py_cropstats(im.crop(box), *box[:2])
+
+def single_channel_test():
+    #a single channel image has the stats of the same image in gray RGB
+    random.seed(0)
+    im = noise(30, 24).split()[0]
+    boxes = [(0, 0, 30, 24), (-5, 10, 5, 20)]
+    assert cropstats.batch_cropstats(im, boxes) == \
+        cropstats.batch_cropstats(im.convert("RGB"), boxes)
+    assert cropstats.py_cropstats(im, 0, 0) == \
+        cropstats.py_cropstats(im.convert("RGB"), 0, 0)
@@ -7,12 +7,14 @@ except ImportError:
 
 import pdb
 class NullDB(object):
-    def __init__(self, *_):
+    def __init__(self, *_, **__):
         pass
     def close(self):
         pass
     def insert(self, _):
-        pass
+        return True
+    def flush(self):
+        return True
 
 create_ballots_table = """
 create table ballots (
@@ -68,7 +70,20 @@ create_voteops_filename_index = """create index voteops_filename_index on voteop
 
 
 class PostgresDB(object):
-    def __init__(self, database, user):
+    """A connection to the tevs database.
+
+    insert records a ballot and its votes. The votes of each ballot are
+    sent in multirow inserts of up to rows_per_insert rows, and the
+    transaction is only committed after every group ballots, so that the
+    database can keep up with several extraction processes. Nothing from
+    an uncommitted group is visible until insert returns True or flush is
+    called; if any insert fails, the whole uncommitted group is rolled
+    back.
+    """
+    def __init__(self, database, user, group=1, rows_per_insert=500):
+        self.group = max(1, group)
+        self.rows_per_insert = rows_per_insert
+        self.pending = 0
         try:
             self.conn = DB.connect(database=database, user=user)
         except Exception, e:
@@ -143,6 +158,8 @@ class PostgresDB(object):
         return r
 
     def insert(self, ballot):
+        """record ballot and its results, returning True if they have been
+        committed and False if they are waiting on the rest of the group"""
         #NB all db queries are decalred as strings after the method body for
         #clarity
 
@@ -166,61 +183,85 @@ class PostgresDB(object):
             name1, name2 = b[0].filename, b[1].filename
 
         cur = self.conn.cursor()
-
-        # create a record for this ballot
-
-        cur.execute(_pg_mk, (search_key, name1, name2))
-        sql_ret = cur.fetchall()
-
         try:
-            ballot_id = int(sql_ret[0][0])
-        except ValueError as e:
-            self.conn.rollback()
-            raise DatabaseError("Corrupt ballot_id")
+            # create a record for this ballot
 
-        # write each result into our record
+            cur.execute(_pg_mk, (search_key, name1, name2))
+            sql_ret = cur.fetchall()
 
-        for vd in ballot.results:
             try:
-                cur.execute(_pg_ins, (
-                        ballot_id,
-                        vd.contest[:80],
-                        vd.choice[:80],
-
-                        vd.coords[0],
-                        vd.coords[1],
-                        vd.stats.adjusted.x,
-                        vd.stats.adjusted.y, 
-
-                        vd.stats.red.intensity,
-                        vd.stats.red.darkest_fourth,
-                        vd.stats.red.second_fourth,
-                        vd.stats.red.third_fourth,
-                        vd.stats.red.lightest_fourth,
-
-                        vd.stats.green.intensity,
-                        vd.stats.green.darkest_fourth,
-                        vd.stats.green.second_fourth,
-                        vd.stats.green.third_fourth,
-                        vd.stats.green.lightest_fourth,
-
-                        vd.stats.blue.intensity,
-                        vd.stats.blue.darkest_fourth,
-                        vd.stats.blue.second_fourth,
-                        vd.stats.blue.third_fourth,
-                        vd.stats.blue.lightest_fourth,
-
-                        vd.was_voted, 
-                        vd.ambiguous,
-                        vd.filename
-                    )
-                )
-            except:
-                self.conn.rollback()
-                raise
+                ballot_id = int(sql_ret[0][0])
+            except ValueError as e:
+                raise DatabaseError("Corrupt ballot_id")
 
+            # write each result into our record, many rows per statement
 
-        self.conn.commit()
+            rows = [_voteop_row(ballot_id, vd) for vd in ballot.results]
+            for i in range(0, len(rows), self.rows_per_insert):
+                values = ",".join(
+                    cur.mogrify(_pg_values, row)
+                    for row in rows[i:i + self.rows_per_insert]
+                )
+                cur.execute(_pg_ins_into + values)
+        except:
+            self.conn.rollback()
+            self.pending = 0
+            raise
+
+        self.pending += 1
+        if self.pending >= self.group:
+            return self.flush()
+        return False
+
+    def flush(self):
+        """commit every ballot inserted since the last commit; returns True
+        once they are committed. On failure, they are rolled back and the
+        error is raised"""
+        if self.pending == 0:
+            return True
+        try:
+            self.conn.commit()
+        except:
+            self.conn.rollback()
+            raise
+        finally:
+            self.pending = 0
+        return True
+
+def _voteop_row(ballot_id, vd):
+    "the values of a voteops row for VoteData vd, in the order of _pg_values"
+    return (
+        ballot_id,
+        vd.contest[:80],
+        vd.choice[:80],
+
+        vd.coords[0],
+        vd.coords[1],
+        vd.stats.adjusted.x,
+        vd.stats.adjusted.y, 
+
+        vd.stats.red.intensity,
+        vd.stats.red.darkest_fourth,
+        vd.stats.red.second_fourth,
+        vd.stats.red.third_fourth,
+        vd.stats.red.lightest_fourth,
+
+        vd.stats.green.intensity,
+        vd.stats.green.darkest_fourth,
+        vd.stats.green.second_fourth,
+        vd.stats.green.third_fourth,
+        vd.stats.green.lightest_fourth,
+
+        vd.stats.blue.intensity,
+        vd.stats.blue.darkest_fourth,
+        vd.stats.blue.second_fourth,
+        vd.stats.blue.third_fourth,
+        vd.stats.blue.lightest_fourth,
+
+        vd.was_voted, 
+        vd.ambiguous,
+        vd.filename
+    )
 
 _pg_mk = """INSERT INTO ballots (
             processed_at, 
@@ -229,7 +270,7 @@ _pg_mk = """INSERT INTO ballots (
             file2
         ) VALUES (now(), %s, %s, %s) RETURNING ballot_id ;"""
 
-_pg_ins = """INSERT INTO voteops (
+_pg_ins_into = """INSERT INTO voteops (
             ballot_id,
             contest_text,
             choice_text,
@@ -260,7 +301,9 @@ _pg_ins = """INSERT INTO voteops (
             was_voted, 
             suspicious,
             filename
-        ) VALUES (
+        ) VALUES """
+
+_pg_values = """(
             %s, %s, %s,  
             %s, %s, %s, %s,
             %s, %s, %s, %s, %s, 
@@ -270,3 +313,5 @@ _pg_ins = """INSERT INTO voteops (
             %s, 
             %s
         )"""
+
+_pg_ins = _pg_ins_into + _pg_values
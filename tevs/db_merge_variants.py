@@ -4,6 +4,7 @@ import os
 import os.path
 import const
 import time
+import Ballot
 
 drop_variants_table_str = "drop table if exists ocr_variants cascade;"
 
@@ -73,23 +74,35 @@ def update_templates(associations,root):
         standardized_id = a[1]
         orig_text = a[3]
         a_dict[standardized_id]=orig_text
+    def standardize(l):
+        for a in associations:
+            regular_id = a[0]
+            standardized_id = a[1]
+            orig_text = a[3]
+            if l.find(orig_text)>-1:
+                s_text = a_dict[standardized_id]
+                l=l.replace(orig_text, s_text)
+        return l
     template_dir = "%s/templates" % (root,)
     templates = os.listdir(template_dir)
     for tname in ["%s/%s" % (template_dir,x) for x in templates]:
         # load template text
         #print tname
-        t = open(tname,"r")
-        out_t = open("%s.new" % (tname,),"w")
-        for l in t.readlines():
-            for a in associations:
-                regular_id = a[0]
-                standardized_id = a[1]
-                orig_text = a[3]
-                if l.find(orig_text)>-1:
-                    s_text = a_dict[standardized_id]
-                    l=l.replace(orig_text, s_text)
-            out_t.write(l)
+        t = open(tname,"rb")
+        data = t.read()
         t.close()
+        out_t = open("%s.new" % (tname,),"wb")
+        if data.startswith(Ballot._tmpl_magic):
+            # binary templates are length prefixed, so edit them as templates
+            template = Ballot.Template_from_data(data)
+            for contest in template.contests:
+                contest.description = standardize(contest.description)
+                for choice in contest.choices:
+                    choice.description = standardize(choice.description)
+            out_t.write(Ballot.Template_to_binary(template))
+        else:
+            for l in data.splitlines(True):
+                out_t.write(standardize(l))
         out_t.close()
     try:
         unmerged_dir = "%s/unmerged_templates%d" % (root,int(time.time()))
@@ -0,0 +1,101 @@
+"""deskew.py undoes the rotation of a ballot image, as found by FindLandmarks
+in page.rot, without rotating the whole page when only part of it is needed.
+
+crop resamples just one region of the deskewed page, by mapping the region
+back through the rotation, and straighten one region measured on the page
+as scanned, such as one found from its landmarks. align deskews a page and
+moves its landmark to where a template has it in one pass, for the
+composites, and deskew leaves alone a page whose rotation would not move
+any pixel. Transposed lets searches written for horizontal
+lines, such as find_line, look for vertical lines by walking down columns
+instead of rotating the page by 90 degrees.
+"""
+import math
+import Image, ImageChops
+
+__all__ = ['R2D', 'matrix', 'moves', 'crop', 'straighten', 'align', 'deskew',
+    'Transposed']
+
+# degrees per unit of page.rot, as Ballot has always converted it
+R2D = 180/3.14
+
+def matrix(size, rot, origin=(0, 0)):
+    """The Image.AFFINE data taking a pixel of an image of size deskewed by
+    rot, relative to origin in the deskewed image, to the pixel of the image
+    it comes from; the same transform image.rotate(-R2D*rot) uses, a
+    rotation about the center of the image."""
+    angle = math.radians(R2D * rot)
+    cos, sin = math.cos(angle), math.sin(angle)
+    cx, cy = size[0]/2.0, size[1]/2.0
+    x0, y0 = origin[0] - cx, origin[1] - cy
+    return (cos, sin, cx + cos*x0 + sin*y0,
+            -sin, cos, cy - sin*x0 + cos*y0)
+
+def moves(size, rot):
+    "whether deskewing an image of size by rot would move any pixel"
+    # the corners move the farthest
+    return abs(math.radians(R2D * rot)) * math.hypot(*size) / 2 >= .5
+
+def crop(image, rot, box, resample=Image.BILINEAR):
+    """The box of image deskewed by rot; for a box within image, the same
+    as image.rotate(-R2D*rot, resample).crop(box), but only resampling box."""
+    left, upper, right, lower = box
+    return image.transform((right - left, lower - upper), Image.AFFINE,
+        matrix(image.size, rot, (left, upper)), resample)
+
+def _about(rot, origin, to=(0, 0)):
+    """the Image.AFFINE data deskewing by rot about origin in the image it
+    comes from, which ends up at to"""
+    angle = math.radians(R2D * rot)
+    cos, sin = math.cos(angle), math.sin(angle)
+    # BILINEAR samples between pixels, so aim half a pixel further on to
+    # land on them
+    return (cos, sin, origin[0] - cos*to[0] - sin*to[1] + .5,
+            -sin, cos, origin[1] + sin*to[0] - cos*to[1] + .5)
+
+def straighten(image, rot, box, resample=Image.BILINEAR):
+    """The box of image, measured in image itself as landmarks are, deskewed
+    by rot about its upper left corner, which stays put. Unlike crop, where
+    box is in the deskewed page, nothing far from the center of the page
+    slides out of box."""
+    left, upper, right, lower = box
+    size = right - left, lower - upper
+    if not moves(size, rot):
+        return image.crop(box)
+    return image.transform(size, Image.AFFINE, _about(rot, (left, upper)),
+        resample)
+
+def align(image, rot, landmark, to, resample=Image.BILINEAR):
+    """image deskewed by rot about landmark, a point of image, and moved so
+    that landmark is at to; what deskewing the page, finding its landmark
+    again and offsetting it to to would give, in one resampling. What comes
+    from outside image is white, as the margins of a ballot are."""
+    if image.mode not in ("L", "RGB"):
+        image = image.convert("RGB")
+    if not moves(image.size, rot):
+        moved = Image.new(image.mode, image.size, "white")
+        moved.paste(image, (int(round(to[0] - landmark[0])),
+            int(round(to[1] - landmark[1]))))
+        return moved
+    data = _about(rot, landmark, to)
+    # transform fills with black, so work on the negative
+    return ImageChops.invert(ImageChops.invert(image).transform(
+        image.size, Image.AFFINE, data, resample))
+
+def deskew(image, rot, resample=Image.BILINEAR):
+    """image deskewed by rot, as by image.rotate(-R2D*rot, resample), or
+    image itself if that would not move any pixel"""
+    if not moves(image.size, rot):
+        return image
+    return image.rotate(-R2D * rot, resample)
+
+class Transposed(object):
+    """A view of image with its rows and columns swapped, so that a vertical
+    line in image is a horizontal line in the view. Supports size and
+    getpixel, which is all find_line needs; nothing is copied."""
+    def __init__(self, image):
+        self.image = image
+        self.size = image.size[1], image.size[0]
+
+    def getpixel(self, xy):
+        return self.image.getpixel((xy[1], xy[0]))
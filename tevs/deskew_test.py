@@ -0,0 +1,59 @@
+import random
+from util_test import *
+from PILB import Image, ImageChops
+import deskew
+
+def crop_test():
+    random.seed(0)
+    im = noise(40, 60)
+    for rot in (.01, -.02):
+        full = im.rotate(-deskew.R2D * rot, Image.BILINEAR)
+        for box in ((0, 0, 40, 60), (3, 7, 31, 50)):
+            diff = ImageChops.difference(deskew.crop(im, rot, box),
+                full.crop(box))
+            #allow for the rounding of the two transforms
+            assert max(hi for lo, hi in diff.getextrema()) <= 1
+
+def _mark(size, box):
+    "a white L image of size, black in box"
+    im = Image.new("L", size, 255)
+    im.paste(0, box)
+    return im
+
+def straighten_test():
+    im = noise(40, 60)
+    box = (3, 7, 31, 50)
+    assert ImageChops.difference(deskew.straighten(im, 0, box),
+        im.crop(box)).getextrema() == ((0, 0),) * 3
+    # far from the center, the corner of the box stays put, unblurred
+    im = _mark((400, 400), (350, 350, 351, 351))
+    zone = deskew.straighten(im, .02, (348, 348, 398, 398))
+    assert zone.size == (50, 50)
+    assert zone.getpixel((2, 2)) < 32
+    assert min(zone.getpixel((x, 3)) for x in range(50)) > 224
+    # a zone the rotation would not move is just cropped
+    assert deskew.straighten(im, .02, (348, 348, 358, 358)).getpixel(
+        (2, 2)) == 0
+
+def align_test():
+    im = noise(40, 60)
+    moved = deskew.align(im, 0, (10, 10), (13, 15))
+    assert moved.size == im.size
+    assert moved.getpixel((20, 25)) == im.getpixel((17, 20))
+    assert moved.getpixel((0, 0)) == (255, 255, 255)
+    im = _mark((400, 400), (50, 50, 51, 51))
+    moved = deskew.align(im, -.02, (50, 50), (300, 200))
+    assert moved.getpixel((300, 200)) < 32
+    assert moved.getpixel((301, 201)) > 224
+    assert moved.getpixel((50, 50)) == 255
+
+def deskew_test():
+    im = noise(40, 60)
+    assert deskew.deskew(im, .001) is im
+    assert deskew.deskew(im, .1).size == im.size
+
+def transposed_test():
+    im = noise(40, 60)
+    t = deskew.Transposed(im)
+    assert t.size == (60, 40)
+    assert t.getpixel((5, 7)) == im.getpixel((7, 5))
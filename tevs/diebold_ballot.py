@@ -11,6 +11,7 @@
 
 import Ballot
 import const
+import util
 from adjust import rotator
 from cropstats import cropstats
 import Image, ImageStat
@@ -38,6 +39,7 @@ class DieboldBallot(Ballot.DuplexBallot):
     correspond to the brand entry in tevs.cfg (diebold.cfg), 
     the configuration file.
     """
+    single_channel = True
 
     def __init__(self, images, extensions):
         #convert all our constants to locally correct values
@@ -75,16 +77,16 @@ class DieboldBallot(Ballot.DuplexBallot):
         oval = 0
         stripedata = list(stripe.getdata())
         for num,p in enumerate(stripedata):
-            if p[0] > darkened:
+            if util.red(p) > darkened:
                 before_oval += 1
             else:
                 try:
                     test_offset = before_oval+printed_oval_height
-                    if ((stripedata[test_offset-2][0] < darkened) or 
-                        (stripedata[test_offset-1][0] < darkened) or 
-                        (stripedata[test_offset][0] < darkened) or
-                        (stripedata[test_offset+1][0] < darkened) or
-                        (stripedata[test_offset+2][0] < darkened)):
+                    if ((util.red(stripedata[test_offset-2]) < darkened) or 
+                        (util.red(stripedata[test_offset-1]) < darkened) or 
+                        (util.red(stripedata[test_offset]) < darkened) or
+                        (util.red(stripedata[test_offset+1]) < darkened) or
+                        (util.red(stripedata[test_offset+2]) < darkened)):
                         oval_start = num
                         oval_end = num + printed_oval_height
                         after_oval = (
@@ -2,7 +2,9 @@ import Image, ImageStat
 import sys
 import pdb
 import const
+import util
 import line_util
+import projection
 
 dark_threshold = 236
 light_threshold = 240
@@ -16,7 +18,7 @@ def count_lines_without_dark_pixel(im, start_x, start_y, end_x, end_y, thresh):
         found_dark = False
         for test_x in range(start_x,end_x):
             p = im.getpixel((test_x,test_y))
-            if p[0] <= thresh:
+            if util.red(p) <= thresh:
                 found_dark = True
                 break
         if not found_dark:
@@ -44,7 +46,7 @@ def get_ulc_if_untinted_oval(im, x, y):
     top_oval_y = y - oval_height
     for test_x in range(x-oval_width,x):
         p = im.getpixel((test_x,mid_oval_y))
-        if p[0]<=dark_threshold:
+        if util.red(p)<=dark_threshold:
             # first check: confirm at least one dark pixel
             # on each line from mid_oval to bottom and top of oval,
             # going out from test_x to test_x + mid_oval
@@ -74,7 +76,7 @@ def get_ulc_if_untinted_oval(im, x, y):
     for test_x in range(left_wall+oval_width-(const.dpi/32),
                         left_wall+oval_width+(const.dpi/32)):
         p = im.getpixel((test_x,mid_oval_y))
-        if p[0] <= dark_threshold:
+        if util.red(p) <= dark_threshold:
             # first check: confirm at least one dark pixel
             # on each line from mid_oval to bottom and top of oval,
             # going out from test_x to test_x + mid_oval
@@ -102,7 +104,7 @@ def get_ulc_if_untinted_oval(im, x, y):
     top_wall = -1
     for test_y in range(y - (3*oval_height/2),y-(oval_height/2),1):
         p = im.getpixel((x,test_y))
-        if p[0]<dark_threshold: 
+        if util.red(p)<dark_threshold: 
             # confirm average intensity in exclusion zone > light_threshold
             xzone_stat = ImageStat.Stat(im.crop((x,
                                                  test_y - exclusion_zone_width,
@@ -147,7 +149,7 @@ def find_bottom_landmark_dash(page,starting_x,starting_y,dpi):
         p = im.getpixel((test_x,starting_y))
         p_above = im.getpixel((test_x,starting_y - (dpi/10)))
         p_below = im.getpixel((test_x,starting_y + (dpi/10)))
-        if p[0] <= ldt and p_above[0] >= let and p_below >= let:
+        if util.red(p) <= ldt and util.red(p_above) >= let and util.red(p_below) >= let:
             starting_x = test_x
             break
         else:
@@ -156,7 +158,7 @@ def find_bottom_landmark_dash(page,starting_x,starting_y,dpi):
     # now scan all black pixels, breaking at first white, which is landmark
     for test_x in range(starting_x+incr,starting_x + (incr*dpi/4),incr):
         p = im.getpixel((test_x,starting_y))
-        if p[0] >= const.line_darkness_threshold:
+        if util.red(p) >= const.line_darkness_threshold:
             return_x = test_x 
             break
     return return_x
@@ -205,7 +207,7 @@ def find_top_landmark_dash(page, starting_x, starting_y, dpi):
     landmark_x = -1
     for test_x in range(starting_x, ending_x, incr):
         pix = im.getpixel((test_x,starting_y))
-        dark = (pix[0] <= const.line_darkness_threshold)
+        dark = (util.red(pix) <= const.line_darkness_threshold)
         if dark:
             passed_dark_pix = True
             num_light_pix = 0
@@ -217,7 +219,7 @@ def find_top_landmark_dash(page, starting_x, starting_y, dpi):
     # continue in same direction until dark encountered again
     for test_x in range(landmark_x, ending_x, incr):
         pix = im.getpixel((test_x,starting_y))
-        if pix[0] <= const.line_darkness_threshold:
+        if util.red(pix) <= const.line_darkness_threshold:
             landmark_x = test_x - incr
             break
 
@@ -227,9 +229,9 @@ def find_top_landmark_dash(page, starting_x, starting_y, dpi):
         p = im.getpixel((alternate_x,starting_y))
         p_above = im.getpixel((alternate_x,starting_y-(dpi/10)))
         p_below = im.getpixel((alternate_x,starting_y+(dpi/10)))
-        darkp = (p[0] < const.line_darkness_threshold)
-        darkp_above = (p_above[0] < const.line_darkness_threshold)
-        darkp_below = (p_below[0] < const.line_darkness_threshold)
+        darkp = (util.red(p) < const.line_darkness_threshold)
+        darkp_above = (util.red(p_above) < const.line_darkness_threshold)
+        darkp_below = (util.red(p_below) < const.line_darkness_threshold)
         if darkp and ((not darkp_above) or (not darkp_below)):
             landmark_x = alternate_x
     return landmark_x
@@ -241,6 +243,8 @@ def find_horizontal_lines(page, starting_x, dpi):
         im = page.image
     except:
         im = page
+    # every scan is of the same strips, so share their profiles
+    profiles = projection.of(im, getattr(page, "profiles", None))
     starting_y_offset = 300
     while True:
         line =line_util.scan_strips_for_horiz_line_y(
@@ -248,7 +252,8 @@ def find_horizontal_lines(page, starting_x, dpi):
             dpi,
             starting_x,
             starting_y_offset = starting_y_offset, 
-            height_to_scan=(im.size[1] - starting_y_offset - (dpi/4)))
+            height_to_scan=(im.size[1] - starting_y_offset - (dpi/4)),
+            profiles = profiles)
         #print "Line at",line
         if line == 0: 
             break
@@ -305,7 +310,7 @@ def find_untinted_voteops(page,starting_x,starting_y,ending_y,dpi):
         p = im.getpixel((starting_x,y))
         # on darkened pix, check for and append oval to retlist
         ulc_of_oval = []
-        if p[0] < dark_threshold:
+        if util.red(p) < dark_threshold:
             # first check a horizontal line to confirm multiple darks
             crop = im.crop((int(starting_x - 10),
                                int(y),
@@ -348,7 +353,7 @@ def find_untinted_voteops(page,starting_x,starting_y,ending_y,dpi):
             # on tinted pix, check for and append oval to current sublist;
             # on darkened untinted pix, add new sublist
             ulc_of_oval = []
-            if p[0] < dark_threshold:
+            if util.red(p) < dark_threshold:
                 # first check a horizontal line to confirm multiple darks
                 croplist = (test_x - 10,
                             y,
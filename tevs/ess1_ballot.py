@@ -320,7 +320,7 @@ page offsets (%d,%d) scaled page offsets (%d,%d), template offsets (%d,%d)" % (
                                         page.landmarks[3][0] + adj(2),
                                         page.landmarks[3][1] ))
             precinct.save("/tmp/precinct.jpg")
-            precincttext = ocr.tesseract(precinct)
+            precincttext = ocr.recognize(precinct)
             precincttext = ocr.clean_ocr_text(precincttext)
             precincttext = precincttext.strip()
             precincttext = precincttext.replace("\n","//").strip()
@@ -493,7 +493,7 @@ page offsets (%d,%d) scaled page offsets (%d,%d), template offsets (%d,%d)" % (
                                        column_bounds[1],
                                        next_y))
                     crop = Image.eval(crop,elim_halftone)
-                    cjurisdiction = ocr.tesseract(crop)
+                    cjurisdiction = ocr.recognize(crop)
                     cjurisdiction = cjurisdiction.replace("\n","//").strip()
                     self.log.debug( "Jurisdiction %s" % (cjurisdiction,))
                     cjurisdiction = ocr.clean_ocr_text(cjurisdiction)
@@ -570,9 +570,9 @@ page offsets (%d,%d) scaled page offsets (%d,%d), template offsets (%d,%d)" % (
                                     dz[0],
                                     txt_off + const.dpi,
                                     dz[1]))
-            zone1text = ocr.tesseract(zonecrop1)
+            zone1text = ocr.recognize(zonecrop1)
             zone1text = ocr.clean_ocr_text(zone1text)
-            zone3text = ocr.tesseract(zonecrop3)
+            zone3text = ocr.recognize(zonecrop3)
             zone3text = ocr.clean_ocr_text(zone3text)
             intensity_suggests_voteop = False
             length_suggests_voteop = False
@@ -698,7 +698,7 @@ page offsets (%d,%d) scaled page offsets (%d,%d), template offsets (%d,%d)" % (
                                       dark_zones[index][0],
                                       crop.size[0]-adj(0.1),
                                       dark_zones[index][1]))
-                zonetext = ocr.tesseract(titlezone)
+                zonetext = ocr.recognize(titlezone)
                 zonetext = ocr.clean_ocr_text(zonetext)
                 zonetext = zonetext.strip()
                 zonetext = zonetext.replace("\n","//").strip()
@@ -724,7 +724,7 @@ page offsets (%d,%d) scaled page offsets (%d,%d), template offsets (%d,%d)" % (
                                       dark_zones[index][0],
                                       crop.size[0]-adj(0.1),
                                       dark_zones[index][1]))
-                zonetext = ocr.tesseract(choicezone)
+                zonetext = ocr.recognize(choicezone)
                 zonetext = ocr.clean_ocr_text(zonetext)
                 zonetext = zonetext.strip()
                 zonetext = zonetext.replace("\n","//").strip()
@@ -45,6 +45,8 @@ Reliably show at least .05" continuous dark pixels at top and bottom center
 
 import Ballot
 import const
+import util
+import ocr
 from adjust import rotator
 from cropstats import cropstats
 import Image, ImageStat
@@ -68,6 +70,7 @@ class EssBallot(Ballot.DuplexBallot):
     correspond to the brand entry in tevs.cfg (ess.cfg), 
     the configuration file.
     """
+    single_channel = True
 
     def __init__(self, images, extensions):
         #convert all our constants to locally correct values
@@ -128,15 +131,15 @@ page offsets (%d,%d) template offsets (%d,%d)" % (
         oval = 0
         stripedata = list(stripe.getdata())
         for num,p in enumerate(stripedata):
-            if p[0] > 245:
+            if util.red(p) > 245:
                 before_oval += 1
             else:
                 try:
-                    if ((stripedata[before_oval+printed_oval_height-2][0] < 245) or 
-                        (stripedata[before_oval+printed_oval_height-1][0] < 245) or 
-                        (stripedata[before_oval+printed_oval_height][0] < 245) or
-                        (stripedata[before_oval+printed_oval_height+1][0] < 245) or
-                        (stripedata[before_oval+printed_oval_height+2][0] < 245)):
+                    if ((util.red(stripedata[before_oval+printed_oval_height-2]) < 245) or 
+                        (util.red(stripedata[before_oval+printed_oval_height-1]) < 245) or 
+                        (util.red(stripedata[before_oval+printed_oval_height]) < 245) or
+                        (util.red(stripedata[before_oval+printed_oval_height+1]) < 245) or
+                        (util.red(stripedata[before_oval+printed_oval_height+2]) < 245)):
                         oval_start = num
                         oval_end = num + printed_oval_height
                         after_oval = stripe.size[1] - (oval_start+printed_oval_height)
@@ -240,9 +243,11 @@ page offsets (%d,%d) template offsets (%d,%d)" % (
              im.size[1]-adj(0.47)-1-move_up
              )
             ):
-            landmark = self.find_landmark_in_region(
-                page.image,
-                [x,y,x+width,y+height]
+            # the lines of the plus are too thin to make out at 1/4 size
+            landmark = page.locate(
+                self.find_landmark_in_region,
+                [x,y,x+width,y+height],
+                factors=(2,)
             )
             landmarks.append(landmark)
         x,y = landmarks[0][0],landmarks[0][1]
@@ -255,11 +260,16 @@ page offsets (%d,%d) template offsets (%d,%d)" % (
         self.log.debug("landmarks %s,rot %f,(%d,%d), longdiff %d" % (landmarks,r,x,y,longdiff))
         return r,x,y,longdiff
 
-    def find_landmark_in_region(self, image, croplist):
-        """ given an image and a cropbox, find the circled plus """
+    def find_landmark_in_region(self, image, croplist, dpi=None):
+        """ given an image and a cropbox, find the circled plus
+
+        The image may be at a lower dpi than const.dpi, as for Page.locate."""
         iround = lambda x: int(round(x))
-        adj = lambda f: int(round(const.dpi * f))
-        dpi = const.dpi
+        if dpi is None:
+            dpi = const.dpi
+        adj = lambda f: int(round(dpi * f))
+        # 4 pixels at const.dpi
+        four = max(iround(4. * dpi / const.dpi), 1)
         full_span_inches = 0.18
         line_span_inches = 0.01
         circle_radius_inches = 0.03
@@ -271,14 +281,14 @@ page offsets (%d,%d) template offsets (%d,%d)" % (
         image = image.crop(croplist)
         for y in range(0,image.size[1]-full_span_pixels):
             for x in range(circle_radius_pixels, image.size[0]-circle_radius_pixels):
-                if (image.getpixel((x,y))[0] < 128 
-                    and image.getpixel((x-1,y))[0]>=128 
-                    and image.getpixel((x+(2*line_span_pixels),y))[0]>=128):
-                    if ((image.getpixel((x,y+full_span_pixels-4))[0]<128
-                        or image.getpixel((x+1,y+full_span_pixels-4))[0]<128
-                        or image.getpixel((x-1,y+full_span_pixels-4))[0]<128)
-                        and (image.getpixel((x+(2*line_span_pixels),
-                                             y+full_span_pixels - 4))[0]>=128)):
+                if (util.red(image.getpixel((x,y))) < 128 
+                    and util.red(image.getpixel((x-1,y)))>=128 
+                    and util.red(image.getpixel((x+(2*line_span_pixels),y)))>=128):
+                    if ((util.red(image.getpixel((x,y+full_span_pixels-four)))<128
+                        or util.red(image.getpixel((x+1,y+full_span_pixels-four)))<128
+                        or util.red(image.getpixel((x-1,y+full_span_pixels-four)))<128)
+                        and (util.red(image.getpixel((x+(2*line_span_pixels),
+                                             y+full_span_pixels - four)))>=128)):
                         try:
                             for n in range(-3,3,1):
                                 hline = image.crop((x-circle_radius_pixels,
@@ -401,14 +411,21 @@ page offsets (%d,%d) template offsets (%d,%d)" % (
                 lastletter = "W"
         return letters
 
-    def generate_transition_list_from_zones(self,image,regionlist,column_bounds,left,middle):
+    def generate_transition_list_from_zones(self,image,regionlist,column_bounds,left,middle,scheduler=None):
         """ given the pair of zone lists, generate a comprehensive list
 
         We should then be able to merge these sets of split information:
         anything where we find solid black or halftone is a definite break
         which may be followed either by another black or halftone area, by
         a description area, or by a vote area.
+
+        Descriptions are recognized through scheduler, an
+        ocr.OCRScheduler, and are only filled in once it is run; if none
+        is given, one is made and run before returning.
         """
+        own_scheduler = scheduler is None
+        if own_scheduler:
+            scheduler = ocr.OCRScheduler(self.extensions)
         ccontest_default = "No current contest"
         ccontest = ccontest_default
         cjurisdiction_default = "No current jurisdiction"
@@ -447,11 +464,12 @@ page offsets (%d,%d) template offsets (%d,%d)" % (
                                        this_y,
                                        column_bounds[1],
                                        next_y))
-                    cjurisdiction = self.extensions.ocr_engine(crop)
-                    self.log.debug( "Jurisdiction %s" % (cjurisdiction,))
-                    cjurisdiction = self.extensions.ocr_cleaner(cjurisdiction)
-                    cjurisdiction = cjurisdiction.replace("\n","//").strip()
-                    self.log.debug( "Cleaned Jurisdiction %s" % (cjurisdiction,))
+                    def jurisdiction(cjurisdiction):
+                        self.log.debug( "Jurisdiction %s" % (cjurisdiction,))
+                        cjurisdiction = self.extensions.ocr_cleaner(cjurisdiction)
+                        cjurisdiction = cjurisdiction.replace("\n","//").strip()
+                        self.log.debug( "Cleaned Jurisdiction %s" % (cjurisdiction,))
+                    scheduler.add(crop, jurisdiction)
                     # and the current contest is set 
                     # from the descriptive text
                     # at the start of the Yes No Vote area
@@ -468,17 +486,19 @@ page offsets (%d,%d) template offsets (%d,%d)" % (
                                        column_bounds[1],
                                        next_y))
                     crop = Image.eval(crop,elim_halftone)
-                    ccontest = self.extensions.ocr_engine(crop)
-                    ccontest = ccontest.replace("\n","//").strip()
-                    self.log.debug( "Contest %s" % (ccontest,))
-                    ccontest = self.extensions.ocr_cleaner(ccontest)
-                    self.log.debug( "Cleaned Contest %s" % (ccontest,))
                     contest_instance = Ballot.Contest(column_bounds[0],
                                                       this_y,
                                                       column_bounds[1],
                                                       this_y+next_y,
                                                       0,
-                                                      ccontest)
+                                                      None)
+                    def contest(ccontest, contest_instance=contest_instance):
+                        ccontest = ccontest.replace("\n","//").strip()
+                        self.log.debug( "Contest %s" % (ccontest,))
+                        ccontest = self.extensions.ocr_cleaner(ccontest)
+                        self.log.debug( "Cleaned Contest %s" % (ccontest,))
+                        contest_instance.description = ccontest
+                    scheduler.add(crop, contest)
                     regionlist.append(contest_instance)
             if left[n][1]=='W':
                 if this_white_is_votearea:
@@ -487,7 +507,8 @@ page offsets (%d,%d) template offsets (%d,%d)" % (
                                              (column_bounds[0],
                                               this_y,
                                               column_bounds[1],
-                                              next_y))
+                                              next_y),
+                                             scheduler)
                 if this_white_is_yesno:
                     # descriptive text sets current contest,
                     # votes are in stretches where the middle is white
@@ -496,8 +517,11 @@ page offsets (%d,%d) template offsets (%d,%d)" % (
                                                      (column_bounds[0],
                                                       this_y,
                                                       column_bounds[1],
-                                                      next_y))
+                                                      next_y),
+                                                     scheduler)
                 self.log.debug( "White zone at %d to %d %s" % (this_y,next_y,next_zone))
+        if own_scheduler:
+            scheduler.run()
         return regionlist
 
     def get_dark_zones(self,crop):
@@ -522,7 +546,7 @@ page offsets (%d,%d) template offsets (%d,%d)" % (
                 dark_zones.append([dark_start,dark_end])
         return dark_zones
 
-    def get_contests_and_votes_from(self,image,regionlist,croplist):
+    def get_contests_and_votes_from(self,image,regionlist,croplist,scheduler=None):
         """ given an area known to contain votes and desc text, return info
 
         The cropped area will contain contest descriptions and voting areas.
@@ -531,7 +555,12 @@ page offsets (%d,%d) template offsets (%d,%d)" % (
         and then treat every line as either part of a contest or as a vote
         line, depending on whether we find a pattern of white indicating
         the line contains only an oval and a single word, YES or NO.
+
+        As the text decides what each line is, the text of all of the
+        lines is recognized up front, all at once, through scheduler.
         """
+        if scheduler is None:
+            scheduler = ocr.OCRScheduler(self.extensions)
         adj = lambda f: int(round(const.dpi * f))
         oval_offset_into_column = adj(0.14)
         oval_end_offset_into_column = adj(0.39)
@@ -552,6 +581,7 @@ page offsets (%d,%d) template offsets (%d,%d)" % (
         # then text beginning at .38
         dark_zones = self.get_dark_zones(crop)
         contest_created = False
+        zones, zone2stats = [], []
         for dz in dark_zones:
             zonecrop1 = crop.crop((const.dpi/10,
                                     dz[0],
@@ -561,15 +591,16 @@ page offsets (%d,%d) template offsets (%d,%d)" % (
                                     dz[0],
                                     votetext_offset_into_column, 
                                     dz[1]))
-            zone2stat = ImageStat.Stat(zonecrop2)
+            zone2stats.append(ImageStat.Stat(zonecrop2))
             zonecrop3 = crop.crop((votetext_offset_into_column,
                                     dz[0],
                                     votetext_offset_into_column + const.dpi,
                                     dz[1]))
-            zone1text = self.extensions.ocr_engine(zonecrop1)
-            zone1text = self.extensions.ocr_cleaner(zone1text)
-            zone3text = self.extensions.ocr_engine(zonecrop3)
-            zone3text = self.extensions.ocr_cleaner(zone3text)
+            zones.extend((zonecrop1, zonecrop3))
+        texts = [self.extensions.ocr_cleaner(text)
+                    for text in scheduler.map(zones)]
+        for dz, zone2stat, zone1text, zone3text in zip(
+                dark_zones, zone2stats, texts[::2], texts[1::2]):
             intensity_suggests_voteop = False
             length_suggests_voteop = False
             if zone2stat.mean[0]>244: intensity_suggests_voteop = True
@@ -610,7 +641,7 @@ page offsets (%d,%d) template offsets (%d,%d)" % (
                     self.log.debug("Contest string: %s" % (contest_string,))
         return dark_zones
 
-    def get_only_votes_from(self,image,contest_instance,croplist):
+    def get_only_votes_from(self,image,contest_instance,croplist,scheduler=None):
         """ given an area known to contain only votes, return info
 
         The cropped area will contain only voting areas.  Voting areas will
@@ -618,7 +649,13 @@ page offsets (%d,%d) template offsets (%d,%d)" % (
         the ovals will be assigned to each oval based on being at or below
         the oval.
 
+        The text is recognized through scheduler, and the choices are
+        only described once it is run; if none is given, one is made and
+        run before returning.
         """
+        own_scheduler = scheduler is None
+        if own_scheduler:
+            scheduler = ocr.OCRScheduler(self.extensions)
         adj = lambda f: int(round(const.dpi * f))
         oval_offset_into_column = adj(0.14)
         oval_end_offset_into_column = adj(0.39)
@@ -654,10 +691,6 @@ page offsets (%d,%d) template offsets (%d,%d)" % (
                                   dz[0],
                                   crop.size[0]-(const.dpi/10),
                                   ndz[end]))
-            zonetext = self.extensions.ocr_engine(zonecrop)
-            zonetext = self.extensions.ocr_cleaner(zonetext)
-            zonetext = zonetext.strip()
-            zonetext = zonetext.replace("\n","//").strip()
             if blankzonestat.mean[0]>244: 
                 append_x = croplist[0] + adj(0.14)
                 append_y = croplist[1] + dz[0]
@@ -681,11 +714,19 @@ page offsets (%d,%d) template offsets (%d,%d)" % (
                         contig = 0
                 if not found:
                     continue
-                self.log.debug("Appending choice %d %d %s" % (append_x,
-                                                              append_y,
-                                                              zonetext))
-                choice = Ballot.Choice(append_x, append_y, zonetext)
+                choice = Ballot.Choice(append_x, append_y, None)
+                def describe(zonetext, choice=choice):
+                    zonetext = self.extensions.ocr_cleaner(zonetext)
+                    zonetext = zonetext.strip()
+                    zonetext = zonetext.replace("\n","//").strip()
+                    self.log.debug("Appending choice %d %d %s" % (choice.x,
+                                                                  choice.y,
+                                                                  zonetext))
+                    choice.description = zonetext
+                scheduler.add(zonecrop, describe)
                 contest_instance.append(choice)
+        if own_scheduler:
+            scheduler.run()
         return contest_instance
 
     def build_layout(self, page, back=False):
@@ -796,6 +837,8 @@ page offsets (%d,%d) template offsets (%d,%d)" % (
         except IndexError:
             column_width = page.image.size[0] - const.dpi
         regionlist = []
+        # the text of every column is recognized at once, at the end
+        scheduler = ocr.OCRScheduler(self.extensions)
         for cnum, column in enumerate(columns):
             column_x = column[0] - oval_offset_into_column
             # determine the zones at two offsets into the column
@@ -808,8 +851,10 @@ page offsets (%d,%d) template offsets (%d,%d)" % (
                 (column_x,
                 column_x+column_width),
                 left_edge_zones,
-                middle_zones
+                middle_zones,
+                scheduler
                 )
+        scheduler.run()
         return regionlist
 
 def adjust_ulc(image,left_x,top_y,max_adjust=5):
@@ -820,15 +865,15 @@ def adjust_ulc(image,left_x,top_y,max_adjust=5):
     orig_adj = max_adjust
     while max_adjust > 0 and target_intensity > gray50pct:
         max_adjust -= 1
-        left_target_intensity = image.getpixel((left_x-2,top_y))[0]
-        target_intensity = image.getpixel((left_x,top_y))[0]
-        right_target_intensity = image.getpixel((left_x+2,top_y))[0]
-        above_target_intensity = image.getpixel((left_x,top_y-2))[0]
-        above_right_target_intensity = image.getpixel((left_x+2,top_y-2))[0]
-        above_left_target_intensity = image.getpixel((left_x-2,top_y-2))[0]
-        below_target_intensity = image.getpixel((left_x,top_y+2))[0]
-        below_left_target_intensity = image.getpixel((left_x-2,top_y+2))[0]
-        below_right_target_intensity = image.getpixel((left_x+2,top_y+2))[0]
+        left_target_intensity = util.red(image.getpixel((left_x-2,top_y)))
+        target_intensity = util.red(image.getpixel((left_x,top_y)))
+        right_target_intensity = util.red(image.getpixel((left_x+2,top_y)))
+        above_target_intensity = util.red(image.getpixel((left_x,top_y-2)))
+        above_right_target_intensity = util.red(image.getpixel((left_x+2,top_y-2)))
+        above_left_target_intensity = util.red(image.getpixel((left_x-2,top_y-2)))
+        below_target_intensity = util.red(image.getpixel((left_x,top_y+2)))
+        below_left_target_intensity = util.red(image.getpixel((left_x-2,top_y+2)))
+        below_right_target_intensity = util.red(image.getpixel((left_x+2,top_y+2)))
         #print above_left_target_intensity,above_target_intensity,above_right_target_intensity
         #print left_target_intensity,target_intensity,right_target_intensity
         #print below_left_target_intensity,below_target_intensity,below_right_target_intensity
@@ -878,7 +923,7 @@ def timing_marks(image,x,y,dpi=300):
     top_y += half
     for n in range(adj(0.1)):
         pix = image.getpixel((left_x+adj(0.1),top_y + n))
-        if pix[0] > 128:
+        if util.red(pix) > 128:
             top_y = top_y + 1
     code_string = ""
     zero_block_count = 0
@@ -913,7 +958,7 @@ def block_type(image,pixtocheck,x,y):
     """check pixcount pix starting at x,y; return code from avg intensity"""
     intensity = 0
     for testx in range(x,x+pixtocheck):
-        intensity += image.getpixel((testx,y))[0]
+        intensity += util.red(image.getpixel((testx,y)))
     intensity = intensity/pixtocheck
     if intensity > 192:
         retval = 0
@@ -968,7 +1013,7 @@ def column_markers(image,ref_pt,min_runlength_inches=.2,zonelength_inches=.25):
     counter = 0
     while True:
         pix = image.getpixel((startx,top_y))
-        if pix[0]<64: break
+        if util.red(pix)<64: break
         top_y += 1
         counter += 1
         if counter > (const.dpi/10):
@@ -976,13 +1021,13 @@ def column_markers(image,ref_pt,min_runlength_inches=.2,zonelength_inches=.25):
 
     for x in range(startx,endx,incrementx):
         # if we lose the line,
-        if image.getpixel((x,top_y))[0]>64:
+        if util.red(image.getpixel((x,top_y)))>64:
             # go up or down looking for black pixel
-            if image.getpixel((x,top_y-1))[0]<image.getpixel((x,top_y+1))[0]:
+            if util.red(image.getpixel((x,top_y-1)))<util.red(image.getpixel((x,top_y+1))):
                 top_y -= 1
             else:
                 top_y += 1
-        if image.getpixel((x,top_y+twelfth))[0] < 128:
+        if util.red(image.getpixel((x,top_y+twelfth))) < 128:
             black_runlength += 1
             if black_runlength >= min_runlength:
                 if run_backwards:
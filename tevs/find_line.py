@@ -25,8 +25,15 @@ class NoLineException(Exception):
 class BadBlockSeedException(Exception):
     pass
 
+def rgb(p):
+    """return p, or p as all three colors if from a single channel image"""
+    if isinstance(p, int):
+        return p, p, p
+    return p
+
 def difference_exceeds_threshold(p1, p2, threshold):
     """return whether avg diff across colors exceeds spec'd threshold"""
+    p1, p2 = rgb(p1), rgb(p2)
     return (abs(p1[0]-p2[0])
             + abs(p1[1]-p2[1]) 
             + abs(p1[2]-p2[2])) > (3 * threshold)
@@ -64,9 +71,9 @@ def boundary_test(im, x, y, threshold, search_inc=1, black_sufficient=False):
     # we need an option to count black as acceptable
     if black_sufficient:
         try:
-            p0 = im.getpixel((x,y))
-            p1 = im.getpixel((x,y+1))
-            p2 = im.getpixel((x,y+2))
+            p0 = rgb(im.getpixel((x,y)))
+            p1 = rgb(im.getpixel((x,y+1)))
+            p2 = rgb(im.getpixel((x,y+2)))
             if (    (p0[0]+p0[1]+p0[2] < (threshold*3))
                 and (p1[0]+p1[1]+p1[2] < (threshold*3))
                 and (p2[0]+p2[1]+p2[2] < (threshold*3)) ):
@@ -236,25 +243,25 @@ def find_block_extents(im, startx, starty, min_darkness=128):
         raise BadBlockSeedException((startx,starty))
     while(1):
         if startx+xinc >= im.size[0]:break
-        p = im.getpixel((startx+xinc, starty))
+        p = rgb(im.getpixel((startx+xinc, starty)))
         is_dark = ((p[0]+p[1]+p[2]) <= (3*min_darkness))
         if not is_dark: break
         xinc += 1
     while(1):
         if startx-xdec < 0: break
-        p = im.getpixel((startx-xdec, starty))
+        p = rgb(im.getpixel((startx-xdec, starty)))
         is_dark = ((p[0]+p[1]+p[2]) <= (3*min_darkness))
         if not is_dark: break
         xdec += 1
     while(1):
         if starty+yinc >= im.size[1]:break
-        p = im.getpixel((startx, starty+yinc))
+        p = rgb(im.getpixel((startx, starty+yinc)))
         is_dark = ((p[0]+p[1]+p[2]) <= (3*min_darkness))
         if not is_dark: break
         yinc += 1
     while(1):
         if starty-ydec < 0: break
-        p = im.getpixel((startx, starty-ydec))
+        p = rgb(im.getpixel((startx, starty-ydec)))
         is_dark = ((p[0]+p[1]+p[2]) <= (3*min_darkness))
         if not is_dark: break
         ydec += 1
@@ -20,7 +20,10 @@ from hart_util import *
 from hart_build_contests import *
 from hart_barcode import *
 import Ballot
+import deskew
 import const
+import util
+import ocr
 
 from cropstats import cropstats
 
@@ -36,6 +39,7 @@ class HartBallot(Ballot.Ballot):
     """
 
     brand = "Hart"
+    single_channel = True
 
     def __init__(self, images, extensions):
         #convert all our constants to locally correct values
@@ -107,38 +111,46 @@ class HartBallot(Ballot.Ballot):
                                              const.dpi, 
                                              left_starting_x_offset, 
                                              const.dpi/2, const.dpi/2,
-                                             TOP)
+                                             TOP,
+                                             profiles=page.profiles)
         tiltinfo.append(follow_hline_to_corner(page.image, 
                                                const.dpi, 
                                                left_starting_x_offset, 
-                                               hline, LEFT))
+                                               hline, LEFT,
+                                               profiles=page.profiles))
         hline = scan_strips_for_horiz_line_y(page.image, 
                                              const.dpi, 
                                              right_starting_x_offset, 
                                              const.dpi/2, const.dpi/2, 
-                                             TOP)
+                                             TOP,
+                                             profiles=page.profiles)
         tiltinfo.append(follow_hline_to_corner(page.image, 
                                                const.dpi, 
                                                right_starting_x_offset,
-                                               hline, RIGHT))
+                                               hline, RIGHT,
+                                               profiles=page.profiles))
         hline=scan_strips_for_horiz_line_y(page.image, 
                                            const.dpi, 
                                            right_starting_x_offset, 
                                            const.dpi/2, const.dpi/2, 
-                                           BOT)
+                                           BOT,
+                                           profiles=page.profiles)
         tiltinfo.append(follow_hline_to_corner(page.image, 
                                                const.dpi, 
                                                right_starting_x_offset,
-                                               hline, RIGHT))
+                                               hline, RIGHT,
+                                               profiles=page.profiles))
         hline=scan_strips_for_horiz_line_y(page.image, 
                                            const.dpi, 
                                            left_starting_x_offset, 
                                            const.dpi/2, const.dpi/2, 
-                                           BOT)
+                                           BOT,
+                                           profiles=page.profiles)
         tiltinfo.append(follow_hline_to_corner(page.image, 
                                                const.dpi, 
                                                left_starting_x_offset,
-                                               hline, LEFT))
+                                               hline, LEFT,
+                                               profiles=page.profiles))
         # removing PILB call
         #tiltinfo = page.image.gethartlandmarks(const.dpi, 0)
         if tiltinfo is None or tiltinfo[0][0] == 0 or tiltinfo[1][0] == 0:
@@ -206,26 +218,38 @@ class HartBallot(Ballot.Ballot):
             raise Ballot.BallotException("bad yref")
         # pass image, x,y,w,h
         try:
-            barcode = hart_barcode(
+            readings = read_hart_barcode(
                 page.image,
                 page.xoff - third_inch,
                 page.yoff - eighth_inch,
                 sixth_inch,
-                eighth_inch + int(round((15.*const.dpi)/6.)) # bar code 2 1/3"
+                eighth_inch + int(round((15.*const.dpi)/6.)), # bar code 2 1/3"
+                profiles=page.profiles
                 )
         except BarcodeException as e:
             self.log.info("%s %s" % (page.filename,e))
-            barcode = "NOGOOD"
+            readings = []
+        # take the most confident reading that makes sense, in either
+        # direction, falling back to ocr only if none does
+        barcode = "NOGOOD"
+        for reading, confidence in readings:
+            if good_barcode(reading):
+                barcode = reading
+                if confidence < 1.0:
+                    self.log.debug("%s barcode %s read with confidence %.2f" % (
+                        page.filename, barcode, confidence))
+                break
         if not good_barcode(barcode):
             # try getting bar code from ocr of region beneath
             self.log.debug("Barcode no good, trying to get barcode via OCR")
-            zone = page.image.crop((
+            # deskewing just the zone, about its corner found from landmarks
+            zone = deskew.straighten(page.image, page.rot, (
                     page.xoff - third_inch - adj(.05),
                     page.yoff + adj(2.5),
                     page.xoff - adj(.04),
                     page.yoff + adj(4.5)
                     ))
-            zone = zone.rotate(-90) #make it left to right
+            zone = zone.transpose(Image.ROTATE_270) #make it left to right
             barcode = self.extensions.ocr_engine(zone)
 
             #remove OCR errors specific to text guranteed numeric
@@ -250,23 +274,24 @@ class HartBallot(Ballot.Ballot):
         second_third = first_line + (2*width)/3
         print "Warning: assuming three columns"
         print first_line,first_third,second_third,last_line
-        rot90 = image.rotate(-90.)
-        rot90.save("/tmp/rot90.jpg")
+        # search for vertical lines rightward along the middle of the page,
+        # as horizontal lines in the page with rows and columns swapped
+        transposed = deskew.Transposed(image)
         pot_line = [0,0,0,0]
         search_start_y = dpi/3
         vlines = []
         while pot_line is not None:
             try:
-                pot_line = find_line(rot90,
-                                     rot90.size[0]/2,
+                pot_line = find_line(transposed,
+                                     transposed.size[0]/2,
                                      search_start_y,
-                                     search_npixels = (rot90.size[1]/2),
+                                     search_npixels = (transposed.size[1]/2),
                                      threshold=64, 
                                      black_sufficient=True)
                 if pot_line is not None:
                     search_start_y = pot_line[1]+(const.dpi/16)
+                    vlines.append((pot_line[1]+pot_line[3])/2)
                 print pot_line
-                vlines.append((pot_line[1]+pot_line[3])/2)
             except Exception, e:
                 print e
                 pdb.set_trace()
@@ -275,6 +300,8 @@ class HartBallot(Ballot.Ballot):
         column_width = vlines[2] - vlines[1]
         vthop = int(round(const.vote_target_horiz_offset_inches * const.dpi))
         contests = []
+        # recognize the text of every column at once
+        scheduler = ocr.OCRScheduler(self.extensions)
         for vline in vlines[:-1]:
             croplist = (vline,0,vline+column_width,image.size[1])
             crop = image.crop(croplist)
@@ -287,8 +314,10 @@ class HartBallot(Ballot.Ballot):
                                                   vline,
                                                   column_width,
                                                   dpi,
-                                                  extensions = self.extensions)
+                                                  extensions = self.extensions,
+                                                  scheduler = scheduler)
             contests.extend(column_contests)
+        scheduler.run()
         for contest in contests:
             self.log.debug("%d,%d, %s" % (contest.x,contest.y,contest.description))
             #print contest.x, contest.y, contest.description
@@ -318,9 +347,9 @@ class HartBallot(Ballot.Ballot):
         let = const.line_exit_threshold
         for test_x in range(0,crop.size[0]/2):
             if (
-                (crop.getpixel((test_x,test_y1))[0] < let)
-                and (crop.getpixel((test_x,test_y2))[0] < let)
-                and (crop.getpixel((test_x,test_y3))[0] < let)):
+                (util.red(crop.getpixel((test_x,test_y1))) < let)
+                and (util.red(crop.getpixel((test_x,test_y2))) < let)
+                and (util.red(crop.getpixel((test_x,test_y3))) < let)):
                 contig += 1
             if contig >= contig_pixels_required:
                 valid_x = test_x - (contig - 1)
@@ -333,7 +362,7 @@ class HartBallot(Ballot.Ballot):
         valid_top_y = -1
         for test_y in range(crop.size[1]/2,0,-1):
             ok = False
-            if crop.getpixel((valid_x+1,test_y))[0] >= const.line_exit_threshold:
+            if util.red(crop.getpixel((valid_x+1,test_y))) >= const.line_exit_threshold:
                 contig += 1
             if contig > contig_pixels_required:
                 test_top_y = test_y + contig
@@ -343,7 +372,7 @@ class HartBallot(Ballot.Ballot):
                 for test_x in range(valid_x+1,valid_x + (crop.size[0]/4)):
                     # add 1 pix to get back into black, one for slip
                     try:
-                        red = crop.getpixel((test_x,test_top_y+2))[0]
+                        red = util.red(crop.getpixel((test_x,test_top_y+2)))
                     except IndexError as e:
                         self.log.debug("VLA FAILED, returning passed values.")
                         self.log.debug(
@@ -369,7 +398,7 @@ class HartBallot(Ballot.Ballot):
         contig = 0
         valid_bottom_y = crop.size[1]-1
         for test_y in range(crop.size[1]/2,crop.size[1],1):
-            if crop.getpixel((valid_x+1,test_y))[0] >= const.line_exit_threshold:
+            if util.red(crop.getpixel((valid_x+1,test_y))) >= const.line_exit_threshold:
                 contig += 1
             if contig > contig_pixels_required:
                 valid_bottom_y = test_y - contig
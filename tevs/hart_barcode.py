@@ -1,116 +1,87 @@
 # hart_barcode.py
-import Image, ImageStat
+import Image
 import pdb
 import sys
 import logging
+import itertools
+import projection
 
 class BarcodeException(Exception):
     "Raised if barcode not properly interpreted"
     pass
 
-def hart_barcode(image,x,y,w,h):
-    """read a vertical barcode on a hart ballot, as in getbarcode in PILB"""
-    whites_list = []
-    blacks_list = []
-    whitethresh = 128
-    croplist = (x,y,x+w,y+h)
-    crop = image.crop(croplist)
-    # 1) scan down all lines, deciding white or black
-    firsttime = True
-    lastwhite = True
-    whitecount = 0
-    blackcount = 0
-    for y in range(crop.size[1]-1,0,-1):
-        linecroplist = (0,y,crop.size[0],y+1)
-        linecrop = crop.crop(linecroplist)
-        linemean = ImageStat.Stat(linecrop).mean[0]
-        if linemean > whitethresh:
-            if lastwhite:
-                whitecount += 1
-            else:
-                blacks_list.append(blackcount)
-                blackcount = 0
-                whitecount = 1
-                lastwhite = True
-        else:
-            if not lastwhite:
-                blackcount += 1
-            else:
-                if firsttime: firsttime = False
-                else:
-                    whites_list.append(whitecount)
-                    whitecount = 0
-                    blackcount = 1
-                    lastwhite = False
-    # 2) determine average length of blacks, whites;
-    # replace original lengths with True for narrow, False for wide
-    bsum = 0
-    avg = 0
-    for b in blacks_list:
-        bsum += b
-    try:
-        avg = bsum/len(blacks_list)
-    except ZeroDivisionError:
-        raise BarcodeException("No black stripes found in barcode region.")
+whitethresh = 128
 
-    # convert wide -->True, narrow-->False
-    blacks_list = map(lambda el: el >= avg, blacks_list)    
-    wsum = 0
-    avg = 0
-    whites_list = whites_list[1:]
-    for w in whites_list:
-        wsum += w
-    try:
-        avg = wsum/len(whites_list)
-    except ZeroDivisionError:
+def _runs(image, x, y, w, h, profiles=None):
+    """the stripes of the barcode zone x, y, w, h of image from the bottom
+    up, as a list of (white, rows) runs, from the mean of each row"""
+    rows = projection.of(image, profiles).rows(x, x + w)
+    means = [rows.mean(r) for r in range(y + h - 1, y - 1, -1)]
+    return [(white, len(list(run)))
+        for white, run in itertools.groupby(m > whitethresh for m in means)]
+
+def _decode(runs):
+    """Decode the barcode from runs, as from _runs, in reading order.
+    Returns the barcode and the fraction of the start group and digit
+    groups that were well formed, or (None, 0.0) if runs is too short."""
+    # trim the white margins (not part of bar code)
+    while runs and runs[0][0]:
+        runs = runs[1:]
+    while runs and runs[-1][0]:
+        runs = runs[:-1]
+    blacks = [n for white, n in runs if not white]
+    whites = [n for white, n in runs if white]
+    if not blacks:
+        raise BarcodeException("No black stripes found in barcode region.")
+    if not whites:
         raise BarcodeException("No white stripes found in barcode region.")
-    # after trimming initial white (not part of bar code)
-    # first two whites, first two blacks must be narrow 
     # convert wide -->True, narrow-->False
-    whites_list = map(lambda el: el >= avg, whites_list)
+    bavg = sum(blacks)/len(blacks)
+    blacks = [b >= bavg for b in blacks]
+    wavg = sum(whites)/len(whites)
+    whites = [w >= wavg for w in whites]
+    if len(blacks) < 37 or len(whites) < 37:
+        return None, 0.0
     # first two whites, first two blacks should be narrow (False)
-    if (blacks_list[0] 
-            or blacks_list[1] 
-            or whites_list[0] 
-            or whites_list[1]):
-        logging.getLogger('').debug("Problem with bar code: not finding start group.")
+    checks = [not (blacks[0] or blacks[1] or whites[0] or whites[1])]
     # process seven groups of five blacks, five whites
     # expect exactly two wides
-    values = [0,0,0,0,0,0,0, 0,0,0,0,0,0,0]
-    try:
-        for group in range(7):
-            bvalue = 0
-            wvalue = 0
-            if blacks_list[2+(group*5)+0]:
-                bvalue += 1
-            if blacks_list[2+(group*5)+1]:
-                bvalue += 2
-            if blacks_list[2+(group*5)+2]:
-                bvalue += 4
-            if blacks_list[2+(group*5)+3]:
-                bvalue += 7
-            if bvalue == 11: bvalue = 0
+    values = []
+    for group in range(7):
+        for wides in (blacks, whites):
+            code = wides[2+(group*5):7+(group*5)]
+            value = sum(weight for weight, wide in zip((1, 2, 4, 7), code)
+                if wide)
+            if value == 11: value = 0
+            values.append("%d" % value)
+            checks.append(code.count(True) == 2)
+    return "".join(values), checks.count(True)/float(len(checks))
+
+def read_hart_barcode(image, x, y, w, h, profiles=None):
+    """Read the vertical barcode in the zone x, y, w, h of image, from the
+    bottom up and, should the code be upside down, from the top down, from
+    the same runs of light and dark rows. profiles are the projection
+    Profiles of image, if already computed.
 
-            if whites_list[2+(group*5)+0]:
-                wvalue += 1
-            if whites_list[2+(group*5)+1]:
-                wvalue += 2
-            if whites_list[2+(group*5)+2]:
-                wvalue += 4
-            if whites_list[2+(group*5)+3]:
-                wvalue += 7
-            if wvalue == 11: wvalue = 0
-            values[group*2] = bvalue
-            values[1+(group*2)] = wvalue
-    
-        retval = "%d%d%d%d%d%d%d%d%d%d%d%d%d%d" % (
-            values[0],values[1],values[2],values[3],
-            values[4],values[5],values[6],values[7],
-            values[8],values[9],values[10],values[11],values[12],values[13]
-            )
-    except IndexError:
-        retval = "FLIP?"
-    return (retval)
+    Returns a list of (barcode, confidence) for each direction that could
+    be decoded, most confident first, where confidence is the fraction of
+    the groups of stripes that were well formed."""
+    runs = _runs(image, x, y, w, h, profiles)
+    readings = []
+    for ordered in (runs, runs[::-1]):
+        barcode, confidence = _decode(ordered)
+        if barcode is not None:
+            readings.append((barcode, confidence))
+    readings.sort(key=lambda r: r[1], reverse=True)
+    return readings
+
+def hart_barcode(image,x,y,w,h):
+    """read a vertical barcode on a hart ballot, as in getbarcode in PILB"""
+    readings = read_hart_barcode(image, x, y, w, h)
+    if not readings:
+        logging.getLogger('').debug("Problem with bar code: too few stripes.")
+        return "FLIP?"
+    return readings[0][0]
 
 if __name__ == "__main__":
     if len(sys.argv)<6:
@@ -120,13 +91,11 @@ if __name__ == "__main__":
     x,y,w,h = int(sys.argv[2]),int(sys.argv[3]),int(sys.argv[4]),int(sys.argv[5])
     print x,y,w,h
     try:
-        barcode = hart_barcode(image,x,y,w,h)
+        readings = read_hart_barcode(image,x,y,w,h)
     except BarcodeException as e:
         print e
-        barcode = "NOBARCODE"
+        readings = []
         pdb.set_trace()
-    print "Barcode",barcode
-    if barcode == "FLIP?":
-        barcode = hart_barcode(image.rotate(180),x,y,w,h)
-        print "Barcode of flip",barcode
+    for barcode, confidence in readings:
+        print "Barcode",barcode,"confidence",confidence
     sys.exit(0)
@@ -7,8 +7,16 @@ import logging
 from line_util import *
 from hart_util import *
 
-def hart_build_contests(image, pot_hlines, vboxes, column_start, column_width, dpi=300,extensions=None):
-    """Merge horiz lines and vote boxes to get contests and choice offsets."""
+def hart_build_contests(image, pot_hlines, vboxes, column_start, column_width, dpi=300,extensions=None,scheduler=None):
+    """Merge horiz lines and vote boxes to get contests and choice offsets.
+
+    The text of the contests and choices is recognized through scheduler,
+    an ocr.OCRScheduler, so that several columns can share one. If no
+    scheduler is given, one is made and run before returning."""
+    own_scheduler = scheduler is None
+    if own_scheduler:
+        scheduler = ocr.OCRScheduler(extensions)
+    first_line_of = lambda text: ocr.clean_ocr_text(text).split("/")[0]
     regionlist = []
     contest_description_zones = []
     last_contest = 0
@@ -28,16 +36,15 @@ def hart_build_contests(image, pot_hlines, vboxes, column_start, column_width, d
                            contest[0],
                            column_start + column_width,
                            contest[1]))
-        # get text
-        zonetext = ocr.tesseract(crop)
-        zonetext = ocr.clean_ocr_text(zonetext)
-        # create Contest, append to regionlist
-        regionlist.append(Ballot.Contest(column_start,
-                                         contest[0],
-                                         column_start + column_width,
-                                         contest[1],
-                                         0,
-                                         zonetext))
+        # create Contest, append to regionlist, get text later
+        rcontest = Ballot.Contest(column_start,
+                                  contest[0],
+                                  column_start + column_width,
+                                  contest[1],
+                                  0,
+                                  None)
+        scheduler.describe(rcontest, crop, ocr.clean_ocr_text)
+        regionlist.append(rcontest)
 
     contest_description_zones.reverse()
     for vbox in vboxes:
@@ -48,27 +55,24 @@ def hart_build_contests(image, pot_hlines, vboxes, column_start, column_width, d
             # first contest above vbox gets vbox as choice
             if contest[0] < vbox[1]:
                 #print "Vbox at",vbox[1],"in contest at",contest
-                # crop area to right of vbox
-                # get and clean text
-                crop = image.crop((vbox[0] + dpi/3 + dpi/30, #!!!
-                                            vbox[1] - dpi/100, #!!!
-                                            vbox[0]+column_width-(dpi/2), #!!!
-                                            vbox[1]+(dpi/2)))
-                choice_text = ocr.tesseract(crop) #!!!
-                # take only first line of choice
-                choice_text = ocr.clean_ocr_text(choice_text).split("/")[0]
-
                 # search regionlist for matching Contest, append
                 #match.append(Ballot.Choice(...,choice_text))
                 for rcontest in regionlist:
                     if rcontest.y == contest[0] and rcontest.x == column_start:
-                        rcontest.append(Ballot.Choice(
-                                vbox[0],
-                                vbox[1],
-                                choice_text)
-                                        )
+                        choice = Ballot.Choice(vbox[0], vbox[1], None)
+                        # crop area to right of vbox
+                        # take only first line of choice
+                        crop = image.crop((vbox[0] + dpi/3 + dpi/30, #!!!
+                                            vbox[1] - dpi/100, #!!!
+                                            vbox[0]+column_width-(dpi/2), #!!!
+                                            vbox[1]+(dpi/2)))
+                        scheduler.describe(choice, crop, first_line_of)
+                        rcontest.append(choice)
                         break
                 break
+    if not own_scheduler:
+        return regionlist
+    scheduler.run()
     logger = logging.getLogger('')
     for contest in regionlist:
         logger.info("%d %d %s" % (contest.x, contest.y, contest.description))
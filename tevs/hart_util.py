@@ -1,6 +1,7 @@
 import pdb
 import sys
 import Image
+import util
 
 def check_for_votebox_at(image,dpi,x,y):
     """ Given a location with a black pixel, see if there's a votebox.
@@ -28,7 +29,7 @@ def check_for_votebox_at(image,dpi,x,y):
     for test_x in range(range_start,range_end,1):
         p1 = image.getpixel((test_x,y1))
         p2 = image.getpixel((test_x,y2))
-        if p1[0]<128 and p2[0]<128:
+        if util.red(p1)<128 and util.red(p2)<128:
             if init_x == 0: init_x = test_x
             dark += 1
             if dark > quarter_inch:
@@ -40,13 +41,13 @@ def check_for_votebox_at(image,dpi,x,y):
     # if you've passed, try moving left by up to 1/32" until first white 
     for test_x in range(x,x-(dpi/32),-1):
         p = image.getpixel((test_x,y1))
-        if p[0]>128: break
+        if util.red(p)>128: break
         init_x = test_x
     # and try moving up by up to 1/32" until first white 
     new_y1 = y1
     for test_y in range(y1,y1-(dpi/32),-1):
         p = image.getpixel((init_x,test_y))
-        if p[0]>128: break
+        if util.red(p)>128: break
         new_y1 = test_y
     y1 = new_y1
     
@@ -57,7 +58,7 @@ def check_for_votebox_at(image,dpi,x,y):
         p0 = image.getpixel((init_x-hundredth_inch,test_y))
         p1 = image.getpixel((init_x,test_y))
         p2 = image.getpixel((init_x+hundredth_inch,test_y))
-        if p0[0]<128 or p1[0]<128 or p2[0]<128:
+        if util.red(p0)<128 or util.red(p1)<128 or util.red(p2)<128:
             if init_y == 0: init_y = test_y
             dark += 1
             if dark > tenth_inch:
@@ -70,7 +71,7 @@ def check_for_votebox_at(image,dpi,x,y):
     light = 0
     for test_y in range(y1,y2,1):
         p0 = image.getpixel((init_x-(2*hundredth_inch),test_y))
-        if p0[0]>128:
+        if util.red(p0)>128:
             light += 1
             if light > tenth_inch:
                 break
@@ -111,14 +112,14 @@ def gethartvoteboxes(image,startx,starty,dpi):
             skip -= 1
             continue
         p = image.getpixel((x,y))
-        if p[0]<128:
+        if util.red(p)<128:
             a,b = check_for_votebox_at(image,dpi,x,y)
             if a>0 and b>0:
                 votebox_list.append((a,b))
                 skip = minimum_box_top_to_top
         else:
             p2 = image.getpixel((x2,y))
-            if p2[0]<128:
+            if util.red(p2)<128:
                 a,b = check_for_votebox_at(image,dpi,x2,y)
                 if a>0 and b>0:
                     votebox_list.append((a,b))
@@ -1,8 +1,9 @@
 import sys
 import pdb
 import const
+import util
 import Image
-import ImageStat
+import projection
 
 """
 find_hline just checks for a dark region 1/3" long.
@@ -26,12 +27,17 @@ then beginning line test at discovered dark pixel.
 Speed up by using lines_connect only if the y offsets are not within 1 pix,
 instead using stat test for darkness for the low tilt case.
 
+Sped up by reading intensities from projection profiles of the image
+(see projection.py) instead of cropping a strip at each position. Each
+function takes the Profiles of the image as an optional last argument,
+so that they can be shared between searches of the same image.
+
 """
 class LineUtilException(Exception):
     "Raised if analysis of a line cannot continue"
     pass
 
-def follow_hline_to_corner(image,dpi,startx,hline,left=True):
+def follow_hline_to_corner(image,dpi,startx,hline,left=True,profiles=None):
     """Follow a dark line in a direction until it's not dark.
 
     Follow the line in image at y hline in one direction, tracking it
@@ -45,30 +51,26 @@ def follow_hline_to_corner(image,dpi,startx,hline,left=True):
         endx = image.size[0] - dpi/30
         incr = 1
 
+    profiles = projection.of(image, profiles)
     lastred = 0
     possible = False
     for x in range(startx,endx,incr):
+        # the three pixels above and the three below the line
+        band = profiles.columns(hline - 3, hline + 3)
         # test for end of line by confirming 
         # no dark red pixels in next 3 moves
         if possible:
-            croplist = (min(x,x+3*incr),hline-3,max(x,x+3*incr),hline+3)
-            crop = image.crop(croplist)
-            stat = ImageStat.Stat(crop)
-            thisred = stat.extrema[0][0]
+            thisred = band.min(min(x,x+3*incr),max(x,x+3*incr))
             if thisred >= const.line_exit_threshold:
                 retval = (x,hline)
                 break
         else:
             possible = False
-        croplist = (x,hline - 3,x+1,hline+3)
-        crop = image.crop(croplist)
-        stat = ImageStat.Stat(crop)
-        thisred = stat.extrema[0][0]
-        data = crop.getdata()
+        thisred = band.min(x)
         # if the top is darker than the bottom, move up a pixel,
         # or vice versa
-        line_top_brightness = data[0][0]+data[1][0]+data[2][0] 
-        line_bottom_brightness = data[3][0]+data[4][0]+data[5][0]
+        line_top_brightness = profiles.columns(hline - 3, hline).sum(x)
+        line_bottom_brightness = profiles.columns(hline, hline + 3).sum(x)
         if line_top_brightness > (line_bottom_brightness+5):
             hline += 1
         elif (line_top_brightness+5) < line_bottom_brightness: 
@@ -84,7 +86,8 @@ def follow_hline_to_corner(image,dpi,startx,hline,left=True):
         lastred = thisred
     return retval
 
-def find_hline(image,dpi,starting_x_offset,starting_y_offset=150,top=True):
+def find_hline(image,dpi,starting_x_offset,starting_y_offset=150,top=True,
+               profiles=None):
     """ Scan inboard for a sharp drop in avg intensity of center 1/3 inch.
 
     Line detection is a search for a sharp drop in the average intensity
@@ -102,14 +105,10 @@ def find_hline(image,dpi,starting_x_offset,starting_y_offset=150,top=True):
         starty = image.size[1] - starting_y_offset
         endy = image.size[1] - dpi
         incr = -1
+    rows = projection.of(image, profiles).rows((image.size[0]/2) - one_sixth,
+                                               (image.size[0]/2) + one_sixth)
     for y in range(starty,endy,incr):
-        croplist = ((image.size[0]/2) - one_sixth,
-                    y,
-                    (image.size[0]/2) + one_sixth,
-                    y + 1)
-        crop = image.crop(croplist)
-        stat = ImageStat.Stat(crop)
-        thisred = int(stat.mean[0])
+        thisred = int(rows.mean(y))
         # a line must be below a threshold and should
         # be substantially darker than the area just before; how substantial
         # will be a tuned value, trying 32 for starters
@@ -150,15 +149,15 @@ def lines_connect(image,a,b,allowed_misses=1):
         p = image.getpixel((x,y))
         p_above = image.getpixel((x,y-1))
         p_below = image.getpixel((x,y+1))
-        if ((p[0] >= const.line_exit_threshold)
-            and (p_above[0] >= const.line_exit_threshold)
-            and (p_below[0] >= const.line_exit_threshold)): 
+        if ((util.red(p) >= const.line_exit_threshold)
+            and (util.red(p_above) >= const.line_exit_threshold)
+            and (util.red(p_below) >= const.line_exit_threshold)): 
             problem_count += 1
             if problem_count > allowed_misses: 
                 break
     return (problem_count <= allowed_misses)
 
-def scan_strips_for_horiz_line_y(image,dpi,starting_x_offset, starting_y_offset=150,height_to_scan=300,top=True):
+def scan_strips_for_horiz_line_y(image,dpi,starting_x_offset, starting_y_offset=150,height_to_scan=300,top=True,profiles=None):
     """ Scan inboard for a sharp drop in avg intensity of center 1/3 inch.
 
     Line detection is a search for a sharp drop in the average intensity
@@ -187,7 +186,7 @@ def scan_strips_for_horiz_line_y(image,dpi,starting_x_offset, starting_y_offset=
     adj_start = starty
     for y in range(starty,endy,incr):
         p = image.getpixel((starting_x_offset,y))
-        if p[0] <= const.line_darkness_threshold:
+        if util.red(p) <= const.line_darkness_threshold:
             adj_start = y - incr
             break
     starty = adj_start
@@ -198,23 +197,16 @@ def scan_strips_for_horiz_line_y(image,dpi,starting_x_offset, starting_y_offset=
         ):
         raise LineUtilException("Starting x offset for line following is too close to edge of image.")
     #main test
+    profiles = projection.of(image, profiles)
+    rows1 = profiles.rows(starting_x_offset - 2*one_sixth,
+                          starting_x_offset - one_sixth)
+    rows2 = profiles.rows(starting_x_offset + one_sixth,
+                          starting_x_offset + 2*one_sixth)
     for y in range(starty,endy,incr):
         y1 = min(y,y+incr+incr)
         y2 = max(y,y+incr+incr)
-        croplist1 = (starting_x_offset - 2*one_sixth,
-                    y1,
-                    starting_x_offset - one_sixth,
-                    y2)
-        croplist2 = (starting_x_offset + one_sixth,
-                    y1,
-                    starting_x_offset + 2*one_sixth,
-                    y2)
-        crop1 = image.crop(croplist1)
-        stat1 = ImageStat.Stat(crop1)
-        crop2 = image.crop(croplist2)
-        stat2 = ImageStat.Stat(crop2)
-        thisred1 = int(stat1.mean[0])
-        thisred2 = int(stat2.mean[0])
+        thisred1 = int(rows1.mean(y1, y2))
+        thisred2 = int(rows2.mean(y1, y2))
         # a line must be in the bottom half of intensity and should
         # be substantially darker than the area just before; how substantial
         # will be a tuned value, trying 32 for starters
@@ -244,7 +236,7 @@ def scan_strips_for_horiz_line_y(image,dpi,starting_x_offset, starting_y_offset=
         return 0
     return retval
 
-def scan_strip_for_dash_y(image,dpi,starting_x_offset, starting_y_offset=150,height_to_scan=300,top=True):
+def scan_strip_for_dash_y(image,dpi,starting_x_offset, starting_y_offset=150,height_to_scan=300,top=True,profiles=None):
     """ Scan inboard for a sharp drop in avg intensity of center 1/3 inch.
 
     Dash detection is a search for a sharp drop in the average intensity
@@ -274,23 +266,19 @@ def scan_strip_for_dash_y(image,dpi,starting_x_offset, starting_y_offset=150,hei
     for y in range(starty,endy,incr):
         p1 = image.getpixel((starting_x_offset,y))
         p2 = image.getpixel((starting_x_offset+(dpi/10),y))
-        if p1[0] <= ldt or p2[0] <= ldt:
+        if util.red(p1) <= ldt or util.red(p2) <= ldt:
             adj_start = y - incr
             break
     starty = adj_start
 
     #main test; we will span 1/4" which should result in including a full dash
     test_height = (incr*dpi)/100
+    rows1 = projection.of(image, profiles).rows(starting_x_offset,
+                                                starting_x_offset + (dpi/4))
     for y in range(starty,endy,test_height):
         y1 = min(y,y+test_height)
         y2 = max(y,y+test_height)
-        croplist1 = (starting_x_offset,
-                    y1,
-                    starting_x_offset + (dpi/4),
-                    y2)
-        crop1 = image.crop(croplist1)
-        stat1 = ImageStat.Stat(crop1)
-        thisred1 = int(stat1.mean[0])
+        thisred1 = int(rows1.mean(y1, y2))
         # a dash must be in the bottom half of intensity and should
         # be substantially darker than the area just before; how substantial
         # will be a tuned value, trying 32 for starters
@@ -301,7 +289,7 @@ def scan_strip_for_dash_y(image,dpi,starting_x_offset, starting_y_offset=150,hei
         lastred1 = thisred1
     return retval
 
-def find_all_horiz_lines(image,dpi):
+def find_all_horiz_lines(image,dpi,profiles=None):
     """ Find all horizontal lines spanning image from 1" down to 1/2" from bot 
 
     with assumption that an hline is very horizontal, with a sharp light/dark
@@ -314,13 +302,13 @@ def find_all_horiz_lines(image,dpi):
     skip = 0
     ldt = const.line_darkness_threshold
     let = const.line_exit_threshold
+    rows = projection.of(image, profiles).rows(image.size[0]-dpi,
+                                               image.size[0])
     for y in range((dpi/2),image.size[1]-(dpi/2),1):
         if skip > 0: 
             skip -= 1
             continue
-        crop = image.crop((image.size[0]-dpi, y, image.size[0], y+1))
-        stat = ImageStat.Stat(crop)
-        red = stat.mean[0]
+        red = rows.mean(y)
         if red <= ldt and lastred >= let and (lastred-red)>32:
             pot_hlines.append(y)
             # count on lines being separated by at least 1/36"
@@ -5,8 +5,10 @@ import pdb
 import shutil
 import errno
 import getopt
+import signal
 import logging
 import gc
+import multiprocessing
 import site; site.addsitedir(os.path.expanduser("~/tevs")) 
 import Image, ImageStat, ImageDraw 
 
@@ -15,6 +17,14 @@ import config
 import util
 import db
 import next
+import ocr
+import write_behind
+import prefetch
+import composite
+import metrics
+import profiling
+import watch
+import vops
 import Ballot
 BallotException = Ballot.BallotException
 
@@ -22,20 +32,28 @@ def get_args():
     """Get command line arguments"""
     try:
         opts, args = getopt.getopt(sys.argv[1:],
-                                    "tdc:",
+                                    "tdc:w:pW",
                                     ["templates",
                                      "debug",
-                                     "config="
+                                     "config=",
+                                     "workers=",
+                                     "profile",
+                                     "profile-every=",
+                                     "watch"
                                     ]
                                    ) 
     except getopt.GetoptError:
         #note that logging doesn't exist yet
         sys.stderr.write(
-            "usage: %s -tdc --templates --debug --config=file" % sys.argv[0]
+            "usage: %s -tdcwpW --templates --debug --config=file --workers=N "
+            "--profile --profile-every=N --watch" % sys.argv[0]
         )
         sys.exit(2)
     templates_only = False
     debug = False
+    workers = 1
+    profile, profile_every = False, 10
+    watching = False
     config = "tevs.cfg"
     for opt, arg in opts:
         if opt in ("-t", "--templates"):
@@ -44,9 +62,29 @@ def get_args():
             debug = True
         if opt in ("-c", "--config"):
             config = arg
+        if opt in ("-w", "--workers"):
+            try:
+                workers = max(1, int(arg))
+            except ValueError:
+                sys.stderr.write("--workers requires a number\n")
+                sys.exit(2)
+        if opt in ("-p", "--profile"):
+            profile = True
+        if opt == "--profile-every":
+            try:
+                profile, profile_every = True, max(1, int(arg))
+            except ValueError:
+                sys.stderr.write("--profile-every requires a number\n")
+                sys.exit(2)
+        if opt in ("-W", "--watch"):
+            watching = True
 
     const.templates_only = templates_only
     const.debug = debug
+    const.workers = workers
+    const.profile = profile
+    const.profile_every = profile_every
+    const.watch = watching
     return config
 
 def remove_partial(fname):
@@ -69,6 +107,23 @@ def dirn(dir, n): # where dir is the "unrooted" name
 def filen(dir, n): #where dir is from dirn
     return os.path.join(dir, "%06d" % n)
 
+def unproc_names(n):
+    "the names of the images of ballot n before it is processed"
+    return [incomingn(n + m) for m in range(const.num_pages)]
+
+def proc_names(n):
+    "the names of the images of ballot n once it has been processed"
+    return [filen(dirn("proc", n), n + m) + const.filename_extension
+        for m in range(const.num_pages)]
+
+#the next.Journal of the progress of this process, if any
+journal = None
+
+def record(n, state):
+    "note in the journal, if any, that ballot n has reached state"
+    if journal is not None:
+        journal.record(n, state)
+
 def mark_error(e, *files):
     log = logging.getLogger('')
     if e is not None:
@@ -81,23 +136,279 @@ def mark_error(e, *files):
             log.error("Could not copy unprocessable file to errors dir")
     return len(files)
 
-def results_to_vop_files(results,resultsfilename):
-    """Save all ovals from a list of Votedata"""
-    for r in results:
-        label = "%s_%04d_%04d_%s_%s.jpg" % (
-            resultsfilename,
-            r.coords[0],
-            r.coords[1],
-            "V" if r.was_voted else "v",
-            "A" if r.ambiguous else "a"
-        )
+def make_dirs():
+    "create initial top level dirs, if they do not exist"
+    for p in (
+        "%s" % ("templates"), 
+        "%s%d" % ("template_images",  os.getpid()), 
+        "%s%d" % ("composite_images", os.getpid()), 
+        "results", 
+        "proc",
+        "errors"):
+        util.mkdirp(util.root(p))
+
+def connect_db():
+    "connect to the database named in tevs.cfg, or a NullDB if not used"
+    if const.use_db:
         try:
-            if r.image is not None:
-                r.image.save(label)
+            return db.PostgresDB(const.dbname, const.dbuser,
+                group=const.db_group)
+        except db.DatabaseError:
+            util.fatal("Could not connect to database")
+    return db.NullDB()
+
+def process_ballot(n, ballotfrom, extensions, dbc, writer=None,
+        prefetcher=None, profiler=None):
+    """Extract, record, and move the ballot starting at image number n.
+    Returns None if there is no such ballot in the incoming tree, otherwise
+    the pair of the number of images processed and left unprocessed.
+
+    If writer, a write_behind.WriteBehind, is given, recording and moving
+    the ballot is handed to it and may not have happened yet on return. If
+    prefetcher, a prefetch.Prefetcher, is given, the images are taken from
+    it. If profiler, a profiling.Profiler, is given, it is told of the
+    analysis of the ballot."""
+    log = logging.getLogger('')
+    base = os.path.basename
+    gc.collect()
+    unprocs = unproc_names(n)
+    if not os.path.exists(unprocs[0]):
+        log.info(base(unprocs[0]) + " does not exist. No more records to process")
+        return None
+    if journal is not None and journal.done(n):
+        log.info("%d was already processed", n)
+        return 0, 0
+    #for i, f in enumerate(unprocs[1:]):
+    #    if not os.path.exists(f):
+    #        log.info(base(f) + " does not exist. Cannot proceed.")
+    #        for j in range(i):
+    #            log.info(base(unprocs[j]) + " will NOT be processed")
+    #        total_unproc += mark_error(None, *unprocs[:i-1])
+            
+
+    #Processing
+
+    log.info("Processing %s:\n %s" % 
+        (n, "\n".join("\t%s" % base(u) for u in unprocs))
+    )
+
+    pages = unprocs
+    if prefetcher is not None:
+        pages = prefetcher.get(n)
+    if profiler is not None:
+        profiler.start(n)
+    record(n, "claimed")
+    try:
+        with metrics.timer("ballot"):
+            ballot = ballotfrom(pages, extensions)
+            results = ballot.ProcessPages()
+    except BallotException as e:
+        metrics.error(e)
+        log.exception("Could not process ballot")
+        unproc = mark_error(e, *unprocs)
+        record(n, "failed")
+        return 0, unproc
+    finally:
+        if profiler is not None:
+            profiler.stop()
+    record(n, "extracted")
+
+    csv = Ballot.results_to_CSV(results)
+    #moz = Ballot.results_to_mosaic(results)
+    
+    #Write all data
+
+    #make dirs:
+    proc1d = dirn("proc", n)
+    resultsd = dirn("results", n)
+    resultsfilename = filen(resultsd, n)
+    procs = proc_names(n)
+
+    def write():
+        for p in (proc1d, resultsd):
+            util.mkdirp(p)
+        try:
+            with metrics.timer("save_vops"):
+                vops.save(resultsfilename + ".vops", results)
         except Exception as e:
+            metrics.error(e)
             print e
+        #write csv and mosaic
+        util.genwriteto(resultsfilename + ".txt", csv)
+
+    def commit():
+        _uncommitted.append((n, unprocs, procs, resultsfilename))
+        #write to the database
+        try:
+            with metrics.timer("db_insert"):
+                committed = dbc.insert(ballot)
+        except db.DatabaseError as e:
+            metrics.error(e)
+            #dbc does not commit if there is an error, just need to remove 
+            #partial files
+            remove_uncommitted()
+            util.fatal("Could not commit vote information to database")
+
+        #Post-processing
+
+        # move the images from unproc to proc, if the db has committed them
+        if committed:
+            move_committed()
+        metrics.ballot(const.num_pages)
+        log.info("%d images processed", const.num_pages)
+
+    if writer is None:
+        write()
+        commit()
+    else:
+        writer.put(write, commit)
+    return const.num_pages, 0
+
+#ballots whose votes the database has not committed yet, as their number,
+#unproc names, proc names, and results file name; see db.PostgresDB's group
+_uncommitted = []
+
+def move_committed():
+    "move the images of every ballot in _uncommitted from unproc to proc"
+    while _uncommitted:
+        n, unprocs, procs, _ = _uncommitted.pop(0)
+        record(n, "committed")
+        with metrics.timer("move"):
+            for a, b in zip(unprocs, procs):
+                try:
+                    os.rename(a, b)
+                except OSError as e:
+                    util.fatal("Could not rename %s", a)
+        record(n, "moved")
+
+def remove_uncommitted():
+    """remove the results of every ballot in _uncommitted, leaving it in
+    unproc. The journal has not marked them done, so they are processed
+    again by the next run, however far this one has got."""
+    log = logging.getLogger('')
+    while _uncommitted:
+        n, _, _, resultsfilename = _uncommitted.pop(0)
+        remove_partial(resultsfilename + ".txt")
+        remove_partial(resultsfilename + ".vops")
+        remove_partial(resultsfilename + const.filename_extension)
+        log.warning("Ballot %d was not committed and will be processed again",
+            n)
+
+def start_writer():
+    "a write_behind.WriteBehind as configured, or None"
+    if const.write_behind_threads > 0:
+        return write_behind.WriteBehind(const.write_behind_threads,
+            const.write_behind_depth)
+    return None
+
+def start_prefetcher(ballotfrom):
+    "a prefetch.Prefetcher for ballotfrom ballots as configured, or None"
+    if const.prefetch > 0:
+        names = lambda n: [incomingn(n + m) for m in range(const.num_pages)]
+        return prefetch.Prefetcher(names, const.num_pages,
+            ahead=const.prefetch, threads=const.prefetch,
+            mode=Ballot.image_mode(ballotfrom))
+    return None
+
+def start_profiler():
+    "a profiling.Profiler if --profile was given, or None"
+    if const.profile:
+        return profiling.Profiler(util.root("profile"), const.profile_every)
+    return None
+
+def start_watcher():
+    """a watch.Watcher of the incoming tree if --watch was given, or None;
+    SIGTERM and SIGINT stop it once the ballot at hand is finished"""
+    if not const.watch:
+        return None
+    watcher = watch.Watcher(unproc_names)
+    def stop(signum, frame):
+        logging.getLogger('').info("Stopping after this ballot")
+        watcher.stop()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    return watcher
+
+def stop_writer(writer, reraise=True):
+    "wait for writer, if any, to finish everything it was given"
+    if writer is not None:
+        writer.close(reraise)
+
+def flush_db(dbc):
+    "commit anything dbc is holding on to and move the committed ballots"
+    try:
+        with metrics.timer("db_flush"):
+            dbc.flush()
+    except db.DatabaseError as e:
+        metrics.error(e)
+        logging.getLogger('').exception(
+            "Could not commit vote information to database")
+        remove_uncommitted()
+        return
+    move_committed()
+
+#ballots handed to a worker at a time in --workers mode; a worker that finds
+#no images in a whole batch assumes it has run out of records
+batch_size = 10
+
+def _work(start):
+    """Body of each worker process in --workers mode: claim batches of
+    ballots starting from start and process each batch in order until an
+    entire batch is missing, skipping any the journal says are done.
+    Returns the number of images processed and left unprocessed, the first
+    ballot number of the empty batch, the claim files created so the parent
+    can release them, and the pid of the worker, whose composite images the
+    parent merges."""
+    global journal
+    make_dirs()
+    # everything that holds a db connection or per-pid state must be made
+    # after the fork
+    ballotfrom = Ballot.LoadBallotType(const.layout_brand)
+    cache = Ballot.TemplateCache(util.root("templates"),
+        const.template_cache_size, const.template_format == "binary")
+    extensions = Ballot.Extensions(template_cache=cache)
+    dbc = connect_db()
+    writer = start_writer()
+    prefetcher = start_prefetcher(ballotfrom)
+    profiler = start_profiler()
+    journal = next.Journal(util.root("journal.txt"), const.num_pages)
+    claims = next.Claims(util.root("claims"), start, const.num_pages, batch_size)
+    proc, unproc, stop = 0, 0, None
+    try:
+        for batch in claims:
+            seen = False
+            for n in batch:
+                counts = process_ballot(n, ballotfrom, extensions, dbc,
+                    writer, prefetcher, profiler)
+                if counts is None:
+                    continue
+                seen = True
+                proc += counts[0]
+                unproc += counts[1]
+            if not seen:
+                stop = batch[0]
+                break
+        stop_writer(writer)
+    except SystemExit:
+        # util.fatal exits, which would silently lose this worker's task
+        raise RuntimeError("worker %d could not continue" % os.getpid())
+    finally:
+        # on error, still record what was handed over before flushing
+        stop_writer(writer, False)
+        if prefetcher is not None:
+            prefetcher.close()
+        cache.save_all()
+        composite.flush()
+        flush_db(dbc)
+        dbc.close()
+        metrics.flush()
+        if profiler is not None:
+            profiler.close()
+        journal.close()
+    return proc, unproc, stop, claims.claimed, os.getpid()
 
 def main():
+    global journal
     miss_counter = 0
     # get command line arguments
     cfg_file = get_args()
@@ -107,125 +418,129 @@ def main():
     util.mkdirp(const.root)
     log = config.logger(const.logfilename)
 
-    #create initial top level dirs, if they do not exist
-    for p in (
-        "%s" % ("templates"), 
-        "%s%d" % ("template_images",  os.getpid()), 
-        "%s%d" % ("composite_images", os.getpid()), 
-        "results", 
-        "proc",
-        "errors"):
-        util.mkdirp(util.root(p))
+    make_dirs()
 
-    next_ballot = next.File(util.root("nexttoprocess.txt"), const.num_pages)
+    # pick up where the last run left off, finishing any ballot it had
+    # committed but not yet moved
+    journal = next_ballot = next.Journal(util.root("journal.txt"),
+        const.num_pages, util.root("nexttoprocess.txt"))
+    moved = journal.reconcile(unproc_names, proc_names)
+    if moved:
+        log.info("Finished moving %d ballots from the last run", len(moved))
 
     try:
         ballotfrom = Ballot.LoadBallotType(const.layout_brand)
     except KeyError as e:
         util.fatal("No such ballot type: " + const.layout_brand + ": check " + cfg_file)
 
+    if const.workers > 1:
+        if const.watch:
+            util.fatal("--watch cannot be used with --workers")
+        return main_workers(next_ballot)
+
     # allow all instances to share a common template location,
     # though need per-pid locs for template_images and composite_images
-    cache = Ballot.TemplateCache(util.root("templates"))
+    cache = Ballot.TemplateCache(util.root("templates"),
+        const.template_cache_size, const.template_format == "binary")
     extensions = Ballot.Extensions(template_cache=cache)
+    # fork the OCR workers while this is the only thread
+    ocr.tesseract_pool.start()
    
     # connect to db and open cursor
-    if const.use_db:
-        try:
-            dbc = db.PostgresDB(const.dbname, const.dbuser)
-        except db.DatabaseError:
-            util.fatal("Could not connect to database")
-    else:
-        dbc = db.NullDB()
+    dbc = connect_db()
+    # record ballots in the background while the next is analyzed
+    writer = start_writer()
+    # and read the images of the next ballots while this one is analyzed,
+    # unless waiting for each ballot to arrive, when they are not there yet
+    watcher = start_watcher()
+    prefetcher = None
+    if watcher is None:
+        prefetcher = start_prefetcher(ballotfrom)
+    # and profile and watch the memory of the analysis if asked to
+    profiler = start_profiler()
 
     total_proc, total_unproc = 0, 0
-    base = os.path.basename
     # While ballot images exist in the directory specified in tevs.cfg,
     # create ballot from images, get landmarks, get layout code, get votes.
     # Write votes to database and results directory.  Repeat.
-    #from guppy import hpy;hp=hpy();hp.setref();import gc;gc.disable();gc.collect();hp.setref()
+    # With --watch, wait for each ballot to arrive until told to stop.
     try:
         for n in next_ballot:
-            gc.collect()
-            unprocs = [incomingn(n + m) for m in range(const.num_pages)]
-            if not os.path.exists(unprocs[0]):
+            if watcher is not None and not watcher.wait(n):
+                break
+            counts = process_ballot(n, ballotfrom, extensions, dbc,
+                writer, prefetcher, profiler)
+            if counts is None:
                 miss_counter += 1
-                log.info(base(unprocs[0]) + " does not exist. No more records to process")
                 if miss_counter > 10:
                     break
                 continue
-            #for i, f in enumerate(unprocs[1:]):
-            #    if not os.path.exists(f):
-            #        log.info(base(f) + " does not exist. Cannot proceed.")
-            #        for j in range(i):
-            #            log.info(base(unprocs[j]) + " will NOT be processed")
-            #        total_unproc += mark_error(None, *unprocs[:i-1])
-                    
-
-            #Processing
-
-            log.info("Processing %s:\n %s" % 
-                (n, "\n".join("\t%s" % base(u) for u in unprocs))
-            )
-
-            try:
-                ballot = ballotfrom(unprocs, extensions)
-                results = ballot.ProcessPages()
-            except BallotException as e:
-                total_unproc += mark_error(e, *unprocs)
-                log.exception("Could not process ballot")
-                continue
-
-            csv = Ballot.results_to_CSV(results)
-            #moz = Ballot.results_to_mosaic(results)
-            
-            #Write all data
-
-            #make dirs:
-            proc1d = dirn("proc", n)
-            resultsd = dirn("results", n)
-            resultsfilename = filen(resultsd, n)
-            for p in (proc1d, resultsd):
-                util.mkdirp(p)
-            try:
-                results_to_vop_files(results,resultsfilename)
-            except Exception as e:
-                print e
-            #write csv and mosaic
-            util.genwriteto(resultsfilename + ".txt", csv)
-            #write to the database
-            try:
-                dbc.insert(ballot)
-            except db.DatabaseError:
-                #dbc does not commit if there is an error, just need to remove 
-                #partial files
-                remove_partial(resultsfilename + ".txt")
-                remove_partial(resultsfilename + const.filename_extension)
-                util.fatal("Could not commit vote information to database")
-
-            #Post-processing
-
-            # move the images from unproc to proc
-            procs = [filen(proc1d, n + m) + const.filename_extension
-                        for m in range(const.num_pages)]
-            for a, b in zip(unprocs, procs):
-                try:
-                    os.rename(a, b)
-                except OSError as e:
-                    util.fatal("Could not rename %s", a)
-            total_proc += const.num_pages
-            log.info("%d images processed", const.num_pages)
-            #hp.heap().dump('prof.hpy');hp.setref();gc.collect();hp.setref();hp.heap().dump('prof.hpy')
+            total_proc += counts[0]
+            total_unproc += counts[1]
+        stop_writer(writer)
     finally:
+        # on error, still record what was handed over before flushing
+        stop_writer(writer, False)
+        if prefetcher is not None:
+            prefetcher.close()
+        if watcher is not None:
+            watcher.close()
         cache.save_all()
+        composite.flush()
+        flush_db(dbc)
         dbc.close()
+        metrics.flush()
+        if profiler is not None:
+            profiler.close()
+        ocr.tesseract_pool.close()
+        next_ballot.save()
+        log.info("%d images processed", total_proc)
+        if total_unproc > 0:
+            log.warning("%d images NOT processed.", total_unproc)
+
+def main_workers(next_ballot):
+    """Fan ballot processing out over const.workers processes. Each worker
+    claims batches of ballot numbers so that no ballot is processed twice,
+    even by other copies of this program sharing the same root, and the
+    totals are collected here when every worker has run out of ballots."""
+    log = logging.getLogger('')
+    log.info("Processing with %d workers", const.workers)
+    start = next_ballot.next
+    claims = next.Claims(util.root("claims"), start, const.num_pages, batch_size)
+    # batches claimed by a run that crashed or was killed are free again
+    for fname in claims.reap():
+        log.warning("Removed the stale claim %s", fname)
+    # and so are the metrics of its workers
+    metrics.remove_workers()
+    pool = multiprocessing.Pool(const.workers)
+    total_proc, total_unproc = 0, 0
+    pids = set()
+    try:
+        for proc, unproc, _, claimed, pid in pool.imap_unordered(
+                _work, [start] * const.workers):
+            total_proc += proc
+            total_unproc += unproc
+            claims.claimed.extend(claimed)
+            pids.add(pid)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        claims.release()
+        # and so are those of workers that died before handing theirs back
+        claims.reap()
+        # so the last numbers of the workers are not exported forever
+        metrics.remove_workers()
+        # the workers have journaled every ballot they finished
         next_ballot.save()
         log.info("%d images processed", total_proc)
         if total_unproc > 0:
             log.warning("%d images NOT processed.", total_unproc)
+    if const.save_composite_images:
+        # combine the composites saved by each worker
+        composite.merge(sorted(pids))
 
 if __name__ == "__main__":
     main()
-    #import cProfile as profile
-    #profile.Profile.bias = 3.15e-6
-    #profile.run('main()', 'prof.%s' % sys.argv[1])
@@ -0,0 +1,282 @@
+"""metrics.py times the stages of processing each ballot and counts what
+happens along the way, so that operators can watch throughput while a run
+is going instead of only seeing the number of images processed at the end.
+
+Stage times go into histograms; ballots and images processed, template
+cache hits and misses, OCR zones and errors by exception type go into
+counters; and the ballots processed per minute over the last few minutes
+are kept as a gauge. Every so often, and when the run ends, all of them are
+written to const.metrics_file in the Prometheus text format, for the
+textfile collector of node_exporter to pick up.
+
+Each process keeps its own Metrics. A pool worker process, as in
+main.py's --workers mode, writes its own file, with its pid before the
+extension, and labels everything it writes with worker="<pid>". Those files
+are removed once the pool is done with, by remove_workers, so that the
+numbers of workers that are gone are not exported forever.
+"""
+import os
+import re
+import time
+import bisect
+import logging
+import threading
+import multiprocessing
+from collections import deque
+
+import const
+
+__all__ = ['Metrics', 'metrics', 'timer', 'timed', 'count', 'error',
+    'ballot', 'flush', 'remove_workers']
+
+# upper bounds in seconds of the buckets of each stage histogram
+buckets = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+def _labels(labels):
+    "labels, a sequence of (name, value) pairs, in the Prometheus format"
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\")
+        .replace('"', '\\"').replace("\n", "\\n")) for k, v in labels)
+
+class _Histogram(object):
+    "the count of observations at or below each bucket, their sum and count"
+    def __init__(self):
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class _Timer(object):
+    "a context manager observing the seconds spent in it as stage"
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.stage, time.time() - self.start)
+        return False
+
+class Metrics(object):
+    """Stage histograms, counters and the recent throughput of one process.
+    If path is given, a thread writes them there every interval seconds
+    until close. labels are added to everything written. The ballots per
+    minute are measured over the last window seconds. All methods may be
+    called from any thread."""
+    def __init__(self, path=None, interval=15, labels=(), window=300):
+        self.path = path
+        self.interval = interval
+        self.labels = tuple(labels)
+        self.window = window
+        self.histograms = {}
+        self.counters = {}
+        self.recent = deque() #(time, images) of each recent ballot
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.log = logging.getLogger('')
+        self.done = threading.Event()
+        self.thread = None
+        if path is not None and interval > 0:
+            self.thread = threading.Thread(target=self._write_loop,
+                name="metrics")
+            self.thread.daemon = True
+            self.thread.start()
+
+    def observe(self, stage, seconds):
+        "record that stage took seconds"
+        with self.lock:
+            h = self.histograms.get(stage)
+            if h is None:
+                h = self.histograms[stage] = _Histogram()
+            h.observe(seconds)
+
+    def timer(self, stage):
+        "a context manager that observes the time spent in it as stage"
+        return _Timer(self, stage)
+
+    def count(self, name, n=1, **labels):
+        "add n to counter name with labels"
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def error(self, e):
+        "count the exception e by its type"
+        self.count("errors", type=type(e).__name__)
+
+    def ballot(self, images):
+        "record that a ballot of images images has been processed"
+        now = time.time()
+        self.count("ballots")
+        self.count("images", images)
+        with self.lock:
+            self.recent.append((now, images))
+            self._expire(now)
+
+    def _expire(self, now):
+        while self.recent and self.recent[0][0] < now - self.window:
+            self.recent.popleft()
+
+    def per_minute(self, now=None):
+        "ballots processed per minute over the last window seconds"
+        if now is None:
+            now = time.time()
+        with self.lock:
+            self._expire(now)
+            ballots = len(self.recent)
+        # early in a run, only count the time since it started
+        seconds = min(self.window, max(now - self.started, 1))
+        return ballots * 60.0 / seconds
+
+    def text(self):
+        "everything recorded so far in the Prometheus text format"
+        now = time.time()
+        per_minute = self.per_minute(now)
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+            histograms = [(stage, list(h.counts), h.sum, h.count)
+                for stage, h in histograms]
+        const_labels = self.labels
+        out = []
+        def line(name, labels, value):
+            out.append("tevs_%s%s %r" % (name,
+                _labels(const_labels + tuple(labels)), float(value)))
+
+        out.append("# HELP tevs_stage_seconds Time spent in each stage "
+            "of processing a ballot.")
+        out.append("# TYPE tevs_stage_seconds histogram")
+        for stage, counts, total, n in histograms:
+            cumulative = 0
+            for bound, c in zip(buckets + ("+Inf",), counts):
+                cumulative += c
+                line("stage_seconds_bucket",
+                    (("stage", stage), ("le", bound)), cumulative)
+            line("stage_seconds_sum", (("stage", stage),), total)
+            line("stage_seconds_count", (("stage", stage),), n)
+
+        names = []
+        for (name, _), _ in counters:
+            if name not in names:
+                names.append(name)
+        for name in names:
+            out.append("# TYPE tevs_%s_total counter" % name)
+            for (n, labels), value in counters:
+                if n == name:
+                    line(name + "_total", labels, value)
+
+        out.append("# HELP tevs_ballots_per_minute Ballots processed per "
+            "minute over the last %d seconds." % self.window)
+        out.append("# TYPE tevs_ballots_per_minute gauge")
+        line("ballots_per_minute", (), per_minute)
+        out.append("# TYPE tevs_metrics_updated_timestamp_seconds gauge")
+        line("metrics_updated_timestamp_seconds", (), now)
+        return "\n".join(out) + "\n"
+
+    def write(self):
+        """write everything recorded to path, replacing it at once so that
+        nothing reading it sees half a file"""
+        if self.path is None:
+            return
+        tmp = "%s.%d.tmp" % (self.path, os.getpid())
+        try:
+            f = open(tmp, "w")
+            try:
+                f.write(self.text())
+            finally:
+                f.close()
+            os.rename(tmp, self.path)
+        except (IOError, OSError):
+            self.log.exception("Could not write metrics to %s", self.path)
+
+    def _write_loop(self):
+        while not self.done.wait(self.interval):
+            self.write()
+
+    def close(self):
+        "stop writing periodically and write everything one last time"
+        self.done.set()
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join()
+        self.write()
+
+_metrics = [None, None] #(pid, Metrics)
+
+def metrics():
+    """The Metrics of this process, written to const.metrics_file, if set,
+    every const.metrics_interval seconds. A process forked from one with
+    Metrics gets its own, and a pool worker writes its own file."""
+    pid = os.getpid()
+    if _metrics[0] != pid:
+        path = getattr(const, "metrics_file", None)
+        labels = ()
+        if path is not None and multiprocessing.current_process().daemon:
+            base, ext = os.path.splitext(path)
+            path = "%s.%d%s" % (base, pid, ext)
+            labels = (("worker", pid),)
+        _metrics[:2] = pid, Metrics(path,
+            getattr(const, "metrics_interval", 15), labels)
+    return _metrics[1]
+
+def timer(stage):
+    "a context manager timing stage in the Metrics of this process"
+    return metrics().timer(stage)
+
+def timed(stage):
+    "decorate a function so that each call is timed as stage"
+    def decorate(f):
+        def timed_f(*args, **kw):
+            with timer(stage):
+                return f(*args, **kw)
+        timed_f.__name__ = f.__name__
+        timed_f.__doc__ = f.__doc__
+        return timed_f
+    return decorate
+
+def count(name, n=1, **labels):
+    "add n to counter name with labels in the Metrics of this process"
+    metrics().count(name, n, **labels)
+
+def error(e):
+    "count the exception e by its type in the Metrics of this process"
+    metrics().error(e)
+
+def ballot(images):
+    "record a ballot of images images processed by this process"
+    metrics().ballot(images)
+
+def flush():
+    "write out and stop the Metrics of this process, if it has any"
+    if _metrics[0] == os.getpid():
+        _metrics[1].close()
+
+def remove_workers():
+    """remove the files written by pool workers next to const.metrics_file,
+    returning their names"""
+    path = getattr(const, "metrics_file", None)
+    if path is None:
+        return []
+    directory, name = os.path.split(path)
+    base, ext = os.path.splitext(name)
+    worker = re.compile(r"%s\.\d+%s$" % (re.escape(base), re.escape(ext)))
+    removed = []
+    try:
+        names = os.listdir(directory or ".")
+    except OSError:
+        return removed
+    for name in names:
+        if worker.match(name):
+            try:
+                os.unlink(os.path.join(directory, name))
+            except OSError:
+                continue
+            removed.append(os.path.join(directory, name))
+    return removed
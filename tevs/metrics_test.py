@@ -0,0 +1,63 @@
+import os
+import tempfile
+import metrics
+
+def text_test():
+    m = metrics.Metrics(labels=(("worker", 7),))
+    for seconds in (.001, .2, .2, 100):
+        m.observe("BuildLayout", seconds)
+    m.count("template_cache", result="hit")
+    m.count("template_cache", 2, result="hit")
+    m.error(KeyError("x"))
+    m.ballot(2)
+    lines = m.text().splitlines()
+    def value(sample):
+        for line in lines:
+            if line.startswith(sample + " "):
+                return float(line.split()[-1])
+    stage = 'tevs_stage_seconds_%s{worker="7",stage="BuildLayout"%s}'
+    assert value(stage % ("bucket", ',le="0.005"')) == 1
+    assert value(stage % ("bucket", ',le="0.25"')) == 3
+    assert value(stage % ("bucket", ',le="60"')) == 3
+    assert value(stage % ("bucket", ',le="+Inf"')) == 4
+    assert value(stage % ("count", "")) == 4
+    assert abs(value(stage % ("sum", "")) - 100.401) < 1e-9
+    assert value('tevs_template_cache_total{worker="7",result="hit"}') == 3
+    assert value('tevs_errors_total{worker="7",type="KeyError"}') == 1
+    assert value('tevs_ballots_total{worker="7"}') == 1
+    assert value('tevs_images_total{worker="7"}') == 2
+    assert value('tevs_ballots_per_minute{worker="7"}') > 0
+
+def write_test():
+    d = tempfile.mkdtemp()
+    path = os.path.join(d, "tevs.prom")
+    try:
+        m = metrics.Metrics(path, interval=3600)
+        with m.timer("move"):
+            pass
+        m.close()
+        assert not m.thread.is_alive()
+        assert os.listdir(d) == ["tevs.prom"]
+        assert 'stage="move"' in open(path).read()
+    finally:
+        for f in os.listdir(d):
+            os.unlink(os.path.join(d, f))
+        os.rmdir(d)
+
+def remove_workers_test():
+    d = tempfile.mkdtemp()
+    saved = getattr(metrics.const, "metrics_file", None)
+    metrics.const.metrics_file = os.path.join(d, "tevs.prom")
+    try:
+        for name in ("tevs.prom", "tevs.123.prom", "tevs.45.prom",
+                "tevs.123.prom.123.tmp", "other.6.prom"):
+            open(os.path.join(d, name), "w").close()
+        assert sorted(metrics.remove_workers()) == [
+            os.path.join(d, "tevs.123.prom"), os.path.join(d, "tevs.45.prom")]
+        assert sorted(os.listdir(d)) == [
+            "other.6.prom", "tevs.123.prom.123.tmp", "tevs.prom"]
+    finally:
+        metrics.const.metrics_file = saved
+        for f in os.listdir(d):
+            os.unlink(os.path.join(d, f))
+        os.rmdir(d)
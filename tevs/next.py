@@ -1,4 +1,7 @@
 import copy
+import os
+import errno
+import time
 
 import util
 
@@ -60,6 +63,225 @@ class IncrementingFile(object):
     def save(self):
         util.writeto(self.next_file, str(self.next))
 
+class Claims(object):
+    """Hand out batches of ballot numbers to any number of cooperating
+    processes. A batch belongs to whichever process first creates its claim
+    file in claim_dir, so several extractors can walk the same unproc tree
+    without processing a ballot twice. Iterating yields lists of the ballot
+    numbers in each batch this process managed to claim."""
+    def __init__(self, claim_dir, start, inc, batch):
+        self.claim_dir = claim_dir
+        self.start, self.inc, self.batch = start, inc, batch
+        self.claimed = []
+        util.mkdirp(claim_dir)
+
+    def claim(self, first):
+        "atomically claim the batch starting at first, True on success"
+        fname = os.path.join(self.claim_dir, "%06d" % first)
+        try:
+            fd = os.open(fname, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                return False
+            raise
+        os.write(fd, str(os.getpid()))
+        os.close(fd)
+        self.claimed.append(fname)
+        return True
+
+    def __iter__(self):
+        step = self.inc * self.batch
+        first = self.start
+        while True:
+            if self.claim(first):
+                yield range(first, first + step, self.inc)
+            first += step
+
+    def __repr__(self):
+        return "claims in %s from %d by %d" % (
+            self.claim_dir, self.start, self.inc * self.batch)
+
+    def release(self, claimed=None):
+        "remove the claim files of claimed, or of every batch we claimed"
+        if claimed is None:
+            claimed = self.claimed
+        for fname in claimed:
+            util.rmf(fname)
+
+    def reap(self, grace=60):
+        """Remove the claim files of processes that are no longer running,
+        as left by a run that crashed or was killed, so that their batches
+        can be claimed again. A claim file with no pid in it yet is only
+        removed once it is grace seconds old. Returns the names removed."""
+        reaped = []
+        for name in sorted(os.listdir(self.claim_dir)):
+            fname = os.path.join(self.claim_dir, name)
+            try:
+                pid = int(util.readfrom(fname, ""))
+            except ValueError:
+                try:
+                    if time.time() - os.stat(fname).st_mtime < grace:
+                        continue
+                except OSError:
+                    continue
+            else:
+                if _running(pid):
+                    continue
+            util.rmf(fname)
+            reaped.append(fname)
+        return reaped
+
+def _running(pid):
+    "whether a process with pid is running"
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+class Journal(object):
+    """The progress of extraction, kept as an append only log so that it
+    survives a crash. Each line of journal_file is a ballot number and the
+    state that ballot has reached: claimed when its analysis starts,
+    extracted when its analysis is done, committed when the database has
+    its votes, moved when its images are in proc, or failed when it could
+    not be processed and was copied to errors. The lines of the finished
+    states, the only ones resuming depends on, are on disk before record
+    returns; the others are left to the operating system. A torn last line
+    is ignored.
+
+    next is the first ballot, counting by inc, not yet committed, moved or
+    failed; it starts from a "next" line of the journal, or failing that
+    from next_file, as left by File. Iterating yields next and every ballot
+    after it that is not yet done, skipping those finished out of order.
+    save compacts the journal to what is still needed to resume and also
+    writes next to next_file, for anything still reading it."""
+    states = ("claimed", "extracted", "committed", "moved", "failed")
+    finished = ("committed", "moved", "failed")
+
+    def __init__(self, journal_file, inc, next_file=None):
+        self.journal_file = journal_file
+        self.next_file = next_file
+        self.inc = inc
+        self.next = None
+        self._load()
+        if self.next is None:
+            self.next = 1
+            if next_file is not None:
+                self.next = int(util.readfrom(next_file, 1))
+        self.log = open(journal_file, "a")
+        if self.torn:
+            # end the torn line so that it does not run into the next
+            self.log.write("\n")
+
+    def _load(self):
+        "read the journal, including what other processes have added to it"
+        self.state = {}
+        self.torn = False
+        try:
+            with open(self.journal_file) as f:
+                for line in f:
+                    self._replay(line)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def _replay(self, line):
+        if not line.endswith("\n"):
+            self.torn = True #by a crash while writing
+            return
+        fields = line.split()
+        try:
+            if len(fields) == 2 and fields[0] == "next":
+                self.next = int(fields[1])
+            elif len(fields) == 2 and fields[1] in self.states:
+                self.state[int(fields[0])] = fields[1]
+        except ValueError:
+            pass
+
+    def record(self, n, state):
+        """note that ballot n has reached state, on disk before returning if
+        it is a finished state"""
+        if state not in self.states:
+            raise ValueError("unknown ballot state %r" % (state,))
+        self.state[n] = state
+        self.log.write("%d %s\n" % (n, state))
+        self.log.flush()
+        if state in self.finished:
+            os.fsync(self.log.fileno())
+
+    def done(self, n):
+        "whether ballot n is committed, moved or failed"
+        return self.state.get(n) in self.finished
+
+    def _advance(self):
+        while self.done(self.next):
+            self.next += self.inc
+
+    def reconcile(self, unproc, proc):
+        """Bring the journal up to date with the files after a crash.
+        unproc(n) and proc(n) are the lists of the names of the images of
+        ballot n before and after it is moved. A committed ballot still in
+        unproc is moved now, since the database already has its votes, and
+        a ballot found in proc but not in unproc, such as one moved by a run
+        that crashed before saying so, is moved. Returns the ballots moved
+        here."""
+        def exist(names):
+            return all(os.path.exists(name) for name in names)
+        moved = []
+        for n in sorted(self.state):
+            if self.state[n] != "committed":
+                continue
+            for a, b in zip(unproc(n), proc(n)):
+                if os.path.exists(a) and not os.path.exists(b):
+                    os.rename(a, b)
+            moved.append(n)
+            self.record(n, "moved")
+        self._advance()
+        while exist(proc(self.next)) and not exist(unproc(self.next)):
+            moved.append(self.next)
+            self.record(self.next, "moved")
+            self._advance()
+        return moved
+
+    def __iter__(self):
+        self._advance()
+        n = self.next
+        while True:
+            if not self.done(n):
+                yield n
+            n += self.inc
+
+    def __repr__(self):
+        return "%s with inc %d and next %d" % (
+            self.journal_file, self.inc, self.next)
+
+    def save(self):
+        """Rewrite the journal as just next and the ballots after it that
+        are done, and write next to next_file. Nothing else may be recording
+        to the journal while it is saved."""
+        start = self.next
+        self._load()
+        self.next = max(self.next, start)
+        self._advance()
+        self.state = dict((n, s) for n, s in self.state.iteritems()
+            if n > self.next and s in self.finished)
+        tmp = "%s.%d" % (self.journal_file, os.getpid())
+        with open(tmp, "w") as f:
+            f.write("next %d\n" % self.next)
+            for n in sorted(self.state):
+                f.write("%d %s\n" % (n, self.state[n]))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, self.journal_file)
+        self.log.close()
+        self.log = open(self.journal_file, "a")
+        if self.next_file is not None:
+            util.writeto(self.next_file, str(self.next))
+
+    def close(self):
+        self.log.close()
+
 class Simple(object):
     def __init__(self, start=0, inc=1):
         self.start, self.inc = start, inc
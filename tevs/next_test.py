@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import next
+
+def _names(d, where):
+    return lambda n: [os.path.join(d, where, "%06d.jpg" % (n + m))
+        for m in range(2)]
+
+def _touch(names):
+    for name in names:
+        open(name, "w").close()
+
+def journal_test():
+    d = tempfile.mkdtemp()
+    try:
+        for where in ("unproc", "proc"):
+            os.mkdir(os.path.join(d, where))
+        unproc, proc = _names(d, "unproc"), _names(d, "proc")
+        jfile = os.path.join(d, "journal.txt")
+        nfile = os.path.join(d, "nexttoprocess.txt")
+        open(nfile, "w").write("3")
+        j = next.Journal(jfile, 2, nfile)
+        assert j.next == 3
+        j.record(3, "claimed")
+        j.record(3, "extracted")
+        j.record(3, "committed")
+        j.record(5, "claimed")
+        j.record(7, "failed")
+        j.close()
+        # a crash while writing
+        open(jfile, "a").write("5 extr")
+        for n in (3, 5, 7, 9, 11):
+            _touch(unproc(n))
+        # moved by a run that crashed before it could say so
+        os.unlink(unproc(9)[0])
+        os.unlink(unproc(9)[1])
+        _touch(proc(9))
+
+        j = next.Journal(jfile, 2, nfile)
+        assert j.state[5] == "claimed"
+        assert j.reconcile(unproc, proc) == [3]
+        assert all(os.path.exists(f) for f in proc(3))
+        assert not any(os.path.exists(f) for f in unproc(3))
+        assert j.next == 5
+        assert next.Journal(jfile, 2).state[3] == "moved"
+        it = iter(j)
+        assert [it.next() for _ in range(3)] == [5, 9, 11]
+        j.record(5, "moved")
+        j.save()
+        assert open(nfile).read().strip() == "9"
+        j.close()
+
+        j = next.Journal(jfile, 2, nfile)
+        assert j.reconcile(unproc, proc) == [9]
+        assert j.next == 11
+        j.close()
+    finally:
+        shutil.rmtree(d)
+
+def reap_test():
+    d = tempfile.mkdtemp()
+    try:
+        claims = next.Claims(d, 1, 2, 10)
+        claims.claim(1)
+        # a process that has exited, as a worker killed with its claim
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0)
+        os.waitpid(pid, 0)
+        open(os.path.join(d, "000021"), "w").write(str(pid))
+        # being claimed right now
+        open(os.path.join(d, "000041"), "w").close()
+        assert claims.reap() == [os.path.join(d, "000021")]
+        assert sorted(os.listdir(d)) == ["000001", "000041"]
+        assert claims.reap(grace=-1) == [os.path.join(d, "000041")]
+        assert [batch[0] for batch, _ in zip(claims, range(2))] == [21, 41]
+    finally:
+        shutil.rmtree(d)
+
+def uncommitted_test():
+    # a group of ballots the database failed to commit, ahead of one it had
+    d = tempfile.mkdtemp()
+    try:
+        jfile = os.path.join(d, "journal.txt")
+        j = next.Journal(jfile, 2)
+        for n in (1, 3, 5):
+            j.record(n, "extracted")
+        j.record(7, "moved")
+        j.save()
+        j.close()
+        j = next.Journal(jfile, 2)
+        assert j.next == 1
+        it = iter(j)
+        assert [it.next() for _ in range(4)] == [1, 3, 5, 9]
+        j.close()
+    finally:
+        shutil.rmtree(d)
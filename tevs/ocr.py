@@ -4,9 +4,17 @@ import subprocess
 import uuid
 import re
 import logging
+import hashlib
+import ctypes
+import ctypes.util
+import multiprocessing
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
+import Image
 import const
 import util
+import metrics
 
 class OCRException(Exception):
     "Raised if OCR fails"
@@ -45,6 +53,230 @@ def tesseract(zone):
             util.rmf(ft + p)
     return "".join(c for c in text if ord(c)<128)
 
+class _LibTesseract(object):
+    """tesseract's C API, loaded through ctypes, so that a zone is handed to
+    tesseract in memory instead of through files and a fork per zone. Each
+    instance is one tesseract, which must only be used by one thread."""
+    def __init__(self, language="eng"):
+        name = ctypes.util.find_library("tesseract")
+        if name is None:
+            raise OSError("no libtesseract")
+        lib = ctypes.CDLL(name)
+        lib.TessBaseAPICreate.restype = ctypes.c_void_p
+        lib.TessBaseAPIInit3.argtypes = [ctypes.c_void_p, ctypes.c_char_p,
+            ctypes.c_char_p]
+        lib.TessBaseAPISetImage.argtypes = [ctypes.c_void_p, ctypes.c_char_p,
+            ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int]
+        lib.TessBaseAPIGetUTF8Text.argtypes = [ctypes.c_void_p]
+        lib.TessBaseAPIGetUTF8Text.restype = ctypes.c_void_p
+        lib.TessDeleteText.argtypes = [ctypes.c_void_p]
+        lib.TessBaseAPIDelete.argtypes = [ctypes.c_void_p]
+        self.lib = lib
+        self.api = lib.TessBaseAPICreate()
+        if lib.TessBaseAPIInit3(self.api, None, language) != 0:
+            lib.TessBaseAPIDelete(self.api)
+            raise OSError("could not start libtesseract for " + language)
+
+    def __call__(self, zone):
+        "run tesseract on Image zone"
+        if zone.mode not in ("L", "RGB"):
+            zone = zone.convert("L")
+        depth = len(zone.getbands())
+        w, h = zone.size
+        self.lib.TessBaseAPISetImage(self.api, zone.tostring(), w, h,
+            depth, w * depth)
+        text = self.lib.TessBaseAPIGetUTF8Text(self.api)
+        if not text:
+            raise OCRException("OCR failed")
+        try:
+            return "".join(c for c in ctypes.string_at(text) if ord(c)<128)
+        finally:
+            self.lib.TessDeleteText(text)
+
+#this process's _LibTesseract, False if it cannot be loaded, with the pid it
+#was made in; as with composite.composites, one made before a fork is not used
+_lib = (None, None)
+
+def recognize(zone):
+    """run tesseract on Image zone in this process, through libtesseract if
+    it can be loaded, falling back on running the tesseract program"""
+    global _lib
+    engine, pid = _lib
+    if pid != os.getpid():
+        try:
+            engine = _LibTesseract()
+        except (OSError, AttributeError) as e:
+            # AttributeError from ctypes if the library is too old
+            log.info("Running the tesseract program, no libtesseract: %s", e)
+            engine = False
+        _lib = engine, os.getpid()
+    if engine:
+        return engine(zone)
+    return tesseract(zone)
+
+def _tesseract_pixels(mode, size, data):
+    "run tesseract on the zone described by mode, size, and its raw data"
+    return recognize(Image.fromstring(mode, size, data))
+
+def zone_key(zone):
+    "a hash of the pixels of zone, identical zones have identical keys"
+    h = hashlib.sha1("%s %dx%d " % ((zone.mode,) + zone.size))
+    h.update(zone.tostring())
+    return h.hexdigest()
+
+class TesseractPool(object):
+    """An OCR engine that can be used anywhere tesseract can. It keeps a pool
+    of long lived worker processes, each with its own tesseract loaded from
+    libtesseract, so zones are recognized side by side without forking
+    anything per zone; the pixels of each zone are sent to a worker over a
+    pipe and handed to tesseract in memory. Where libtesseract cannot be
+    loaded, the tesseract program is run for each zone instead.
+
+    The text of each zone is cached by zone_key, so identical zones, such as
+    the same candidate name on many layouts, are only recognized once. At
+    most cache_size texts are kept, least recently used first out.
+
+    workers is the number of worker processes, by default const.ocr_workers
+    or the number of CPUs. With zero workers, or when used from a daemonic
+    process (which may not start a pool of its own, as in main.py's
+    --workers mode), zones are recognized one at a time in this process.
+    """
+    def __init__(self, workers=None, cache_size=4096):
+        self.workers = workers
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits, self.misses = 0, 0
+        self._pool, self._pid = None, None
+
+    def _get_pool(self):
+        if self._pool is not None and self._pid == os.getpid():
+            return self._pool
+        # a pool made before a fork belongs to the parent
+        self._pool, self._pid = None, os.getpid()
+        workers = self.workers
+        if workers is None:
+            workers = getattr(const, "ocr_workers", None)
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if workers > 0 and not multiprocessing.current_process().daemon:
+            self._pool = multiprocessing.Pool(workers)
+        return self._pool
+
+    def start(self):
+        """Start the worker processes now rather than when first needed. The
+        workers are forked, so a process with threads must start them before
+        its threads: a worker forked while another thread holds a lock, such
+        as logging's or metrics', would never see the lock released."""
+        self._get_pool()
+
+    def _remember(self, key, text):
+        self.cache[key] = text
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def __call__(self, zone):
+        "run the tesseract ocr engine on Image zone"
+        return self.map([zone])[0]
+
+    @metrics.timed("ocr")
+    def map(self, zones):
+        """run tesseract on every Image in zones at once, returning the list
+        of their texts in the same order"""
+        keys = [zone_key(zone) for zone in zones]
+        texts, pending = {}, {}
+        for zone, key in zip(zones, keys):
+            if key in texts or key in pending:
+                continue
+            if key in self.cache:
+                #popped so that it goes back in as most recently used
+                texts[key] = self.cache.pop(key)
+                self.hits += 1
+                metrics.count("ocr_zones", cache="hit")
+                continue
+            self.misses += 1
+            metrics.count("ocr_zones", cache="miss")
+            pool = self._get_pool()
+            if pool is None:
+                texts[key] = recognize(zone)
+            else:
+                pending[key] = pool.apply_async(
+                    _tesseract_pixels,
+                    (zone.mode, zone.size, zone.tostring())
+                )
+        for key, result in pending.iteritems():
+            texts[key] = result.get()
+        for key, text in texts.iteritems():
+            self._remember(key, text)
+        log.debug("OCR cache: %d hits, %d misses", self.hits, self.misses)
+        return [texts[key] for key in keys]
+
+    def close(self):
+        "shut down the worker processes, if any"
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.close()
+            self._pool.join()
+        self._pool = None
+
+#the default ocr engine, see Ballot.Extensions
+tesseract_pool = TesseractPool()
+
+class OCRScheduler(object):
+    """Collects the zones that building a layout needs recognized so that
+    they can all be sent to the ocr engine at once, instead of waiting on
+    tesseract for one zone after another.
+
+    add queues a zone along with a function to call with its text, and
+    describe queues a zone whose cleaned text becomes the description of a
+    Contest or Choice. run recognizes everything queued and then calls the
+    functions in the order their zones were added, so a layout can be built
+    with empty descriptions that are all filled in at the end. Where the
+    text decides the shape of the layout, map recognizes a list of zones
+    right away.
+
+    The ocr engine and cleaner are taken from extensions, if given. If the
+    engine has a map method, as TesseractPool does, that is used to run the
+    zones concurrently, otherwise they are run from threads.
+    """
+    def __init__(self, extensions=None, threads=4):
+        self.engine = getattr(extensions, "ocr_engine", tesseract_pool)
+        self.cleaner = getattr(extensions, "ocr_cleaner", clean_ocr_text)
+        self.threads = threads
+        self.queue = []
+
+    def map(self, zones):
+        "return the text of each of zones"
+        if len(zones) == 0:
+            return []
+        try:
+            engine_map = self.engine.map
+        except AttributeError:
+            pool = ThreadPool(min(self.threads, len(zones)))
+            try:
+                return pool.map(self.engine, zones)
+            finally:
+                pool.close()
+        return engine_map(zones)
+
+    def add(self, zone, then):
+        "queue zone, calling then with its text once run"
+        self.queue.append((zone, then))
+
+    def describe(self, node, zone, clean=None):
+        """queue zone, setting the description of node to its text as
+        cleaned by clean, or the cleaner from extensions, once run"""
+        if clean is None:
+            clean = self.cleaner
+        def then(text):
+            node.description = clean(text)
+        self.add(zone, then)
+
+    def run(self):
+        "recognize every queued zone and hand out the results"
+        queue, self.queue = self.queue, []
+        texts = self.map([zone for zone, _ in queue])
+        for (_, then), text in zip(queue, texts):
+            then(text)
+
 #XXX choice of OCR text cleaner should be config
 _scrub = re.compile(r'[^a-zA-Z0-9_ /]+')
 def clean_ocr_text(text):
@@ -0,0 +1,79 @@
+"""prefetch.py decodes the images of the ballots expected next while the
+current ballot is being processed, so that Ballot does not have to wait on
+reading and decompressing each image itself.
+
+The decoded images are handed to a Ballot as a list of (filename, image)
+pairs in place of its list of filenames.
+"""
+import os
+import logging
+from multiprocessing.pool import ThreadPool
+
+import Ballot
+
+__all__ = ['Prefetcher']
+
+def _decode(fname, mode):
+    """Return (fname, image) with image fully read and in mode, or just
+    fname if it could not be read now, leaving Ballot to try again and
+    report the error as usual."""
+    try:
+        return Ballot.open_image(fname, mode)
+    except KeyboardInterrupt:
+        raise
+    except Exception:
+        return fname
+
+class Prefetcher(object):
+    """Decode the images of ballot n and of the ahead ballots after it on
+    threads background threads. names(n) gives the list of image filenames
+    for ballot n, as incomingn does in main.py, and the ballots after n are
+    assumed to be n + step, n + 2*step, .... Images are converted to mode,
+    which should be Ballot.image_mode of the kind of ballot being read.
+
+    get(n) returns the images of ballot n, as a list of names and (name,
+    image) pairs that can be given to Ballot in place of names(n), and
+    starts on the ballots after it. Anything prefetched for a ballot other
+    than the ones expected next is dropped, so skipping around only costs
+    the wasted decodes.
+
+    Image decoding happens mostly outside of the interpreter lock, so
+    threads are enough and nothing has to be copied between processes.
+    """
+    def __init__(self, names, step, ahead=2, threads=2, mode="RGB"):
+        self.names, self.step, self.ahead = names, step, ahead
+        self.mode = mode
+        self.pool = ThreadPool(threads)
+        self.pending = {}
+        self.log = logging.getLogger('')
+
+    def _start(self, n):
+        if n not in self.pending:
+            self.pending[n] = [
+                self.pool.apply_async(_decode, (fname, self.mode))
+                for fname in self.names(n)
+            ]
+
+    def get(self, n):
+        "the images of ballot n, see Prefetcher"
+        self._start(n)
+        jobs = self.pending.pop(n)
+        upcoming = [n + i*self.step for i in range(1, self.ahead + 1)]
+        for m in self.pending.keys():
+            if m not in upcoming:
+                del self.pending[m]
+        # only look ahead once the first image of the ballot is there
+        if os.path.exists(self.names(n)[0]):
+            for m in upcoming:
+                self._start(m)
+        pages = [job.get() for job in jobs]
+        misses = [p for p in pages if isinstance(p, basestring)]
+        if misses:
+            self.log.debug("not prefetched: %s", ", ".join(misses))
+        return pages
+
+    def close(self):
+        "stop the background threads, dropping anything not yet used"
+        self.pending.clear()
+        self.pool.close()
+        self.pool.join()
@@ -0,0 +1,147 @@
+"""profiling.py is the --profile mode of main.py and
+tevsgui_processing_service.py: a cProfile of the analysis of every Nth
+ballot, and a record of how much memory the process holds after each
+ballot, to find out where the time goes and why a long run grows.
+
+The profile of ballot n is written to <directory>/<n>.pstats, to be read
+with pstats or any viewer of cProfile output. Only the thread analyzing the
+ballot is profiled; prefetching and writing behind happen on other threads.
+
+For every ballot the resident set size of the process is appended to
+<directory>/memory<pid>.txt, and for every profiled ballot a census of the
+largest things that stay alive between ballots: images, templates and
+lists of VoteData. Both are taken when the next ballot is started, or the
+profiler closed, once the caller has let go of the ballot, so that they
+do not count the ballot itself; ballots still waiting to be written
+behind are counted. If the resident set size grows by more than growth
+bytes over what it was after the first ballot, and again for each further
+growth bytes, a warning is logged along with the census, which names the
+largest images still alive.
+"""
+import os
+import gc
+import cProfile
+import logging
+import resource
+
+import Image
+import Ballot
+
+__all__ = ['Profiler', 'rss', 'census']
+
+def rss():
+    "the resident set size of this process in bytes"
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, ValueError, IndexError):
+        # the peak, rather than the current size, is all there is elsewhere
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _image_bytes(im):
+    return im.size[0] * im.size[1] * len(im.getbands())
+
+def census(top=5):
+    """Count what is alive in this process that can be large. Returns a dict
+    of the number and bytes of images, the number of templates, the number
+    of lists of VoteData and of VoteData in them, and a list of the top
+    largest images as (bytes, description) pairs, largest first."""
+    images, templates, lists, votes = [], 0, 0, 0
+    for o in gc.get_objects():
+        if isinstance(o, Image.Image):
+            images.append((_image_bytes(o), "%s %dx%d" % ((o.mode,) + o.size)))
+        elif isinstance(o, Ballot.Template):
+            templates += 1
+        elif type(o) is list and o and isinstance(o[0], Ballot.VoteData):
+            lists += 1
+            votes += len(o)
+    images.sort(reverse=True)
+    return {
+        "images": len(images),
+        "image_bytes": sum(b for b, _ in images),
+        "templates": templates,
+        "vote_lists": lists,
+        "votes": votes,
+        "largest": images[:top],
+    }
+
+class Profiler(object):
+    """Profile every every'th ballot into directory and track the memory of
+    this process after each ballot, warning of growth beyond growth bytes.
+    Call start(n) before analyzing ballot n, stop() after, and close() once
+    done."""
+    def __init__(self, directory, every=10, growth=64 << 20, top=5):
+        self.directory = directory
+        self.every = max(1, every)
+        self.growth = growth
+        self.top = top
+        self.log = logging.getLogger('')
+        self.seen = 0
+        self.baseline = None
+        self.warned = 0
+        self.profile = None
+        self.n = None
+        self.pending = None #(ballot, whether profiled) not yet recorded
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.memory = open(os.path.join(directory,
+            "memory%d.txt" % os.getpid()), "a")
+        self.memory.write("# ballot\trss\timages\timage_bytes\ttemplates"
+            "\tvote_lists\tvotes\tlargest\n")
+
+    def start(self, n):
+        "start on ballot n, profiling it if it is an every'th ballot"
+        self._record()
+        self.n = n
+        if self.seen % self.every == 0:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        self.seen += 1
+
+    def stop(self):
+        """finish the ballot given to start, recording its profile; its
+        memory is recorded by the next start or close"""
+        profiled = self.profile is not None
+        if profiled:
+            self.profile.disable()
+            self.profile.dump_stats(
+                os.path.join(self.directory, "%06d.pstats" % self.n))
+            self.profile = None
+        self.pending = self.n, profiled
+
+    def _record(self):
+        "record the memory held after the ballot last stopped, if any"
+        if self.pending is None:
+            return
+        n, profiled = self.pending
+        self.pending = None
+        counted = None
+        if profiled:
+            counted = census(self.top)
+        size = rss()
+        fields = [n, size]
+        if counted is not None:
+            fields += [counted[k] for k in ("images", "image_bytes",
+                "templates", "vote_lists", "votes")]
+            fields.append(", ".join("%s (%d)" % (d, b)
+                for b, d in counted["largest"]))
+        self.memory.write("\t".join(str(f) for f in fields) + "\n")
+        self.memory.flush()
+        if self.baseline is None:
+            self.baseline = size
+        elif size - self.baseline > (self.warned + 1) * self.growth:
+            self.warned = (size - self.baseline) // self.growth
+            if counted is None:
+                counted = census(self.top)
+            self.log.warning("Memory grew from %d MB to %d MB by ballot %s; "
+                "%d images of %d MB, %d templates, %d VoteData; largest: %s",
+                self.baseline >> 20, size >> 20, n, counted["images"],
+                counted["image_bytes"] >> 20, counted["templates"],
+                counted["votes"], ", ".join(d for _, d in counted["largest"]))
+
+    def close(self):
+        self._record()
+        if self.baseline is not None:
+            self.log.info("Memory went from %d MB to %d MB over %d ballots",
+                self.baseline >> 20, rss() >> 20, self.seen)
+        self.memory.close()
@@ -0,0 +1,50 @@
+import os
+import shutil
+import logging
+import pstats
+import tempfile
+import Image #as profiling counts them, not PILB.Image
+import profiling
+
+def census_test():
+    im = Image.new("RGB", (123, 45))
+    counted = profiling.census(top=100)
+    assert counted["images"] >= 1
+    assert counted["image_bytes"] >= 123*45*3
+    assert (123*45*3, "RGB 123x45") in counted["largest"]
+
+class _Warnings(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self, logging.WARNING)
+        self.records = []
+    def emit(self, record):
+        self.records.append(record)
+
+def profiler_test():
+    d = tempfile.mkdtemp()
+    warnings = _Warnings()
+    logging.getLogger('').addHandler(warnings)
+    try:
+        p = profiling.Profiler(d, every=2, growth=1 << 20)
+        kept = []
+        for n in range(0, 8, 2):
+            p.start(n)
+            kept.append(Image.new("L", (2000, 2000)))
+            kept[-1].load()
+            # the ballot itself, let go of once it is done
+            page = Image.new("L", (3000, 1000))
+            p.stop()
+            del page
+        p.close()
+        assert sorted(f for f in os.listdir(d) if f.endswith(".pstats")) == [
+            "000000.pstats", "000004.pstats"]
+        pstats.Stats(os.path.join(d, "000004.pstats"))
+        memory = open(os.path.join(d, "memory%d.txt" % os.getpid()))
+        lines = memory.read().splitlines()[1:]
+        assert [int(l.split("\t")[0]) for l in lines] == [0, 2, 4, 6]
+        assert "L 2000x2000" in lines[2]
+        assert "L 3000x1000" not in lines[2]
+        assert warnings.records
+    finally:
+        logging.getLogger('').removeHandler(warnings)
+        shutil.rmtree(d)
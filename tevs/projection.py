@@ -0,0 +1,115 @@
+"""projection.py computes the projection profiles of the red channel of a
+page image: for a band of columns, the sum and minimum of each row within
+the band, or for a band of rows, the sum and minimum of each column within
+it. Line and landmark searches that used to crop and ImageStat a one pixel
+strip at every position look the positions up in a profile instead, which
+is computed in one pass over the band and kept for later searches.
+
+Profiles are computed for whatever bands are asked for, so any vendor
+module can use them; Ballot.Page keeps one Profiles for its image.
+"""
+import Image
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['Profile', 'Profiles', 'of']
+
+def _red(im):
+    "the red channel of im, as an L image"
+    if im.mode == "L":
+        return im
+    if im.mode != "RGB":
+        im = im.convert("RGB")
+    return im.split()[0]
+
+class Profile(object):
+    """The sums and minimums of the red channel across a band of width
+    pixels, one for each of the length rows (or columns) of the image.
+    Pixels outside of the image count as black, as they do for Image.crop.
+    """
+    def __init__(self, sums, mins, width):
+        self.width = width
+        self.length = len(mins)
+        self.mins = mins
+        self.cumsum = [0]
+        total = 0
+        for s in sums:
+            total += s
+            self.cumsum.append(total)
+
+    def sum(self, a, b=None):
+        "the sum of the red channel over rows a up to b, by default just a"
+        if b is None:
+            b = a + 1
+        clip = lambda i: min(max(i, 0), self.length)
+        return self.cumsum[clip(b)] - self.cumsum[clip(a)]
+
+    def mean(self, a, b=None):
+        """the mean of the red channel over rows a up to b, by default just
+        a, the same as ImageStat.Stat(crop).mean[0] of that part of the band"""
+        if b is None:
+            b = a + 1
+        return self.sum(a, b) / float(self.width * (b - a))
+
+    def min(self, a, b=None):
+        "the darkest red over rows a up to b, by default just a"
+        if b is None:
+            b = a + 1
+        if a < 0 or b > self.length:
+            return 0
+        return min(self.mins[a:b])
+
+def _profile(band, axis):
+    """the Profile of the red channel of band, an image, along its rows if
+    axis is 1 or its columns if axis is 0"""
+    red = _red(band)
+    w, h = red.size
+    if numpy is not None:
+        a = numpy.asarray(red)
+        return Profile(
+            a.sum(axis=axis, dtype=numpy.int64).tolist(),
+            a.min(axis=axis).tolist(),
+            a.shape[axis],
+        )
+    data = list(red.getdata())
+    if axis == 1:
+        lines = [data[y*w:(y + 1)*w] for y in range(h)]
+        width = w
+    else:
+        lines = [data[x::w] for x in range(w)]
+        width = h
+    return Profile([sum(l) for l in lines], [min(l) for l in lines], width)
+
+class Profiles(object):
+    """The projection profiles of image, computed as they are asked for and
+    kept until image is replaced. rows(x0, x1) is the Profile of each row of
+    the band of columns from x0 up to x1; columns(y0, y1) is the Profile of
+    each column of the band of rows from y0 up to y1."""
+    def __init__(self, image):
+        self.image = image
+        self.cache = {}
+
+    def rows(self, x0, x1):
+        "the Profile of each row of image between columns x0 and x1"
+        key = ("rows", x0, x1)
+        if key not in self.cache:
+            band = self.image.crop((x0, 0, x1, self.image.size[1]))
+            self.cache[key] = _profile(band, 1)
+        return self.cache[key]
+
+    def columns(self, y0, y1):
+        "the Profile of each column of image between rows y0 and y1"
+        key = ("columns", y0, y1)
+        if key not in self.cache:
+            band = self.image.crop((0, y0, self.image.size[0], y1))
+            self.cache[key] = _profile(band, 0)
+        return self.cache[key]
+
+def of(image, profiles=None):
+    """profiles if it is the Profiles of image, otherwise new Profiles for
+    image"""
+    if profiles is None or profiles.image is not image:
+        profiles = Profiles(image)
+    return profiles
@@ -0,0 +1,35 @@
+import random
+from util_test import *
+from PILB import Image, ImageStat
+import projection
+
+def _check(im, numpy):
+    saved, projection.numpy = projection.numpy, numpy
+    try:
+        profiles = projection.Profiles(im)
+        #the last band hangs off of the image
+        for x0, x1 in ((0, 30), (4, 11), (25, 35)):
+            rows = profiles.rows(x0, x1)
+            for y0, y1 in ((0, 1), (3, 5), (22, 24)):
+                stat = ImageStat.Stat(im.crop((x0, y0, x1, y1)))
+                assert rows.mean(y0, y1) == stat.mean[0]
+                assert rows.min(y0, y1) == stat.extrema[0][0]
+        for y0, y1 in ((0, 24), (7, 10)):
+            columns = profiles.columns(y0, y1)
+            for x in (0, 13, 29):
+                stat = ImageStat.Stat(im.crop((x, y0, x + 1, y1)))
+                assert columns.sum(x) == stat.sum[0]
+                assert columns.min(x) == stat.extrema[0][0]
+    finally:
+        projection.numpy = saved
+
+def profiles_test():
+    random.seed(0)
+    im = noise(30, 24)
+    _check(im, None)
+    if projection.numpy is not None:
+        _check(im, projection.numpy)
+
+def single_channel_test():
+    random.seed(0)
+    _check(noise(30, 24).split()[0], projection.numpy)
@@ -0,0 +1,57 @@
+"""pyramid.py keeps reduced copies of a page image, so that a landmark search
+can first look over a whole region at low resolution and then only look
+closely where the landmark turned up; see Ballot.Page.locate.
+
+Only the red channel is kept, which is all that landmark searches look at.
+Each level averages blocks of the level below it, so that thin lines fade
+rather than disappear.
+"""
+import Image
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['Pyramid', 'of']
+
+def _red(im):
+    "the red channel of im, as an L image"
+    if im.mode == "L":
+        return im
+    if im.mode != "RGB":
+        im = im.convert("RGB")
+    return im.split()[0]
+
+def _reduce(im, factor):
+    "im reduced by factor, each pixel the mean of a factor by factor block"
+    w, h = max(im.size[0]/factor, 1), max(im.size[1]/factor, 1)
+    if numpy is None or w*factor > im.size[0] or h*factor > im.size[1]:
+        return im.resize((w, h), Image.ANTIALIAS)
+    a = numpy.asarray(im)[:h*factor, :w*factor].reshape(h, factor, w, factor)
+    sums = a.sum(axis=3, dtype=numpy.uint32).sum(axis=1)
+    n = factor*factor
+    return Image.fromarray(((sums + n//2) // n).astype(numpy.uint8), "L")
+
+class Pyramid(object):
+    """Reductions of the red channel of image by each of factors, kept
+    coarsest first, each made from the one below it when first asked for."""
+    def __init__(self, image, factors=(4, 2)):
+        self.image = image
+        self.factors = tuple(sorted(factors, reverse=True))
+        self.levels = {1: image}
+
+    def level(self, factor):
+        "image reduced by factor; level(1) is image itself"
+        if factor not in self.levels:
+            # reduce the coarsest of the finer levels that factor divides
+            base = max([1] + [f for f in self.factors
+                if f < factor and factor % f == 0])
+            self.levels[factor] = _reduce(_red(self.level(base)),
+                factor/base)
+        return self.levels[factor]
+
+def of(image, pyramid=None):
+    "pyramid if it is the Pyramid of image, otherwise a new Pyramid of image"
+    if pyramid is None or pyramid.image is not image:
+        pyramid = Pyramid(image)
+    return pyramid
@@ -0,0 +1,16 @@
+from PILB import Image
+import pyramid
+
+def levels_test():
+    im = Image.new("RGB", (41, 30), "#fff")
+    im.paste((0, 0, 0), (8, 8, 16, 16))
+    p = pyramid.Pyramid(im)
+    assert p.factors == (4, 2)
+    assert p.level(1) is im
+    assert p.level(2).size == (20, 15)
+    assert p.level(4).size == (10, 7)
+    if pyramid.numpy is not None:
+        #a pixel of level 4 is the mean of the sixteen it covers
+        assert p.level(4).getpixel((2, 2)) == 0
+        assert p.level(4).getpixel((1, 1)) == 255
+    assert pyramid.of(im, p) is p
@@ -13,7 +13,7 @@ import Image, ImageStat, ImageDraw, ImageFont
 import Ballot
 import const
 import util
-from ocr import ocr
+import ocr
 from adjust import rotator
 
 
@@ -285,6 +285,8 @@ page offsets (%d,%d) template offsets (%d,%d)" % (
     def build_regions(self, page, tm_list, dpi, stop=True, verbose=False):
         """ Build regions returns a list of Contests found on the page"""
         regionlist = []
+        # the text of every contest and choice is recognized at the end
+        scheduler = ocr.OCRScheduler(self.extensions)
         onethird = int(round(dpi/3.))
         twelfth = int(round(dpi/12.))
         guard_twentieth = int(round(dpi/20.))
@@ -329,37 +331,28 @@ page offsets (%d,%d) template offsets (%d,%d)" % (
                         # The extensions object offers the ability
                         # to provide the ocr and text cleanup functions
                         # of your choice.
-                        text = self.extensions.ocr_engine(crop)
-                        text = self.extensions.ocr_cleaner(text)
-
                         zonestart = 0
                         zoneend = 0
-                        print "Contest Text: %s" % (text, )
-                        regionlist.append(
-                            Ballot.Contest(top_xy[0],
-                                           zonestart,
-                                           column_width,
-                                           dpi,
-                                           0,
-                                           text)
-                            )
+                        contest = Ballot.Contest(top_xy[0],
+                                                 zonestart,
+                                                 column_width,
+                                                 dpi,
+                                                 0,
+                                                 None)
+                        scheduler.describe(contest, crop)
+                        regionlist.append(contest)
                     # get text for ovals only once
                     if match not in matched:
                         #print "-->(not previously matched.)"
-                        croplist = (top_xy[0]+dpi/4, match - (dpi/50),
-                                    top_xy[0]+column_width - dpi/4, match + (dpi/3))
-                        #print croplist
-                        crop = page.image.crop(croplist)
-                        text = self.extensions.ocr_engine(crop)
-                        text = self.extensions.ocr_cleaner(text)
-                        print "Oval (%d, %d): %s" % (top_xy[0],
-                                                    match,
-                                                    text.strip())
                         if len(regionlist)>0:
-                                regionlist[-1].append( 
-                                    #TODO add x2, y2, remove text
-                                    Ballot.Choice(top_xy[0], match, text)
-                                    )
+                                croplist = (top_xy[0]+dpi/4, match - (dpi/50),
+                                            top_xy[0]+column_width - dpi/4, match + (dpi/3))
+                                #print croplist
+                                crop = page.image.crop(croplist)
+                                #TODO add x2, y2, remove text
+                                choice = Ballot.Choice(top_xy[0], match, None)
+                                scheduler.describe(choice, crop)
+                                regionlist[-1].append(choice)
                         # now enter the just matched oval into a list
                         # of already printed ovals
                         matched.append(match)
@@ -373,6 +366,13 @@ page offsets (%d,%d) template offsets (%d,%d)" % (
                     # to become a text zone
                     zoneend = textzone + (dpi/32) + (dpi/16)
                     #print "Textzone at y %d is not associated with an oval." % (textzone, )
+        scheduler.run()
+        for contest in regionlist:
+            print "Contest Text: %s" % (contest.description, )
+            for choice in contest.choices:
+                print "Oval (%d, %d): %s" % (choice.x,
+                                            choice.y,
+                                            choice.description.strip())
         return regionlist
 
     def column_oval_search(self, page, top_x, dpi=300):
@@ -1,17 +1,24 @@
 #!/usr/bin/env python
 
-import sane
 import time
 import sys
 import getopt
 import os
+import random
+import logging
 from string import atoi
 from datetime import datetime
+try:
+    import sane
+except ImportError:
+    sane = None #only VirtualScanner can be used
 
+import Image, ImageDraw
 import const
 import config
 import util
 import next
+import write_behind
 
 # scanloop.py: scan files into the unproc directory tree
 # the -s argument gives the starting number 
@@ -27,6 +34,16 @@ import next
 # Note that when scanning in duplex, you have to start, snap(no cancel), 
 # then start, snap to get the second side
 
+# Images are saved by -w writer threads (default 2, 0 to save each sheet
+# before scanning the next) while the next sheet is scanned, with up to -b
+# sheets (default 8) waiting; only then does scanning wait on the disk.
+# Each image is written under a .part name, synced, and renamed into place,
+# so extraction never sees half of an image.
+
+# With -v <directory>, no scanner is needed: the images in the directory are
+# replayed as sheets fed at --rate sheets per minute, to load test the
+# extraction of what is being scanned.
+
 class ScanningException(Exception):
     pass
 
@@ -84,30 +101,151 @@ class Scanner(object):
             print e
             raise
 
+class VirtualScanner(object):
+    """A stand in for Scanner that replays the images in directory, and
+    any directories under it, in order by name, one sheet of one image, or
+    two if duplex, at a time. Sheets are fed at rate sheets per minute,
+    each up to jitter of the interval early or late, and a fraction faults
+    of them jams once first, costing retry seconds, as a real misfeed
+    costs a restart. Once the images run out the feeder is empty, as for
+    Scanner, unless loop is set, when they are replayed from the start.
+
+    Like the endorser of the real scanner, the counter is printed in the
+    top margin of the first image of each sheet unless endorse is False."""
+    extensions = (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".gif", ".bmp")
+
+    def __init__(self, directory, duplex, rate=100, jitter=0.1, faults=0.0,
+            retry=2, loop=False, endorse=True, seed=None):
+        self.images = sorted(
+            os.path.join(dir, f)
+            for dir, _, files in os.walk(directory)
+            for f in files if os.path.splitext(f)[1].lower() in self.extensions
+        )
+        self.duplex = duplex
+        self.per_sheet = 2 if duplex else 1
+        if len(self.images) < self.per_sheet:
+            raise ScanningException("No ballot images in %s" % directory)
+        self.interval = 60.0 / rate
+        self.jitter, self.faults, self.retry = jitter, faults, retry
+        self.loop, self.endorse = loop, endorse
+        self.random = random.Random(seed)
+        self.next = 0
+        self.due = None
+        self.log = logging.getLogger('')
+
+    def _feed(self):
+        "wait for the next sheet to be due, and for any jam to clear"
+        now = time.time()
+        if self.due is None:
+            self.due = now
+        wobble = self.random.uniform(-self.jitter, self.jitter)
+        delay = self.due + wobble * self.interval - now
+        if delay > 0:
+            time.sleep(delay)
+        # keep to the rate on average, however long each sheet took to use
+        self.due = max(self.due + self.interval, now - self.interval)
+        if self.random.random() < self.faults:
+            self.log.info("Virtual scanner jammed, retrying")
+            time.sleep(self.retry)
+
+    def scan(self, counter):
+        if self.next + self.per_sheet > len(self.images):
+            if not self.loop:
+                raise ScanningException("Out of images to replay")
+            self.next = 0
+        self._feed()
+        names = self.images[self.next:self.next + self.per_sheet]
+        self.next += self.per_sheet
+        imgs = []
+        for name in names:
+            img = Image.open(name)
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            img.load()
+            imgs.append(img)
+        if self.endorse:
+            ImageDraw.Draw(imgs[0]).text((10, 2), "%08ud" % counter,
+                fill=(0, 0, 0))
+        return imgs
+
+def sheet_names(counter, count):
+    "the names in the unproc tree of the count images of sheet counter"
+    names = []
+    for n in range(counter, counter + count):
+        dir = util.root(const.incoming, "%03d" % (n/1000,))
+        names.append(os.path.join(dir, "%06d.jpg" % n))
+    return names
+
+def _part(filename):
+    "the name filename is written under until it is complete"
+    base, ext = os.path.splitext(filename)
+    return base + ".part" + ext
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def save_part(img, filename):
+    "encode img to the part name of filename and sync it to disk"
+    util.mkdirp(os.path.dirname(filename))
+    part = _part(filename)
+    img.save(part)
+    _fsync(part)
+
+def publish(filename):
+    "rename the part saved by save_part to filename, syncing the rename"
+    os.rename(_part(filename), filename)
+    _fsync(os.path.dirname(filename))
+
 def args():
     counter = 0
     duplex = False
     comment = ""
     inches = 11
     resolution = 300
+    virtual = None
+    replay = {}
+    writers, buffer = 2, 8
     try:
         opts, args = getopt.getopt(
             sys.argv[1:], 
-            "s:e:d:l:r:c:",
+            "s:e:d:l:r:c:v:w:b:",
             ["start=",
              "end=",
              "duplex=",
              "length=",
              "resolution=",
-             "comment="
+             "comment=",
+             "writers=",
+             "buffer=",
+             "virtual=",
+             "rate=",
+             "jitter=",
+             "faults=",
+             "loop",
+             "seed="
             ]
         )
     except getopt.GetoptError:
         sys.stderr.write(
             "Usage: scanloop [-s #] [-e #] [-d True|False] [-l <length in inches>] [-r <dpi>][-c <comment>]\n"
+            "       [-w <writer threads>] [-b <sheets buffered>]\n"
+            "       [-v <directory of images to replay> [--rate=<sheets per minute>]\n"
+            "        [--jitter=<fraction>] [--faults=<fraction>] [--loop] [--seed=#]]\n"
         )
         sys.exit(2)
     for opt, arg in opts:
+        if opt in ("-v", "--virtual"):
+            virtual = arg
+        if opt in ("--rate", "--jitter", "--faults"):
+            replay[opt[2:]] = float(arg)
+        if opt == "--loop":
+            replay["loop"] = True
+        if opt == "--seed":
+            replay["seed"] = int(arg)
         if opt in ("-s","--start"):
             counter = int(arg)
         if opt in ("-d","--duplex"):
@@ -118,9 +256,21 @@ def args():
             inches = int(arg)
         if opt in ("-r","--resolution"):
             resolution = int(arg)
-    return counter, duplex, comment, inches, resolution
+        if opt in ("-w","--writers"):
+            writers = max(0, int(arg))
+        if opt in ("-b","--buffer"):
+            buffer = max(1, int(arg))
+    if virtual is not None:
+        replay["directory"] = virtual
+    elif replay:
+        sys.stderr.write("--rate, --jitter, --faults, --loop and --seed "
+            "need -v\n")
+        sys.exit(2)
+    return (counter, duplex, comment, inches, resolution, replay or None,
+        writers, buffer)
 
-def main(counter, duplex, comment, inches, resolution):
+def main(counter, duplex, comment, inches, resolution, virtual=None,
+        writers=2, buffer=8):
     # read configuration from tevs.cfg and set constants for this run
     const.debug = False #XXX
     config.get("tevs.cfg")
@@ -132,29 +282,44 @@ def main(counter, duplex, comment, inches, resolution):
     if duplex:
         inc = 2
     num = next.IncrementingFile(util.root("nexttoscan.txt"), inc)
+    unsaved = [] #sheets through the feeder but not yet saved, by number
+    writer = None
+    if writers > 0:
+        writer = write_behind.WriteBehind(writers, buffer)
     try:
-        scanner = Scanner(
-            duplex,
-            int(inches * inches_to_mm),
-            resolution
-        )
+        if virtual is not None:
+            scanner = VirtualScanner(duplex=duplex, **virtual)
+        else:
+            scanner = Scanner(
+                duplex,
+                int(inches * inches_to_mm),
+                resolution
+            )
 
+        counter = num.value()
         while True:
-            counter = num.value()
             print "Scanning",counter
             stamp = datetime.now().isoformat()
-            for i, img in enumerate(scanner.scan(counter)):
-                #get path
-                n = counter + i
-                p = "%03d" % (n/1000,)
-                f = "%06d" % n
-                dir = util.root(const.incoming, p)
-                util.mkdirp(dir)
-                filename = os.path.join(dir, f + ".jpg")
-                img.save(filename)
-                print "Saved",filename
-                log.info("Saved %s at %s\n%s", filename, stamp, comment)
-            num.increment_and_save()
+            imgs = scanner.scan(counter)
+            unsaved.append(counter)
+            names = sheet_names(counter, len(imgs))
+            def write(imgs=imgs, names=names):
+                for img, filename in zip(imgs, names):
+                    save_part(img, filename)
+            def commit(counter=counter, names=names, stamp=stamp):
+                for filename in names:
+                    publish(filename)
+                    print "Saved",filename
+                    log.info("Saved %s at %s\n%s", filename, stamp, comment)
+                # only now is the sheet safe to leave behind
+                num.increment_and_save()
+                unsaved.remove(counter)
+            if writer is None:
+                write()
+                commit()
+            else:
+                writer.put(write, commit)
+            counter += inc
     except ScanningException:
         print "Empty feeder?"
         log.info("Scan aborted due to empty feeder for 20 seconds.")
@@ -162,6 +327,16 @@ def main(counter, duplex, comment, inches, resolution):
     except KeyboardInterrupt:
         log.info("Scan aborted by user")
         sys.exit(1)
+    finally:
+        # save every sheet already scanned before exiting
+        if writer is not None:
+            writer.close(False)
+            if writer.error is not None:
+                log.error("Could not save scanned images",
+                    exc_info=writer.error)
+        if unsaved:
+            log.error("The sheets starting at images %s were scanned but "
+                "not saved; rescan them", ", ".join(str(n) for n in unsaved))
 
 if __name__ == "__main__":
     main(*args())
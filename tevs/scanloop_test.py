@@ -0,0 +1,48 @@
+import os
+import time
+import shutil
+import tempfile
+from PILB import Image
+import scanloop
+
+def publish_test():
+    d = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(d, "000", "000001.jpg")
+        scanloop.save_part(Image.new("RGB", (20, 10)), filename)
+        assert os.listdir(os.path.join(d, "000")) == ["000001.part.jpg"]
+        scanloop.publish(filename)
+        assert os.listdir(os.path.join(d, "000")) == ["000001.jpg"]
+        assert Image.open(filename).size == (20, 10)
+    finally:
+        shutil.rmtree(d)
+
+def virtual_scanner_test():
+    d = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(d, "000"))
+        for n in range(1, 5):
+            Image.new("L", (200, 100), 255).save(
+                os.path.join(d, "000", "%06d.jpg" % n))
+        scanner = scanloop.VirtualScanner(d, True, rate=600, jitter=0,
+            seed=0)
+        start = time.time()
+        first = scanner.scan(1)
+        second = scanner.scan(3)
+        # 600 sheets per minute is a sheet every tenth of a second
+        assert time.time() - start >= 0.09
+        assert len(first) == len(second) == 2
+        assert first[0].mode == "RGB" and first[0].size == (200, 100)
+        # endorsed on the front only
+        assert first[0].getextrema()[0][0] < 128
+        assert first[1].getextrema()[0][0] > 128
+        try:
+            scanner.scan(5)
+        except scanloop.ScanningException:
+            pass
+        else:
+            assert False, "feeder should be empty"
+        scanner.loop = True
+        assert len(scanner.scan(5)) == 2
+    finally:
+        shutil.rmtree(d)
@@ -346,7 +346,7 @@ def get_text_for_arrow_at(im,x,y,global_dpi):
                     int(topline),
                     int(x),
                     int(bottomline)))
-    text = ocr.tesseract(crop) # XXX self.extensions once in class
+    text = ocr.recognize(crop) # XXX self.extensions once in class
     text = ocr.clean_ocr_text(text)# XXX self.extensions once in class
     choice_topline = int(topline)
     # now repeat process but going up until thicker black; 
@@ -371,7 +371,7 @@ def get_text_for_arrow_at(im,x,y,global_dpi):
                         int(choice_topline ) 
                         )
     crop = im.crop(contest_croplist)
-    contest_text = ocr.tesseract(crop)# XXX self.extensions once in class
+    contest_text = ocr.recognize(crop)# XXX self.extensions once in class
     contest_text = ocr.clean_ocr_text(contest_text)# XXX self.extensions once in class
     text = text.replace("\n"," ").strip()
     contest_text = contest_text.replace("\n"," ").replace(",","").strip()
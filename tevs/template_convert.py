@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+"""Convert saved templates between XML, which TemplateCache saves by
+default, and the binary format it saves with the template_format option
+set to binary, for reading or editing templates by hand.
+
+usage: python template_convert.py xml|binary template_file ...
+
+Each file is rewritten in place in the requested format.
+"""
+import sys
+import os
+import Ballot
+
+def convert(fname, binary):
+    "rewrite the template in fname in the binary or XML format"
+    with open(fname) as f:
+        template = Ballot.Template_from_data(f.read())
+    if binary:
+        data = Ballot.Template_to_binary(template)
+    else:
+        data = Ballot.Template_to_XML(template)
+    tmp = "%s.%d" % (fname, os.getpid())
+    with open(tmp, "w") as f:
+        f.write(data)
+    os.rename(tmp, fname)
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ("xml", "binary"):
+        print >>sys.stderr, __doc__
+        sys.exit(2)
+    binary = sys.argv[1] == "binary"
+    status = 0
+    for fname in sys.argv[2:]:
+        try:
+            convert(fname, binary)
+        except (IOError, ValueError) as e:
+            print >>sys.stderr, "could not convert %s: %s" % (fname, e)
+            status = 1
+    sys.exit(status)
+
+if __name__ == "__main__":
+    main()
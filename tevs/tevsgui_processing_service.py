@@ -16,6 +16,9 @@ import config
 import util
 import db
 import next
+import prefetch
+import composite
+import profiling
 import Ballot
 BallotException = Ballot.BallotException
 
@@ -25,26 +28,6 @@ class FileNotPresentException(Exception):
     def __str__(self):
         return repr(self.value)
 
-def results_to_vop_files(results,resultsfilename):
-    """Save all ovals from a list of Votedata"""
-    for r in results:
-        label = "%s_%04d_%04d_%s_%s.jpg" % (
-            os.path.join(
-                os.path.dirname(resultsfilename),
-                os.path.basename(r.filename[:-4]),
-                ),
-            r.coords[0],
-            r.coords[1],
-            "V" if r.was_voted else "v",
-            "A" if r.ambiguous else "a"
-        )
-        try:
-            if r.image is not None:
-                r.image.save(label)
-        except Exception as e:
-            print e
-
-
 def results_to_CSV(results,log):
     """Save all ovals from a list of Votedata"""
     log.info("About to return joined results")
@@ -68,20 +51,24 @@ def get_args():
     """Get command line arguments"""
     try:
         opts, args = getopt.getopt(sys.argv[1:],
-                                    "tdc:",
+                                    "tdc:p",
                                     ["templates",
                                      "debug",
-                                     "config="
+                                     "config=",
+                                     "profile",
+                                     "profile-every="
                                     ]
                                    ) 
     except getopt.GetoptError:
         #note that logging doesn't exist yet
         sys.stderr.write(
-            "usage: %s -tdc --templates --debug --config=file" % sys.argv[0]
+            "usage: %s -tdcp --templates --debug --config=file "
+            "--profile --profile-every=N" % sys.argv[0]
         )
         sys.exit(2)
     templates_only = False
     debug = False
+    profile, profile_every = False, 10
     config = "tevs.cfg"
     for opt, arg in opts:
         if opt in ("-t", "--templates"):
@@ -90,9 +77,19 @@ def get_args():
             debug = True
         if opt in ("-c", "--config"):
             config = arg
+        if opt in ("-p", "--profile"):
+            profile = True
+        if opt == "--profile-every":
+            try:
+                profile, profile_every = True, max(1, int(arg))
+            except ValueError:
+                sys.stderr.write("--profile-every requires a number\n")
+                sys.exit(2)
 
     const.templates_only = templates_only
     const.debug = debug
+    const.profile = profile
+    const.profile_every = profile_every
     return config
 
 def remove_partial(fname):
@@ -127,25 +124,6 @@ def mark_error(e, *files):
             log.error("Could not copy unprocessable file to errors dir")
     return len(files)
 
-def results_to_vop_files(results,resultsfilename):
-    """Save all ovals from a list of Votedata"""
-    for r in results:
-        label = "%s_%04d_%04d_%s_%s.jpg" % (
-            os.path.join(
-                os.path.dirname(resultsfilename),
-                os.path.basename(r.filename[:-4]),
-                ),
-            r.coords[0],
-            r.coords[1],
-            "V" if r.was_voted else "v",
-            "A" if r.ambiguous else "a"
-        )
-        try:
-            if r.image is not None:
-                r.image.save(label)
-        except Exception as e:
-            print e
-
 def get_processing_command(num):
     retval = None
     while True:
@@ -188,7 +166,8 @@ def main():
                    + const.layout_brand 
                    + ": check " + cfg_file)
 
-    cache = Ballot.TemplateCache(util.root("templates"))
+    cache = Ballot.TemplateCache(util.root("templates"),
+        const.template_cache_size, const.template_format == "binary")
     extensions = Ballot.Extensions(template_cache=cache)
    
     # connect to db and open cursor
@@ -201,14 +180,23 @@ def main():
         dbc = db.NullDB()
     log.info("Database connected.")
 
+    # read the images of the sheet expected next while waiting for the gui
+    prefetcher = None
+    if const.prefetch > 0:
+        prefetcher = prefetch.Prefetcher(
+            lambda n: [incomingn(n + m) for m in range(const.num_pages)],
+            const.num_pages, ahead=const.prefetch, threads=const.prefetch,
+            mode=Ballot.image_mode(ballotfrom))
+
     total_images_processed, total_images_left_unprocessed = 0, 0
     base = os.path.basename
     # Each time given a signal to proceed for count_to_process ballots,
     # create ballot from images, get landmarks, get layout code, get votes.
     # Write votes to database and results directory.  
-    # for profiling
-    # from guppy import hpy;hp=hpy();hp.setref();
-    # import gc;gc.disable();gc.collect();hp.setref()
+    profiler = None
+    if const.profile:
+        profiler = profiling.Profiler(util.root("profile"),
+            const.profile_every)
 
     count_to_process = 0
     while True:
@@ -258,8 +246,13 @@ def main():
             #    (n, "\n".join("\t%s" % base(u) for u in unprocs))
             #)
             log.debug("Creating ballot.")
+            pages = unprocs
+            if prefetcher is not None:
+                pages = prefetcher.get(next_ballot_number)
+            if profiler is not None:
+                profiler.start(next_ballot_number)
             try:
-                ballot = ballotfrom(unprocs, extensions)
+                ballot = ballotfrom(pages, extensions)
                 log.debug("Created ballot, processing." )
                 results = ballot.ProcessPages()
                 log.debug("Processed.")
@@ -267,6 +260,9 @@ def main():
                 total_images_left_unprocessed += mark_error(e, *unprocs)
                 log.exception("Could not process ballot")
                 continue
+            finally:
+                if profiler is not None:
+                    profiler.stop()
 
 
 
@@ -279,7 +275,7 @@ def main():
             for p in (proc1d, resultsd):
                 util.mkdirp(p)
             #try:
-            #    results_to_vop_files(results,resultsfilename)
+            #    vops.save(resultsfilename + ".vops", results)
             #except Exception as e:
             #    log.info(e)
             #    print e
@@ -323,20 +319,18 @@ def main():
             print "%d extracted. " % (next_ballot_number,)
 
             log.info("%d images processed", const.num_pages)
-
-            # for profiling
-            # hp.heap().dump('prof.hpy');hp.setref();gc.collect();
-            # hp.setref();hp.heap().dump('prof.hpy')
         except FileNotPresentException,e:
             print e
             sys.stdout.flush()
+    if prefetcher is not None:
+        prefetcher.close()
+    composite.flush()
     dbc.close()
+    if profiler is not None:
+        profiler.close()
     log.info("%d images processed", total_images_processed)
     if total_images_left_unprocessed > 0:
         log.warning("%d images NOT processed.", total_images_left_unprocessed)
 
 if __name__ == "__main__":
     main()
-    #import cProfile as profile
-    #profile.Profile.bias = 3.15e-6
-    #profile.run('main()', 'prof.%s' % sys.argv[1])
@@ -73,6 +73,13 @@ def rmf(*path):
         log.exception("Could not remove file " + path)
         sys.exit(1)
 
+def red(p):
+    """the red value of p, a pixel from an RGB image, or p itself if it is
+    from a single channel image; see const.single_channel"""
+    if isinstance(p, int):
+        return p
+    return p[0]
+
 def pairs(list):
     """walk through list returning two elements at a time.
      Assumes len(list) is even."""
@@ -2,7 +2,9 @@
 
 import site; site.addsitedir("/home/jimmy/tevs") #XXX
 from Ballot import *
+from PILB import Image
 import logging
+import random
 import sys
 
 class _const(object):
@@ -10,6 +12,15 @@ class _const(object):
 
 sys.modules["const"] = _const()
 
+def noise(w, h):
+    "an RGB image of w by h random pixels"
+    im = Image.new("RGB", (w, h))
+    im.putdata([
+        tuple(random.randint(0, 255) for _ in range(3))
+        for _ in range(w*h)
+    ])
+    return im
+
 def NilXtnz():
     return Extensions(
         transformer=lambda *_: lambda x, y: (x,y),
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+"""Pack the vote op images of a ballot into one file, instead of one JPEG
+per vote op, and read them back one at a time or export them as the
+individual files they used to be.
+
+usage: python vops.py list archive.vops ...
+       python vops.py export archive.vops ... [-d directory]
+
+list prints the index of each archive. export writes every vote op as
+<page>_<x>_<y>_<V|v>_<A|a>.jpg, as they were named when saved one to a file,
+in directory or else beside the archive.
+
+An archive is a header, the JPEG of each vote op one after another, the
+names of the page images, an index of (page, x, y, voted, ambiguous) to the
+offset and length of each JPEG, and a trailer giving where the names and
+index begin, so that a reader only needs the index and the one JPEG it is
+after. All numbers are little endian.
+"""
+import os
+import sys
+import struct
+import getopt
+from collections import namedtuple
+from cStringIO import StringIO
+
+import Image
+
+__all__ = ['Entry', 'Archive', 'save', 'export', 'filename']
+
+_magic = "TEVSVOPS"
+_version = 1
+_header = struct.Struct("<8sH")
+_entry = struct.Struct("<HiiBBQI")
+_trailer = struct.Struct("<QII8s") #index offset, pages, entries, magic
+
+Entry = namedtuple("Entry", "page x y voted ambiguous offset length")
+
+def _flag(v):
+    return 1 if v else 0
+
+def save(path, results):
+    """Write the images of results, a list of VoteData, to the archive path,
+    replacing it all at once. Vote ops without an image are left out; if
+    none have one, nothing is written. Returns the number of images."""
+    pages, entries = [], []
+    tmp = "%s.%d" % (path, os.getpid())
+    f = None
+    try:
+        for r in results:
+            if r.image is None:
+                continue
+            if f is None:
+                f = open(tmp, "wb")
+                f.write(_header.pack(_magic, _version))
+            page = os.path.basename(r.filename or "")
+            if page not in pages:
+                pages.append(page)
+            buf = StringIO()
+            r.image.save(buf, "JPEG")
+            data = buf.getvalue()
+            entries.append(Entry(pages.index(page), r.coords[0], r.coords[1],
+                _flag(r.was_voted), _flag(r.ambiguous), f.tell(), len(data)))
+            f.write(data)
+        if f is None:
+            return 0
+        index = f.tell()
+        for page in pages:
+            f.write(struct.pack("<H", len(page)) + page)
+        for e in entries:
+            f.write(_entry.pack(*e))
+        f.write(_trailer.pack(index, len(pages), len(entries), _magic))
+        f.close()
+        os.rename(tmp, path)
+    except:
+        if f is not None:
+            f.close()
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+        raise
+    return len(entries)
+
+class Archive(object):
+    """The vote op images saved to path by save, read as they are asked for.
+    Iterating yields an Entry for each, in the order they were saved, with
+    page the name of its page image; find looks one up by page, x and y,
+    and image reads it. Raises ValueError if path is not an archive."""
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, "rb")
+        try:
+            self._read_index()
+        except (ValueError, struct.error, IOError):
+            self.f.close()
+            raise ValueError("%s is not a vote op archive" % path)
+
+    def _read_index(self):
+        magic, version = _header.unpack(self.f.read(_header.size))
+        if magic != _magic or version != _version:
+            raise ValueError
+        self.f.seek(-_trailer.size, os.SEEK_END)
+        end = self.f.tell()
+        index, npages, nentries, magic = _trailer.unpack(
+            self.f.read(_trailer.size))
+        if magic != _magic:
+            raise ValueError
+        self.f.seek(index)
+        data = self.f.read(end - index)
+        pages, at = [], 0
+        for _ in range(npages):
+            n, = struct.unpack_from("<H", data, at)
+            pages.append(data[at + 2:at + 2 + n])
+            at += 2 + n
+        self.entries, self.keys = [], {}
+        for _ in range(nentries):
+            e = Entry(*_entry.unpack_from(data, at))
+            e = e._replace(page=pages[e.page], voted=bool(e.voted),
+                ambiguous=bool(e.ambiguous))
+            at += _entry.size
+            self.keys[e.page, e.x, e.y] = len(self.entries)
+            self.entries.append(e)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def find(self, page, x, y):
+        "the Entry of the vote op at x, y of page; raises KeyError if none"
+        return self.entries[self.keys[page, x, y]]
+
+    def data(self, entry):
+        "the JPEG of entry, as saved"
+        self.f.seek(entry.offset)
+        return self.f.read(entry.length)
+
+    def image(self, entry):
+        "the image of entry"
+        im = Image.open(StringIO(self.data(entry)))
+        im.load()
+        return im
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+def filename(entry):
+    "the name entry had when vote ops were saved one to a file"
+    return "%s_%04d_%04d_%s_%s.jpg" % (
+        os.path.splitext(entry.page)[0],
+        entry.x,
+        entry.y,
+        "V" if entry.voted else "v",
+        "A" if entry.ambiguous else "a",
+    )
+
+def export(path, dest=None):
+    """Write every vote op in the archive path to its own file, named by
+    filename, in dest or else the directory of path. Returns the names."""
+    if dest is None:
+        dest = os.path.dirname(path)
+    names = []
+    with Archive(path) as archive:
+        for entry in archive:
+            name = os.path.join(dest, filename(entry))
+            with open(name, "wb") as f:
+                f.write(archive.data(entry))
+            names.append(name)
+    return names
+
+def main():
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "d:")
+    except getopt.GetoptError:
+        args = []
+    if len(args) < 2 or args[0] not in ("list", "export"):
+        print >>sys.stderr, __doc__
+        sys.exit(2)
+    dest = dict(opts).get("-d")
+    status = 0
+    for path in args[1:]:
+        try:
+            if args[0] == "export":
+                for name in export(path, dest):
+                    print name
+                continue
+            with Archive(path) as archive:
+                for e in archive:
+                    print "%s\t%d\t%d\t%s\t%s\t%d\t%d" % (e.page, e.x, e.y,
+                        "V" if e.voted else "v", "A" if e.ambiguous else "a",
+                        e.offset, e.length)
+        except (IOError, ValueError) as e:
+            print >>sys.stderr, "could not read %s: %s" % (path, e)
+            status = 1
+    sys.exit(status)
+
+if __name__ == "__main__":
+    main()
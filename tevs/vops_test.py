@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+from PILB import Image
+import Ballot
+import vops
+
+def _results():
+    results = []
+    for n, (x, y, voted) in enumerate(((10, 20, True), (10, 60, False))):
+        for page in ("000001.jpg", "000002.jpg"):
+            results.append(Ballot.VoteData(
+                filename="/proc/000/" + page,
+                coords=(x, y),
+                image=Image.new("RGB", (30, 20), (255 - 200*voted,) * 3),
+                was_voted=voted,
+                ambiguous=n == 1,
+            ))
+    results.append(Ballot.VoteData(filename="000001.jpg", coords=(0, 0)))
+    return results
+
+def archive_test():
+    d = tempfile.mkdtemp()
+    try:
+        path = os.path.join(d, "000001.vops")
+        assert vops.save(path, _results()) == 4
+        with vops.Archive(path) as archive:
+            assert len(archive) == 4
+            e = archive.find("000002.jpg", 10, 20)
+            assert e.voted and not e.ambiguous
+            im = archive.image(e)
+            assert im.size == (30, 20)
+            assert im.getpixel((15, 10))[0] < 128
+            assert archive.image(archive.find("000001.jpg", 10, 60)
+                ).getpixel((15, 10))[0] > 128
+        names = sorted(os.path.basename(n) for n in vops.export(path))
+        assert names == ["000001_0010_0020_V_a.jpg", "000001_0010_0060_v_A.jpg",
+            "000002_0010_0020_V_a.jpg", "000002_0010_0060_v_A.jpg"]
+        assert Image.open(os.path.join(d, names[0])).size == (30, 20)
+        assert vops.save(os.path.join(d, "none.vops"), _results()[-1:]) == 0
+        assert not os.path.exists(os.path.join(d, "none.vops"))
+    finally:
+        shutil.rmtree(d)
+
+def not_archive_test():
+    f = tempfile.NamedTemporaryFile()
+    f.write("not an archive")
+    f.flush()
+    try:
+        vops.Archive(f.name)
+    except ValueError:
+        pass
+    else:
+        assert False, "should not read"
@@ -0,0 +1,172 @@
+"""watch.py waits for the images of each ballot to arrive in the incoming
+tree, for main.py's --watch mode, so that a ballot is started as soon as
+the scanner has finished writing it rather than on the next poll or the
+next run.
+
+On Linux the directories are watched with inotify, through ctypes so that
+nothing needs to be installed, and an image is complete once it is closed
+after writing or renamed into place. Elsewhere, or if inotify cannot be
+used, the directories are polled and an image is complete once it has not
+changed for settle seconds. An image last changed before its directory was
+watched, or before inotify lost events, is likewise complete once it is
+settle seconds old.
+"""
+import os
+import time
+import errno
+import select
+import struct
+import logging
+import ctypes
+import ctypes.util
+
+__all__ = ['Watcher']
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+
+_event = struct.Struct("iIII") #wd, mask, cookie, len; then len bytes of name
+
+class _Inotify(object):
+    "the few parts of inotify(7) that Watcher uses"
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add = libc.inotify_add_watch
+        self.fd = libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        self.dirs = {} #wd -> directory
+
+    def add(self, path, mask):
+        "watch path for mask; raises OSError if path cannot be watched"
+        wd = self._add(self.fd, path, mask)
+        if wd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e), path)
+        self.dirs[wd] = path
+
+    def read(self, timeout):
+        """the (mask, path) of each event within timeout seconds; mask has
+        IN_Q_OVERFLOW if events were lost"""
+        try:
+            if not select.select([self.fd], [], [], timeout)[0]:
+                return []
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return [] #a signal, perhaps to stop
+        data = os.read(self.fd, 64 * 1024)
+        events, i = [], 0
+        while i + _event.size <= len(data):
+            wd, mask, _, length = _event.unpack_from(data, i)
+            i += _event.size
+            name = data[i:i + length].rstrip("\0")
+            i += length
+            if wd in self.dirs:
+                events.append((mask, os.path.join(self.dirs[wd], name)))
+            elif mask & IN_Q_OVERFLOW:
+                events.append((mask, None))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class Watcher(object):
+    """Wait for the images of ballots, named by names(n) as incomingn does
+    in main.py, to be completely written. wait(n) blocks until every image
+    of ballot n is complete or stop is called, checking for stop every poll
+    seconds. inotify is used unless use_inotify is False or it fails."""
+    def __init__(self, names, settle=1.0, poll=0.25, use_inotify=True):
+        self.names = names
+        self.settle, self.poll = settle, poll
+        self.log = logging.getLogger('')
+        self.stopped = False
+        self.closed = set() #images closed or moved in, not yet asked for
+        self.watched = set()
+        self.since = {} #directory -> time from which no event has been lost
+        self.inotify = None
+        if use_inotify:
+            try:
+                self.inotify = _Inotify()
+            except (OSError, AttributeError) as e:
+                # no inotify on this system; AttributeError from ctypes
+                self.log.info("Polling for images, no inotify: %s", e)
+
+    def stop(self):
+        "make wait return False as soon as it notices, as from a signal"
+        self.stopped = True
+
+    def _settled(self, name):
+        """whether image name has not changed for settle seconds and, with
+        inotify, its last change could have gone unseen"""
+        try:
+            mtime = os.stat(name).st_mtime
+        except OSError:
+            return False
+        if self.inotify is not None:
+            since = self.since.get(os.path.dirname(name))
+            if since is None or mtime >= since:
+                return False #its closing will be seen
+        return time.time() - mtime >= self.settle
+
+    def _watch(self, directory):
+        """Watch directory for images being finished, or if it does not exist
+        yet, its parent for directory being created."""
+        if self.inotify is None or directory in self.watched:
+            return
+        try:
+            self.inotify.add(directory, IN_CLOSE_WRITE | IN_MOVED_TO)
+            self.watched.add(directory)
+            self.since[directory] = time.time()
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            parent = os.path.dirname(directory)
+            if parent not in self.watched:
+                self.inotify.add(parent, IN_CREATE | IN_MOVED_TO)
+                self.watched.add(parent)
+
+    def _events(self):
+        "wait up to poll seconds, noting images finished in the meantime"
+        if self.inotify is None:
+            time.sleep(self.poll)
+            return
+        for mask, path in self.inotify.read(self.poll):
+            if mask & IN_Q_OVERFLOW:
+                # events were lost; fall back on settling for what is there
+                self.log.warning("inotify queue overflowed")
+                now = time.time()
+                for directory in self.since:
+                    self.since[directory] = now
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                self.closed.add(path)
+
+    def wait(self, n):
+        """Block until every image of ballot n is complete, returning True,
+        or until stop is called, returning False."""
+        pending = list(self.names(n))
+        # forget images since renamed or removed, as part files and the
+        # images of processed ballots are, so that closed only holds what is
+        # still waiting to be asked for
+        for name in list(self.closed):
+            if not os.path.exists(name):
+                self.closed.discard(name)
+        while not self.stopped:
+            # watch before looking so that nothing finished in between is lost
+            for directory in set(os.path.dirname(name) for name in pending):
+                self._watch(directory)
+            for name in pending[:]:
+                if name in self.closed or self._settled(name):
+                    self.closed.discard(name)
+                    pending.remove(name)
+            if not pending:
+                return True
+            self._events()
+        return False
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
@@ -0,0 +1,107 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+import watch
+
+def _arrive(d, use_inotify):
+    names = lambda n: [os.path.join(d, "%03d" % (n/1000), "%06d.jpg" % (n + m))
+        for m in range(2)]
+    w = watch.Watcher(names, settle=0.5, poll=0.05, use_inotify=use_inotify)
+    def scan():
+        time.sleep(0.1)
+        os.mkdir(os.path.join(d, "000"))
+        for name in names(1):
+            f = open(name, "w")
+            f.write("not done")
+            time.sleep(0.2)
+            f.write(" done")
+            f.close()
+    t = threading.Thread(target=scan)
+    t.start()
+    try:
+        start = time.time()
+        assert w.wait(1)
+        assert all(os.path.getsize(name) == 13 for name in names(1))
+        if w.inotify is not None:
+            # the second image is seen as soon as it is closed
+            assert time.time() - start < 0.9
+        threading.Timer(0.1, w.stop).start()
+        assert not w.wait(3)
+    finally:
+        t.join()
+        w.close()
+
+def inotify_test():
+    d = tempfile.mkdtemp()
+    try:
+        _arrive(d, True)
+    finally:
+        shutil.rmtree(d)
+
+def polling_test():
+    d = tempfile.mkdtemp()
+    try:
+        _arrive(d, False)
+    finally:
+        shutil.rmtree(d)
+
+def stall_test():
+    d = tempfile.mkdtemp()
+    names = lambda n: [os.path.join(d, "%06d.jpg" % (n + m)) for m in range(2)]
+    w = watch.Watcher(names, settle=0.2, poll=0.05)
+    try:
+        if w.inotify is None:
+            return
+        # scanned before watching began
+        old = names(1)[0]
+        open(old, "w").write("done")
+        os.utime(old, (time.time() - 10,) * 2)
+        def scan():
+            time.sleep(0.1)
+            f = open(names(1)[1], "w")
+            f.write("not done")
+            f.flush()
+            time.sleep(0.6) #a scanner stalled mid-image
+            f.write(" done")
+            f.close()
+        t = threading.Thread(target=scan)
+        t.start()
+        try:
+            assert w.wait(1)
+            assert os.path.getsize(names(1)[1]) == 13
+        finally:
+            t.join()
+    finally:
+        w.close()
+        shutil.rmtree(d)
+
+def forget_test():
+    d = tempfile.mkdtemp()
+    names = lambda n: [os.path.join(d, "%06d.jpg" % n)]
+    w = watch.Watcher(names, settle=0.2, poll=0.05)
+    try:
+        if w.inotify is None:
+            return
+        def scan():
+            for n in (1, 2):
+                time.sleep(0.1)
+                # written under a part name and renamed into place
+                part = os.path.join(d, "%06d.part.jpg" % n)
+                open(part, "w").write("done")
+                os.rename(part, names(n)[0])
+        t = threading.Thread(target=scan)
+        t.start()
+        try:
+            assert w.wait(1)
+            os.unlink(names(1)[0]) #processed, as main.py moves it to proc
+            assert w.wait(2)
+        finally:
+            t.join()
+        w.stop()
+        assert not w.wait(3)
+        assert not w.closed
+    finally:
+        w.close()
+        shutil.rmtree(d)
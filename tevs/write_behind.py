@@ -0,0 +1,109 @@
+"""write_behind.py lets the persistence of one ballot (saving vote op images
+and results files, inserting into the database, moving images from unproc to
+proc) proceed in the background while the next ballot is being analyzed.
+
+Each ballot is handed over as a pair of functions: write, which saves files
+and may run at the same time as the writes of other ballots, and commit,
+which records the ballot as done. Commits are run one at a time, in the
+order the ballots were handed over, and only after that ballot's write has
+finished, so a ballot is never moved to proc before its votes are in the
+database and ballots are never committed out of order.
+"""
+import sys
+import threading
+import Queue
+import logging
+
+__all__ = ['WriteBehind']
+
+class WriteBehind(object):
+    """A bounded write behind queue with threads writers and one committer.
+
+    put blocks once depth ballots are waiting to be committed, so that
+    analysis cannot get arbitrarily far ahead of the disk and database.
+
+    If a write or commit fails, or exits via util.fatal, nothing more is
+    committed and the error is raised again in the caller's thread by the
+    next put or by close. Ballots that were not committed are left for the
+    caller to retry, exactly as if processing had stopped there.
+    """
+    def __init__(self, threads=2, depth=4):
+        self.log = logging.getLogger('')
+        self.writes = Queue.Queue()
+        self.commits = Queue.Queue()
+        self.slots = threading.BoundedSemaphore(depth)
+        self.error = None #until it has been raised in the caller
+        self.failed = False #for good, once anything has failed
+        self.closed = False
+        self.writers = [
+            threading.Thread(target=self._write_loop, name="writer%d" % i)
+            for i in range(threads)
+        ]
+        self.committer = threading.Thread(
+            target=self._commit_loop,
+            name="committer"
+        )
+        for t in self.writers + [self.committer]:
+            t.daemon = True
+            t.start()
+
+    def _fail(self):
+        if not self.failed:
+            self.error = sys.exc_info()
+            self.failed = True
+
+    def _write_loop(self):
+        while True:
+            job = self.writes.get()
+            if job is None:
+                return
+            write, done = job
+            try:
+                if not self.failed:
+                    write()
+            except BaseException:
+                self._fail()
+            done.set()
+
+    def _commit_loop(self):
+        while True:
+            job = self.commits.get()
+            if job is None:
+                return
+            done, commit = job
+            done.wait()
+            try:
+                if not self.failed:
+                    commit()
+            except BaseException:
+                self._fail()
+            self.slots.release()
+
+    def _raise(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error[0], error[1], error[2]
+
+    def put(self, write, commit):
+        """hand over a ballot's write and commit functions, blocking while
+        the queue is full"""
+        self._raise()
+        self.slots.acquire()
+        done = threading.Event()
+        self.writes.put((write, done))
+        self.commits.put((done, commit))
+
+    def close(self, reraise=True):
+        """wait for every ballot handed over to be written and committed.
+        Calling close again does nothing but raise any error not yet raised,
+        unless reraise is False."""
+        if not self.closed:
+            self.closed = True
+            for _ in self.writers:
+                self.writes.put(None)
+            for t in self.writers:
+                t.join()
+            self.commits.put(None)
+            self.committer.join()
+        if reraise:
+            self._raise()
@@ -0,0 +1,38 @@
+import time
+import threading
+import write_behind
+
+def failure_test():
+    w = write_behind.WriteBehind(threads=2, depth=4)
+    committed = []
+    fail, later = threading.Event(), threading.Event()
+    def write(n):
+        def f():
+            if n == 1:
+                fail.wait()
+                raise IOError("disk full")
+            if n == 2:
+                later.wait()
+        return f
+    def commit(n):
+        return lambda: committed.append(n)
+    w.put(write(0), commit(0))
+    while not committed:
+        time.sleep(.01)
+    for n in (1, 2):
+        w.put(write(n), commit(n))
+    fail.set()
+    while not w.failed:
+        time.sleep(.01)
+    # raised once, in the caller, while 2 is still being written
+    try:
+        w.put(write(3), commit(3))
+    except IOError:
+        pass
+    else:
+        assert False, "the failed write was not raised"
+    later.set()
+    w.close(False)
+    w.close()
+    # nothing after the failure is committed, even once it has been raised
+    assert committed == [0]